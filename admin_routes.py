@@ -1,9 +1,22 @@
+import queue
+from datetime import datetime
+
 from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.security import generate_password_hash
 
 from app import app, db, admin_required
 from models import User, Canteen, Window, Dish, Review, ReviewReply, Like
+from ai_service import get_classification_cache, get_classifier_status, get_model_status, reload_classifier, \
+    resolve_model_path
+from dish_index import refresh_dish_in_index, remove_dish_from_index
+from rating_aggregates import rating_snapshot, apply_rating_change, delete_reviews, create_stats, delete_stats, \
+    move_dish_stats
+from rating_stats import get_rating_stats
+from review_counters import remove_user_likes, remove_user_replies
+from leaderboards import invalidate_after_commit
+from dish_embeddings import get_embedding_index, get_embedding_job_store, submit_embedding_rebuild, \
+    update_dish_embeddings, remove_dish_embeddings
 
 
 # ================== 管理员用户管理接口 ==================
@@ -129,9 +142,9 @@ def admin_delete_user(user_id):
             return jsonify({'code': 404, 'message': '用户不存在'}), 404
         
         # 删除用户相关的数据
-        Review.query.filter_by(user_id=user_id).delete()
-        ReviewReply.query.filter_by(user_id=user_id).delete()
-        Like.query.filter_by(user_id=user_id).delete()
+        delete_reviews(Review.user_id == user_id)
+        remove_user_replies(user_id)
+        remove_user_likes(user_id)
         
         db.session.delete(user)
         db.session.commit()
@@ -188,6 +201,8 @@ def admin_create_canteen():
         )
         
         db.session.add(canteen)
+        db.session.flush()
+        create_stats('canteen', canteen.canteen_id)
         db.session.commit()
         
         return jsonify({
@@ -253,6 +268,8 @@ def admin_update_canteen(canteen_id):
                 images = [images] if images else []
             canteen.images = images
         
+        # 排行榜中显示食堂名称
+        invalidate_after_commit()
         db.session.commit()
         
         return jsonify({
@@ -288,6 +305,7 @@ def admin_delete_canteen(canteen_id):
         if canteen.windows:
             return jsonify({'code': 400, 'message': '该食堂下还有窗口，无法删除'}), 400
         
+        delete_stats('canteen', canteen_id)
         db.session.delete(canteen)
         db.session.commit()
         
@@ -346,6 +364,8 @@ def admin_create_window():
         )
         
         db.session.add(window)
+        db.session.flush()
+        create_stats('window', window.window_id)
         db.session.commit()
         
         return jsonify({
@@ -407,6 +427,8 @@ def admin_update_window(window_id):
                 images = [images] if images else []
             window.images = images
         
+        # 排行榜中显示窗口名称
+        invalidate_after_commit()
         db.session.commit()
         
         return jsonify({
@@ -441,6 +463,7 @@ def admin_delete_window(window_id):
         if window.dishes:
             return jsonify({'code': 400, 'message': '该窗口下还有菜品，无法删除'}), 400
         
+        delete_stats('window', window_id)
         db.session.delete(window)
         db.session.commit()
         
@@ -506,7 +529,11 @@ def admin_create_dish():
         )
         
         db.session.add(dish)
+        db.session.flush()
+        create_stats('dish', dish.dish_id)
         db.session.commit()
+        refresh_dish_in_index(dish)
+        update_dish_embeddings(dish)
         
         return jsonify({
             'code': 200,
@@ -544,19 +571,33 @@ def admin_update_dish(dish_id):
         if not data:
             return jsonify({'code': 400, 'message': '请求数据不能为空'}), 400
         
+        # 换窗口：检查目标窗口是否存在
+        window_id = dish.window_id
+        if data.get('window_id') is not None:
+            window = Window.query.get(data['window_id'])
+            if not window:
+                return jsonify({'code': 404, 'message': '窗口不存在'}), 404
+            window_id = window.window_id
+        
+        # 检查目标窗口下名称是否重复（排除自己）
+        name = data['name'].strip() if 'name' in data else ''
+        if window_id != dish.window_id or name:
+            existing = Dish.query.filter(
+                Dish.window_id == window_id,
+                Dish.name == (name or dish.name),
+                Dish.dish_id != dish_id
+            ).first()
+            if existing:
+                return jsonify({'code': 400, 'message': '该窗口下菜品名称已存在'}), 400
+        
         # 更新字段
-        if 'name' in data:
-            name = data['name'].strip()
-            if name:
-                # 检查同一窗口下名称是否重复（排除自己）
-                existing = Dish.query.filter(
-                    Dish.window_id == dish.window_id,
-                    Dish.name == name,
-                    Dish.dish_id != dish_id
-                ).first()
-                if existing:
-                    return jsonify({'code': 400, 'message': '该窗口下菜品名称已存在'}), 400
-                dish.name = name
+        if name:
+            dish.name = name
+        
+        if window_id != dish.window_id:
+            old_window_id = dish.window_id
+            dish.window_id = window_id
+            move_dish_stats(dish.dish_id, old_window_id, window_id)
         
         if 'price' in data:
             price = data['price']
@@ -578,7 +619,12 @@ def admin_update_dish(dish_id):
         if 'is_available' in data:
             dish.is_available = bool(data['is_available'])
         
+        # 名称、分类等变化后排行榜重新计算
+        invalidate_after_commit()
         db.session.commit()
+        refresh_dish_in_index(dish)
+        if 'images' in data:
+            update_dish_embeddings(dish)
         
         return jsonify({
             'code': 200,
@@ -611,10 +657,13 @@ def admin_delete_dish(dish_id):
             return jsonify({'code': 404, 'message': '菜品不存在'}), 404
         
         # 删除菜品相关的数据
-        Review.query.filter_by(dish_id=dish_id).delete()
+        delete_reviews(Review.dish_id == dish_id)
+        delete_stats('dish', dish_id)
         
         db.session.delete(dish)
         db.session.commit()
+        remove_dish_from_index(dish_id)
+        remove_dish_embeddings(dish_id)
         
         return jsonify({
             'code': 200,
@@ -675,7 +724,7 @@ def admin_get_reviews():
                 'content': review.content,
                 'images': review.images,
                 'like_count': review.like_count,
-                'reply_count': review.reply_count,
+                'reply_count': review.reply_count or 0,
                 'created_at': review.created_at.isoformat()
             })
         
@@ -711,6 +760,7 @@ def admin_delete_review(review_id):
         Like.query.filter_by(review_id=review_id).delete()
         
         db.session.delete(review)
+        apply_rating_change(review.dish_id, old=rating_snapshot(review), created_at=review.created_at)
         db.session.commit()
         
         return jsonify({
@@ -731,7 +781,8 @@ def admin_delete_review(review_id):
 def admin_get_detailed_stats():
     """管理员获取详细统计数据"""
     try:
-        # 基础统计
+        # 基础统计（评价数和平均分一次扫描评价表得到）
+        rating_stats = get_rating_stats()
         stats = {
             'user_count': User.query.count(),
             'admin_count': User.query.filter_by(role='admin').count(),
@@ -739,14 +790,12 @@ def admin_get_detailed_stats():
             'window_count': Window.query.count(),
             'dish_count': Dish.query.count(),
             'available_dish_count': Dish.query.filter_by(is_available=True).count(),
-            'review_count': Review.query.count(),
+            'review_count': rating_stats.total_count,
             'reply_count': ReviewReply.query.count(),
             'like_count': Like.query.count()
         }
         
-        # 评分统计
-        avg_rating = db.session.query(db.func.avg(Review.overall_rating)).scalar()
-        stats['average_rating'] = round(float(avg_rating), 2) if avg_rating else 0.0
+        stats['average_rating'] = rating_stats.get_average('overall', digits=2)
         
         # 各食堂统计
         canteen_stats = []
@@ -770,3 +819,185 @@ def admin_get_detailed_stats():
         
     except Exception as e:
         return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
+
+
+# ================== 管理员AI识别接口 ==================
+
+@app.route('/api/admin/ai/status', methods=['GET'])
+@jwt_required()
+@admin_required
+def admin_get_ai_status():
+    """管理员查看AI识别服务运行状态"""
+    try:
+        return jsonify({
+            'code': 200,
+            'data': get_classifier_status()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
+
+
+@app.route('/api/admin/ai/cache', methods=['GET'])
+@jwt_required()
+@admin_required
+def admin_get_ai_cache_stats():
+    """管理员查看AI识别结果缓存统计"""
+    try:
+        cache = get_classification_cache()
+        stats = cache.get_stats() if cache else {}
+        stats['enabled'] = cache is not None
+        
+        return jsonify({
+            'code': 200,
+            'data': stats
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
+
+
+@app.route('/api/admin/ai/cache', methods=['DELETE'])
+@jwt_required()
+@admin_required
+def admin_clear_ai_cache():
+    """管理员清空AI识别结果缓存"""
+    try:
+        cache = get_classification_cache()
+        if cache:
+            cache.clear()
+        
+        return jsonify({
+            'code': 200,
+            'message': '缓存已清空'
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
+
+
+@app.route('/api/admin/ai/embeddings', methods=['GET'])
+@jwt_required()
+@admin_required
+def admin_get_embedding_stats():
+    """管理员查看菜品图片特征索引统计"""
+    try:
+        return jsonify({
+            'code': 200,
+            'data': get_embedding_index().get_stats()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
+
+
+@app.route('/api/admin/ai/embeddings/rebuild', methods=['POST'])
+@jwt_required()
+@admin_required
+def admin_rebuild_embeddings():
+    """
+    管理员重建菜品图片特征索引
+    默认只为尚未收录的图片提取特征；full=true 时清空后全部重新提取。
+    重建在后台任务中执行，立即返回 202 和 job_id，通过 GET /api/admin/ai/embeddings/jobs/<job_id> 查看进度；
+    已有重建任务在排队或执行时返回该任务
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            job_id, submitted = submit_embedding_rebuild(rebuild=bool(data.get('full', False)))
+        except queue.Full:
+            response = jsonify({'code': 503, 'message': '特征任务队列已满，请稍后重试'})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        
+        job = get_embedding_job_store().get(job_id)
+        return jsonify({
+            'code': 202,
+            'message': '重建任务已提交' if submitted else '已有重建任务正在进行',
+            'data': {
+                'job_id': job_id,
+                'status': job['status'] if job else 'queued'
+            }
+        }), 202
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
+
+
+@app.route('/api/admin/ai/embeddings/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+@admin_required
+def admin_get_embedding_job(job_id):
+    """
+    管理员查询特征任务（重建索引、菜品图片特征更新）
+    status 为 queued / running / done / failed，重建任务 done 时 result 为索引统计，另含新增的图片数 added
+    """
+    try:
+        job = get_embedding_job_store().get(job_id)
+        if not job:
+            return jsonify({'code': 404, 'message': '任务不存在或已过期'}), 404
+        
+        return jsonify({
+            'code': 200,
+            'data': {
+                'job_id': job['job_id'],
+                'status': job['status'],
+                'created_at': datetime.utcfromtimestamp(job['created_at']).isoformat(),
+                'finished_at': (datetime.utcfromtimestamp(job['finished_at']).isoformat()
+                                if job['finished_at'] else None),
+                'result': job['result'],
+                'error': job['error']
+            }
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
+
+
+@app.route('/api/admin/ai/model', methods=['GET'])
+@jwt_required()
+@admin_required
+def admin_get_ai_model():
+    """管理员查看当前使用的AI识别模型版本和最近一次热更新的状态"""
+    try:
+        return jsonify({
+            'code': 200,
+            'data': get_model_status()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
+
+
+@app.route('/api/admin/ai/model/reload', methods=['POST'])
+@jwt_required()
+@admin_required
+def admin_reload_ai_model():
+    """
+    管理员热更新AI识别模型
+    可选参数 model_path：新的权重文件（.pth），必须位于模型目录（resnet_classifier/ 或 RESNET_MODEL_PATH 所在目录）中，
+    相对路径按 RESNET_MODEL_PATH 所在目录解析；默认重新加载 resnet_classifier/model.pth。
+    新模型在后台加载并预热，完成后新请求切换到新模型，正在处理的请求仍由旧模型完成；
+    通过 GET /api/admin/ai/model 查看加载进度
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        model_path = data.get('model_path')
+        if model_path is not None:
+            if not isinstance(model_path, str) or not model_path.endswith(('.pth', '.pt')):
+                return jsonify({'code': 400, 'message': '模型文件必须是 .pth 或 .pt 文件'}), 400
+            model_path = resolve_model_path(model_path)
+            if model_path is None:
+                return jsonify({'code': 400, 'message': '模型文件不存在或不在模型目录中'}), 400
+        
+        if not reload_classifier(model_path):
+            return jsonify({'code': 409, 'message': '已有模型正在加载，请稍后再试'}), 409
+        
+        return jsonify({
+            'code': 202,
+            'message': '新模型正在后台加载',
+            'data': get_model_status()
+        }), 202
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
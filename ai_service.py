@@ -0,0 +1,576 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI菜品识别服务
+根据应用配置组装进程内共享的识别器，供各个路由使用
+"""
+
+import os
+import threading
+import time
+
+from app import app
+
+_dish_classifier = None
+_dish_classifier_lock = threading.Lock()
+
+_classification_cache = None
+_classification_cache_lock = threading.Lock()
+
+_job_store = None
+_job_store_lock = threading.Lock()
+
+_admission_controller = None
+_admission_controller_lock = threading.Lock()
+
+# 启动预热状态：disabled（未开启预热）/ pending / warming / ready / failed
+# 开启 CLASSIFIER_WARMUP 但预热线程还没有启动时按 pending 处理（见 get_warmup_state）
+_warmup_state = {'status': 'disabled', 'error': None, 'started_at': None, 'duration': None}
+_warmup_thread = None
+
+# 模型热更新状态：idle / loading / ready / failed
+_reload_state = {'status': 'idle', 'version': None, 'previous_version': None, 'model_path': None, 'error': None,
+                 'started_at': None, 'duration': None}
+_reload_lock = threading.Lock()
+_model_watch_thread = None
+
+
+def resolve_upload_path(reference):
+    """
+    把 /api/upload 返回的文件名或地址（/api/uploads/<filename>，可带域名）转换为 UPLOAD_FOLDER 中的文件路径
+    Returns:
+        str 或 None（不是本站上传的文件，或文件不存在）
+    """
+    from urllib.parse import urlparse
+    from werkzeug.utils import secure_filename
+
+    path = urlparse(reference or '').path
+    if '/' in path:
+        prefix, _, filename = path.rpartition('/')
+        if not prefix.endswith('/api/uploads'):
+            return None
+    else:
+        filename = path
+
+    # 只接受 save_uploaded_file 生成的普通文件名，防止路径穿越
+    if not filename or secure_filename(filename) != filename:
+        return None
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    return file_path if os.path.isfile(file_path) else None
+
+
+def resolve_model_path(model_path):
+    """
+    把热更新指定的权重文件转换为模型目录（resnet_classifier/ 或 RESNET_MODEL_PATH 所在目录）中的绝对路径，
+    相对路径按 RESNET_MODEL_PATH 所在目录解析，符号链接和 .. 展开后再检查
+    Returns:
+        str 或 None（不在模型目录中，或文件不存在）
+    """
+    from resnet_classifier.resnet_predict import MODEL_DIRS, MODEL_PATH
+
+    path = os.path.realpath(os.path.join(os.path.dirname(os.path.abspath(MODEL_PATH)), model_path))
+    for directory in MODEL_DIRS:
+        directory = os.path.realpath(directory)
+        if os.path.commonpath([path, directory]) == directory:
+            return path if os.path.isfile(path) else None
+    return None
+
+
+def get_base_classifier():
+    """获取进程内共享的识别器本体（按配置选择推理模式和线程数）"""
+    from resnet_classifier.resnet_predict import get_classifier
+    return get_classifier(
+        mode=app.config.get('CLASSIFIER_INFERENCE_MODE', 'fp32'),
+        num_threads=app.config.get('CLASSIFIER_NUM_THREADS', 0),
+        calibration_dir=app.config.get('CLASSIFIER_CALIBRATION_DIR')
+    )
+
+
+def _create_backend(classifier):
+    """
+    按配置为识别器创建调度后端
+    CLASSIFIER_WORKERS > 0 时返回推理进程池；否则开启 CLASSIFIER_BATCHING 时返回微批处理队列，
+    都不开启时直接返回识别器
+    """
+    if app.config.get('CLASSIFIER_WORKERS', 0) > 0:
+        from resnet_classifier.worker_pool import InferenceWorkerPool
+        try:
+            return InferenceWorkerPool(
+                classifier,
+                num_workers=app.config.get('CLASSIFIER_WORKERS'),
+                threads_per_worker=app.config.get('CLASSIFIER_WORKER_THREADS', 1),
+                pin_cpus=app.config.get('CLASSIFIER_WORKER_PIN_CPUS', False),
+                timeout=app.config.get('CLASSIFIER_WORKER_TIMEOUT', 30)
+            )
+        except RuntimeError as e:
+            app.logger.warning(f'推理进程池启动失败，改为在请求线程中推理: {e}')
+    elif app.config.get('CLASSIFIER_BATCHING', True):
+        from resnet_classifier.batching import BatchingClassifier
+        return BatchingClassifier(
+            classifier,
+            max_batch_size=app.config.get('CLASSIFIER_MAX_BATCH_SIZE', 16),
+            max_wait_ms=app.config.get('CLASSIFIER_MAX_WAIT_MS', 10)
+        )
+    return classifier
+
+
+def get_batch_backend():
+    """
+    批量识别和特征提取使用的后端：开启推理进程池时交给进程池在子进程中执行，
+    否则直接使用识别器本体（批量请求本身已是一个批次，不经过微批处理队列）
+    """
+    from resnet_classifier.worker_pool import InferenceWorkerPool
+    if app.config.get('CLASSIFIER_WORKERS', 0) > 0:
+        backend = get_dish_classifier()
+        if isinstance(backend, InferenceWorkerPool):
+            return backend
+    return get_base_classifier()
+
+
+def get_dish_classifier():
+    """
+    获取进程内共享的AI菜品识别器（延迟导入，避免未安装PyTorch时影响其他接口）
+    返回的调度后端见 _create_backend；模型热更新后返回基于新模型的后端
+    """
+    global _dish_classifier
+    if _dish_classifier is None:
+        with _dish_classifier_lock:
+            if _dish_classifier is None:
+                _dish_classifier = _create_backend(get_base_classifier())
+    return _dish_classifier
+
+
+def _classifier_version(backend):
+    """调度后端（或识别器本身）所用模型的版本"""
+    return getattr(backend, 'classifier', backend).version
+
+
+def get_classifier_status():
+    """获取AI识别服务运行状态（推理模式、调度方式及其统计），模型尚未加载时只返回配置"""
+    status = {
+        'loaded': _dish_classifier is not None,
+        'mode': app.config.get('CLASSIFIER_INFERENCE_MODE', 'fp32'),
+        'warmup': get_warmup_state(),
+        'model': get_model_status()
+    }
+    if _dish_classifier is None:
+        return status
+
+    from resnet_classifier.batching import BatchingClassifier
+    from resnet_classifier.worker_pool import InferenceWorkerPool
+
+    if isinstance(_dish_classifier, InferenceWorkerPool):
+        status['backend'] = 'worker_pool'
+    elif isinstance(_dish_classifier, BatchingClassifier):
+        status['backend'] = 'batching'
+    else:
+        status['backend'] = 'direct'
+
+    if hasattr(_dish_classifier, 'get_stats'):
+        status['stats'] = _dish_classifier.get_stats()
+    if _job_store is not None:
+        status['jobs'] = _job_store.get_stats()
+    if _admission_controller is not None:
+        status['admission'] = _admission_controller.get_stats()
+    return status
+
+
+def get_warmup_batch_sizes():
+    """预热使用的批大小：单张请求，以及微批处理和批量识别接口配置的最大批次"""
+    sizes = {1, app.config.get('CLASSIFIER_MAX_BATCH_IMAGES', 16)}
+    if app.config.get('CLASSIFIER_WORKERS', 0) <= 0 and app.config.get('CLASSIFIER_BATCHING', True):
+        sizes.add(app.config.get('CLASSIFIER_MAX_BATCH_SIZE', 16))
+    return sorted(sizes)
+
+
+def _warm_up_model(classifier):
+    """用空白图片按配置的批大小各跑几次前向计算"""
+    from PIL import Image
+
+    rounds = max(1, app.config.get('CLASSIFIER_WARMUP_ROUNDS', 2))
+    dummy = classifier.preprocess(Image.new('RGB', (640, 480), (128, 128, 128)))
+    for batch_size in get_warmup_batch_sizes():
+        batch = dummy.unsqueeze(0).expand(batch_size, -1, -1, -1).contiguous()
+        for _ in range(rounds):
+            classifier.predict_tensors(batch)
+
+
+def _warm_up_backend(backend, classifier):
+    """调度后端（微批处理线程、推理子进程）完整走一遍识别流程"""
+    from PIL import Image
+
+    if backend is not classifier:
+        result = backend.predict(Image.new('RGB', (640, 480), (128, 128, 128)))
+        if 'error' in result:
+            raise RuntimeError(result['error'])
+
+
+def warm_up_classifier():
+    """
+    预热AI识别器：加载模型权重，用空白图片按配置的批大小各跑几次前向计算，
+    让内存缓冲区和 oneDNN 算子在第一个真实请求到来之前分配、编译完成
+    """
+    _warmup_state.update(status='warming', error=None, started_at=time.time(), duration=None)
+    start = time.perf_counter()
+    try:
+        classifier = get_base_classifier()
+        _warm_up_model(classifier)
+
+        # 基础识别器预热完成后再创建调度后端；推理子进程由 spawn 启动，各自加载模型，不受父进程线程状态影响
+        _warm_up_backend(get_dish_classifier(), classifier)
+
+        _warmup_state.update(status='ready', duration=round(time.perf_counter() - start, 3))
+        app.logger.info(f'AI识别模型预热完成，耗时 {_warmup_state["duration"]} 秒')
+    except Exception as e:
+        _warmup_state.update(status='failed', error=str(e), duration=round(time.perf_counter() - start, 3))
+        app.logger.error(f'AI识别模型预热失败: {e}')
+
+
+def start_warmup():
+    """在后台线程中预热AI识别器，不阻塞服务启动"""
+    global _warmup_thread
+    if _warmup_thread is not None:
+        return _warmup_thread
+    _warmup_state.update(status='pending')
+    _warmup_thread = threading.Thread(target=warm_up_classifier, name='dish-classifier-warmup', daemon=True)
+    _warmup_thread.start()
+    return _warmup_thread
+
+
+def get_warmup_state():
+    """当前预热状态；开启 CLASSIFIER_WARMUP 时，预热线程启动之前也是 pending（未就绪），而不是 disabled"""
+    state = dict(_warmup_state)
+    if state['status'] == 'disabled' and app.config.get('CLASSIFIER_WARMUP', False):
+        state['status'] = 'pending'
+    return state
+
+
+def get_readiness():
+    """
+    AI识别服务是否可以接收流量
+    开启预热时需等待预热完成；未开启预热时模型按需加载，始终视为就绪
+    Returns:
+        tuple: (是否就绪, 预热状态)
+    """
+    state = get_warmup_state()
+    return state['status'] in ('disabled', 'ready'), state
+
+
+def _retire_backend(backend):
+    """
+    模型热更新后关闭旧的调度后端
+    等待 CLASSIFIER_MODEL_DRAIN_SECONDS 秒，让已经拿到旧后端的请求先完成推理
+    """
+    if not hasattr(backend, 'close'):
+        return
+    timer = threading.Timer(app.config.get('CLASSIFIER_MODEL_DRAIN_SECONDS', 30), backend.close)
+    timer.daemon = True
+    timer.start()
+
+
+def _load_and_swap_model(model_path):
+    """后台线程：加载新模型并预热，完成后原子替换当前识别器和调度后端"""
+    from resnet_classifier.resnet_predict import DishClassifier, get_loaded_classifier, set_classifier
+
+    global _dish_classifier
+    start = time.perf_counter()
+    backend = None
+    try:
+        classifier = DishClassifier(
+            model_path=model_path,
+            mode=app.config.get('CLASSIFIER_INFERENCE_MODE', 'fp32'),
+            num_threads=app.config.get('CLASSIFIER_NUM_THREADS', 0),
+            calibration_dir=app.config.get('CLASSIFIER_CALIBRATION_DIR')
+        )
+        _reload_state['version'] = classifier.version
+        _warm_up_model(classifier)
+        backend = _create_backend(classifier)
+        _warm_up_backend(backend, classifier)
+
+        # 新请求从这里开始使用新模型；已经拿到旧后端的请求继续用旧模型完成
+        with _dish_classifier_lock:
+            previous_backend = _dish_classifier
+            previous = set_classifier(classifier)
+            _dish_classifier = backend
+        if previous_backend is not None and previous_backend is not previous:
+            _retire_backend(previous_backend)
+
+        _reload_state.update(status='ready', previous_version=previous.version if previous else None,
+                             duration=round(time.perf_counter() - start, 3))
+        app.logger.info(f'AI识别模型已切换到版本 {classifier.version}，耗时 {_reload_state["duration"]} 秒')
+    except Exception as e:
+        if backend is not None and backend is not _dish_classifier and hasattr(backend, 'close'):
+            backend.close()
+        loaded = get_loaded_classifier()
+        _reload_state.update(status='failed', error=str(e), duration=round(time.perf_counter() - start, 3))
+        app.logger.error(f'AI识别模型加载失败，继续使用版本 {loaded.version if loaded else None}: {e}')
+
+
+def reload_classifier(model_path=None):
+    """
+    热更新AI识别模型：在后台线程加载新的权重文件并预热，完成后原子替换当前识别器，
+    加载和预热期间仍由旧模型处理请求，服务不需要重启
+    Args:
+        model_path: 新的权重文件，默认重新加载 RESNET_MODEL_PATH（resnet_classifier/model.pth）
+    Returns:
+        bool: 是否开始加载，已有加载任务在进行时返回 False
+    """
+    from resnet_classifier.resnet_predict import MODEL_PATH
+
+    with _reload_lock:
+        if _reload_state['status'] == 'loading':
+            return False
+        _reload_state.update(status='loading', version=None, previous_version=None, model_path=model_path or MODEL_PATH,
+                             error=None, started_at=time.time(), duration=None)
+    threading.Thread(target=_load_and_swap_model, args=(model_path or MODEL_PATH,), name='dish-classifier-reload',
+                     daemon=True).start()
+    return True
+
+
+def get_model_status():
+    """当前使用的模型版本和最近一次热更新的状态"""
+    from resnet_classifier.resnet_predict import get_loaded_classifier
+
+    classifier = get_loaded_classifier()
+    return {
+        'version': classifier.version if classifier else None,
+        'model_path': classifier.model_path if classifier else None,
+        'watch': _model_watch_thread is not None,
+        'reload': dict(_reload_state)
+    }
+
+
+def _watch_model_file(interval):
+    """
+    轮询模型文件，文件版本变化并且连续两次检查保持不变（文件已写完）后自动热更新
+    """
+    from resnet_classifier.resnet_predict import MODEL_PATH, model_file_version
+
+    def current_version():
+        try:
+            return model_file_version(MODEL_PATH)
+        except OSError:
+            return None
+
+    loaded_version = current_version()
+    seen_version = loaded_version
+    while True:
+        time.sleep(interval)
+        version = current_version()
+        if version != seen_version:
+            # 文件可能还在复制中，等下一次检查确认不再变化
+            seen_version = version
+            continue
+        if version is None or version == loaded_version:
+            continue
+        app.logger.info(f'检测到模型文件更新（版本 {version}），开始热更新')
+        if reload_classifier(MODEL_PATH):
+            loaded_version = version
+
+
+def start_model_watch():
+    """在后台线程中监视模型文件（CLASSIFIER_MODEL_WATCH），被替换后自动热更新"""
+    global _model_watch_thread
+    if _model_watch_thread is not None:
+        return _model_watch_thread
+    _model_watch_thread = threading.Thread(
+        target=_watch_model_file,
+        args=(max(1, app.config.get('CLASSIFIER_MODEL_WATCH_INTERVAL', 10)),),
+        name='dish-classifier-model-watch',
+        daemon=True
+    )
+    _model_watch_thread.start()
+    return _model_watch_thread
+
+
+def classify_image_batch(images, top_k=1, deadline=None):
+    """
+    一次识别多张图片（本身已是一个批次，不经过微批处理队列；开启推理进程池时在子进程中执行）
+    与单张识别共用推理准入控制，整个批次按图片数占用推理名额
+    Args:
+        images: 图片路径或类文件对象列表
+        top_k: 每张图片返回的候选类别数
+        deadline: 必须开始推理的最晚时刻（get_request_deadline），None 表示一直排队等待
+    Returns:
+        list: 与输入顺序一致的识别结果，成功的结果附带所用模型版本 'model_version'
+    Raises:
+        AdmissionRejected: 无法在截止时间前开始推理
+    """
+    if not images:
+        return []
+    backend = get_batch_backend()
+    max_workers = app.config.get('CLASSIFIER_PREPROCESS_WORKERS', 4)
+    admission = get_admission_controller()
+    if admission is None:
+        results = backend.predict_batch(images, top_k=top_k, max_workers=max_workers)
+    else:
+        with admission.admit(deadline, weight=len(images)):
+            results = backend.predict_batch(images, top_k=top_k, max_workers=max_workers)
+    version = _classifier_version(backend)
+    for result in results:
+        if 'error' not in result:
+            result['model_version'] = version
+    return results
+
+
+def get_classification_cache():
+    """
+    获取进程内共享的识别结果缓存
+    未开启 CLASSIFIER_CACHE 时返回 None
+    """
+    global _classification_cache
+    if not app.config.get('CLASSIFIER_CACHE', True):
+        return None
+    if _classification_cache is None:
+        with _classification_cache_lock:
+            if _classification_cache is None:
+                from resnet_classifier.result_cache import ClassificationCache
+                _classification_cache = ClassificationCache(
+                    max_size=app.config.get('CLASSIFIER_CACHE_SIZE', 1024),
+                    ttl=app.config.get('CLASSIFIER_CACHE_TTL', 3600),
+                    max_distance=app.config.get('CLASSIFIER_CACHE_MAX_DISTANCE', 4)
+                )
+    return _classification_cache
+
+
+def get_admission_controller():
+    """
+    获取进程内共享的推理准入控制
+    CLASSIFIER_MAX_CONCURRENT 为 0 时返回 None（不限制）
+    """
+    global _admission_controller
+    if app.config.get('CLASSIFIER_MAX_CONCURRENT', 16) <= 0:
+        return None
+    if _admission_controller is None:
+        with _admission_controller_lock:
+            if _admission_controller is None:
+                from resnet_classifier.admission import AdmissionController
+                _admission_controller = AdmissionController(
+                    max_concurrent=app.config.get('CLASSIFIER_MAX_CONCURRENT', 16),
+                    max_queue=app.config.get('CLASSIFIER_MAX_QUEUE', 32)
+                )
+    return _admission_controller
+
+
+def get_request_deadline(timeout_ms=None):
+    """
+    计算识别请求的截止时间（time.monotonic() 时刻）
+    Args:
+        timeout_ms: 客户端给出的时限（毫秒），只能比 CLASSIFIER_REQUEST_DEADLINE_MS 更短
+    """
+    limit = app.config.get('CLASSIFIER_REQUEST_DEADLINE_MS', 5000)
+    if timeout_ms is not None and timeout_ms > 0:
+        limit = min(limit, timeout_ms)
+    return time.monotonic() + limit / 1000.0
+
+
+def _predict_admitted(classifier, image, top_k, deadline):
+    """取得推理名额后再执行推理，排不上队时抛出 AdmissionRejected"""
+    admission = get_admission_controller()
+    if admission is None:
+        return classifier.predict(image, top_k=top_k)
+    with admission.admit(deadline):
+        return classifier.predict(image, top_k=top_k)
+
+
+def classify_image_data(image_data, deadline=None):
+    """
+    识别内存中的图片（上传的原始字节），优先使用结果缓存
+    先按字节哈希精确匹配，再按感知哈希匹配近似重复的图片，都未命中才执行推理。
+    结果包含前 CLASSIFIER_TOP_K 个候选类别（'top_k'），缓存中的条目也按同样的候选数存储；
+    成功的结果附带所用模型版本 'model_version'，模型热更新后缓存随之清空。
+    缓存未命中时需先取得推理名额（见 get_admission_controller），deadline 前排不上的请求被拒绝
+    Args:
+        image_data: 图片的原始字节
+        deadline: 必须开始推理的最晚时刻（get_request_deadline），None 表示一直排队等待
+    Returns:
+        tuple: (识别结果, 是否命中缓存)
+    Raises:
+        AdmissionRejected: 无法在截止时间前开始推理
+    """
+    # 整个请求固定使用同一个调度后端，期间发生模型热更新也不会混用新旧模型
+    classifier = get_dish_classifier()
+    version = _classifier_version(classifier)
+    top_k = max(1, app.config.get('CLASSIFIER_TOP_K', 3))
+    cache = get_classification_cache()
+    if cache is None:
+        result = _predict_admitted(classifier, image_data, top_k, deadline)
+        if 'error' not in result:
+            result['model_version'] = version
+        return result, False
+
+    from resnet_classifier.resnet_predict import load_image
+    from resnet_classifier.result_cache import bytes_digest, perceptual_hash
+
+    cache.check_model_version(version)
+
+    digest = bytes_digest(image_data)
+    result = cache.get_by_digest(digest)
+    if result is not None:
+        return result, True
+
+    img = load_image(image_data)
+    phash = perceptual_hash(img)
+    result = cache.get(phash, digest)
+    if result is not None:
+        return result, True
+
+    result = _predict_admitted(classifier, img, top_k, deadline)
+    if 'error' not in result:
+        result['model_version'] = version
+        cache.put(phash, result, digest)
+    return result, False
+
+
+def build_classification_data(result, cached):
+    """
+    把识别结果整理为接口响应数据，附带各候选类别匹配的菜品
+    Args:
+        result: classify_image_data 返回的识别结果（不含 'error'）
+        cached: 是否命中缓存
+    """
+    from dish_index import get_matching_dishes
+
+    # 从菜品名称索引中查找各候选类别对应的菜品，客户端无需再按名称搜索
+    candidates = result.get('top_k', [result])
+    matches = get_matching_dishes([c['name'] for c in candidates])
+    return {
+        'dish_name': result['name'],
+        'confidence': round(result.get('confidence', 0) * 100, 2),  # 置信度转换为百分比
+        'cached': cached,
+        'model_version': result.get('model_version'),
+        'candidates': [
+            {
+                'dish_name': c['name'],
+                'confidence': round(c['confidence'] * 100, 2),
+                'dishes': matches.get(c['name'], [])
+            }
+            for c in candidates
+        ]
+    }
+
+
+def _run_classification_job(image_data):
+    """异步识别任务：在后台线程中识别图片，识别失败时抛出异常由任务队列记录为 failed"""
+    with app.app_context():
+        result, cached = classify_image_data(image_data)
+        if 'error' in result:
+            raise RuntimeError(f'AI识别失败: {result["error"]}')
+        return build_classification_data(result, cached)
+
+
+def get_job_store():
+    """获取进程内共享的异步识别任务队列"""
+    global _job_store
+    if _job_store is None:
+        with _job_store_lock:
+            if _job_store is None:
+                from resnet_classifier.jobs import ClassificationJobStore
+                _job_store = ClassificationJobStore(
+                    _run_classification_job,
+                    num_workers=app.config.get('CLASSIFIER_JOB_WORKERS', 2),
+                    max_queue=app.config.get('CLASSIFIER_JOB_QUEUE_SIZE', 100),
+                    max_jobs=app.config.get('CLASSIFIER_JOB_MAX_JOBS', 1000),
+                    ttl=app.config.get('CLASSIFIER_JOB_TTL', 600)
+                )
+    return _job_store
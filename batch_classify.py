@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+历史图片离线批量识别
+从数据库中流式读取 Review.images 和 Dish.images 引用的图片，多线程并行解码预处理，
+按批次执行推理，把识别结果写入 image_classifications 表。
+
+每个批次写入后立即提交，已写入的结果就是断点：重新运行时按来源ID从上次的位置继续，
+跳过当前模型版本下已经识别过的图片。
+"""
+
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from app import db
+from models import Dish, Review, ImageClassification
+from ai_service import get_base_classifier, resolve_upload_path
+
+SOURCES = {
+    'review': (Review, Review.review_id),
+    'dish': (Dish, Dish.dish_id),
+}
+
+
+def iter_source_images(source_type, start_id=0, chunk_size=500):
+    """
+    按ID顺序流式读取某类来源中引用的图片
+    按主键分段查询（每段 chunk_size 行），不长时间占用数据库游标，批次提交不会打断读取
+    Yields:
+        tuple: (来源ID, 图片地址)
+    """
+    model, id_column = SOURCES[source_type]
+    last_id = start_id - 1
+    while True:
+        rows = db.session.query(id_column, model._images_text)\
+                         .filter(id_column > last_id, model._images_text.isnot(None))\
+                         .order_by(id_column)\
+                         .limit(chunk_size)\
+                         .all()
+        if not rows:
+            return
+
+        for source_id, images_text in rows:
+            try:
+                images = json.loads(images_text)
+            except (json.JSONDecodeError, TypeError):
+                continue
+            if not isinstance(images, list):
+                continue
+            for image in dict.fromkeys(images):
+                if image and isinstance(image, str):
+                    yield source_id, image
+        last_id = rows[-1][0]
+
+
+def get_resume_point(source_type, model_version, full_scan=False):
+    """
+    断点：当前模型版本下已写入结果的最大来源ID，以及需要跳过的已识别图片
+    同一条评价的多张图片可能被拆到两个批次中，因此从这条评价重新开始，并跳过其中已识别的图片；
+    full_scan 时从头扫描，跳过所有已识别的图片（用于重试失败的图片）
+    Returns:
+        tuple: (起始来源ID, {(来源ID, 图片地址), ...})
+    """
+    query = db.session.query(ImageClassification.source_id, ImageClassification.image).filter(
+        ImageClassification.source_type == source_type,
+        ImageClassification.model_version == model_version
+    )
+    if full_scan:
+        return 0, set(query.all())
+
+    last_id = db.session.query(db.func.max(ImageClassification.source_id)).filter(
+        ImageClassification.source_type == source_type,
+        ImageClassification.model_version == model_version
+    ).scalar()
+    if last_id is None:
+        return 0, set()
+    return last_id, set(query.filter(ImageClassification.source_id == last_id).all())
+
+
+def load_images(items, classifier, workers, prefetch):
+    """
+    并行加载器：用线程池解码和预处理图片，最多提前加载 prefetch 张，保持输入顺序
+    Yields:
+        tuple: (来源ID, 图片地址, 张量或异常)
+    """
+    def load(image):
+        path = resolve_upload_path(image)
+        if path is None:
+            return FileNotFoundError('图片文件不存在或不是本站上传的图片')
+        try:
+            return classifier.preprocess(path)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = deque()
+        for source_id, image in items:
+            pending.append((source_id, image, pool.submit(load, image)))
+            if len(pending) >= prefetch:
+                source_id, image, future = pending.popleft()
+                yield source_id, image, future.result()
+        while pending:
+            source_id, image, future = pending.popleft()
+            yield source_id, image, future.result()
+
+
+class ProgressReporter:
+    """每隔 interval 秒输出一次进度和吞吐量"""
+
+    def __init__(self, interval=5.0, output=print):
+        self.interval = interval
+        self.output = output
+        self.processed = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self._last_report = self.started
+
+    def update(self, processed, errors):
+        self.processed += processed
+        self.errors += errors
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.output(self.summary())
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        return f'已处理 {self.processed} 张图片（失败 {self.errors} 张），{rate:.1f} 张/秒，耗时 {elapsed:.0f} 秒'
+
+
+def classify_source(source_type, batch_size=32, workers=4, top_k=3, limit=0, full_scan=False, reporter=None):
+    """
+    识别某类来源中尚未识别的全部图片
+    Returns:
+        int: 本次处理的图片数
+    """
+    import torch
+
+    classifier = get_base_classifier()
+    start_id, done = get_resume_point(source_type, classifier.version, full_scan)
+    items = (item for item in iter_source_images(source_type, start_id) if item not in done)
+
+    processed = 0
+    batch = []
+
+    def flush():
+        valid = [(source_id, image, tensor) for source_id, image, tensor in batch
+                 if not isinstance(tensor, Exception)]
+        predictions = iter(classifier.predict_tensors(torch.stack([t for _, _, t in valid]), top_k=top_k)
+                           if valid else [])
+
+        rows = []
+        for source_id, image, tensor in batch:
+            row = ImageClassification(source_type=source_type, source_id=source_id, image=image,
+                                      model_version=classifier.version)
+            if isinstance(tensor, Exception):
+                row.status = 'error'
+                row.error = str(tensor)[:255]
+            else:
+                prediction = next(predictions)
+                row.dish_name = prediction['name']
+                row.confidence = prediction['confidence']
+                row.top_k = prediction.get('top_k', [prediction])
+            rows.append(row)
+
+        # 每个批次单独提交，中断后已提交的结果不会丢失
+        db.session.add_all(rows)
+        db.session.commit()
+        if reporter:
+            reporter.update(len(rows), sum(1 for row in rows if row.status == 'error'))
+        return len(rows)
+
+    for item in load_images(items, classifier, workers, prefetch=batch_size * 2):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            processed += flush()
+            batch = []
+            if limit and processed >= limit:
+                return processed
+    if batch:
+        processed += flush()
+    return processed
+
+
+def run_batch_classification(source_types=('review', 'dish'), batch_size=32, workers=4, top_k=3, limit=0,
+                             retry_errors=False, report_interval=5.0, output=print):
+    """
+    离线批量识别入口
+    Args:
+        retry_errors: 删除识别失败的记录后从头扫描，重新识别这些图片
+    Returns:
+        dict: {来源类型: 处理的图片数}
+    """
+    db.create_all()
+
+    if retry_errors:
+        deleted = ImageClassification.query.filter(
+            ImageClassification.source_type.in_(source_types),
+            ImageClassification.model_version == get_base_classifier().version,
+            ImageClassification.status == 'error'
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        output(f'已删除 {deleted} 条识别失败的记录，重新识别')
+
+    reporter = ProgressReporter(report_interval, output)
+    result = {}
+    for source_type in source_types:
+        output(f'开始识别 {source_type} 图片...')
+        result[source_type] = classify_source(source_type, batch_size=batch_size, workers=workers, top_k=top_k,
+                                              limit=limit, full_scan=retry_errors, reporter=reporter)
+    output(reporter.summary())
+    return result
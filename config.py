@@ -23,6 +23,75 @@ class Config:
     # 数据库配置
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///canteen_score.db'
     
+    # AI识别推理配置
+    CLASSIFIER_INFERENCE_MODE = os.environ.get('CLASSIFIER_INFERENCE_MODE') or 'fp32'  # fp32 / torchscript / int8-dynamic / int8
+    CLASSIFIER_NUM_THREADS = int(os.environ.get('CLASSIFIER_NUM_THREADS') or 0)  # 算子内并行线程数，0为PyTorch默认
+    CLASSIFIER_CALIBRATION_DIR = os.environ.get('CLASSIFIER_CALIBRATION_DIR')  # int8静态量化校准图片目录
+    
+    # AI识别结果匹配菜品配置
+    CLASSIFIER_TOP_K = int(os.environ.get('CLASSIFIER_TOP_K') or 3)  # 单张识别返回的候选类别数
+    CLASSIFIER_MATCH_LIMIT = int(os.environ.get('CLASSIFIER_MATCH_LIMIT') or 5)  # 每个候选类别最多返回的匹配菜品数
+    DISH_INDEX_REBUILD_INTERVAL = int(os.environ.get('DISH_INDEX_REBUILD_INTERVAL') or 30)  # 类别->菜品名称索引全量重建的间隔(秒)，即其他worker进程的菜品变更最久多久后可见，0为不重建（仅限单进程部署）
+
+    # 菜品图片特征索引配置（相似菜品查询）
+    CLASSIFIER_EMBEDDINGS = os.environ.get('CLASSIFIER_EMBEDDINGS', 'true').lower() == 'true'  # 菜品图片变化时自动提取特征
+    CLASSIFIER_EMBEDDING_DIR = os.environ.get('CLASSIFIER_EMBEDDING_DIR') or 'instance/embeddings'  # 特征矩阵存放目录
+
+    # AI识别批处理配置
+    CLASSIFIER_BATCHING = os.environ.get('CLASSIFIER_BATCHING', 'true').lower() == 'true'
+    CLASSIFIER_MAX_BATCH_SIZE = int(os.environ.get('CLASSIFIER_MAX_BATCH_SIZE') or 16)  # 单批最多图片数
+    CLASSIFIER_MAX_WAIT_MS = float(os.environ.get('CLASSIFIER_MAX_WAIT_MS') or 10)  # 凑批最长等待时间(毫秒)
+    CLASSIFIER_MAX_BATCH_IMAGES = int(os.environ.get('CLASSIFIER_MAX_BATCH_IMAGES') or 16)  # 批量识别接口单次最多图片数
+    CLASSIFIER_PREPROCESS_WORKERS = int(os.environ.get('CLASSIFIER_PREPROCESS_WORKERS') or 4)  # 批量识别并行预处理线程数
+    
+    # AI识别推理进程池配置（大于0时启用，替代请求线程内推理和微批处理，子进程由 spawn 启动并各自加载模型）
+    CLASSIFIER_WORKERS = int(os.environ.get('CLASSIFIER_WORKERS') or 0)  # 推理子进程数
+    CLASSIFIER_WORKER_THREADS = int(os.environ.get('CLASSIFIER_WORKER_THREADS') or 1)  # 每个子进程的PyTorch线程数
+    CLASSIFIER_WORKER_PIN_CPUS = os.environ.get('CLASSIFIER_WORKER_PIN_CPUS', 'false').lower() == 'true'  # 子进程绑定CPU核
+    CLASSIFIER_WORKER_TIMEOUT = int(os.environ.get('CLASSIFIER_WORKER_TIMEOUT') or 30)  # 单次推理超时(秒)
+    
+    # AI识别异步任务配置
+    CLASSIFIER_JOB_WORKERS = int(os.environ.get('CLASSIFIER_JOB_WORKERS') or 2)  # 后台识别线程数
+    CLASSIFIER_JOB_QUEUE_SIZE = int(os.environ.get('CLASSIFIER_JOB_QUEUE_SIZE') or 100)  # 等待队列最大长度
+    CLASSIFIER_JOB_MAX_JOBS = int(os.environ.get('CLASSIFIER_JOB_MAX_JOBS') or 1000)  # 任务表最多保存的任务数
+    CLASSIFIER_JOB_TTL = int(os.environ.get('CLASSIFIER_JOB_TTL') or 600)  # 任务完成后结果保留时间(秒)
+    CLASSIFIER_JOB_MAX_WAIT = int(os.environ.get('CLASSIFIER_JOB_MAX_WAIT') or 30)  # 长轮询最长等待时间(秒)
+
+    # AI识别准入控制配置（推理排不上队时立即返回503，而不是让请求无限堆积）
+    CLASSIFIER_MAX_CONCURRENT = int(os.environ.get('CLASSIFIER_MAX_CONCURRENT') or 16)  # 同时推理的请求数上限，0为不限制
+    CLASSIFIER_MAX_QUEUE = int(os.environ.get('CLASSIFIER_MAX_QUEUE') or 32)  # 等待推理的请求数上限
+    CLASSIFIER_REQUEST_DEADLINE_MS = int(os.environ.get('CLASSIFIER_REQUEST_DEADLINE_MS') or 5000)  # 请求必须开始推理的时限(毫秒)
+
+    # AI识别启动预热配置（启动时在后台线程加载模型并用空白图片跑几个批次）
+    CLASSIFIER_WARMUP = os.environ.get('CLASSIFIER_WARMUP', 'false').lower() == 'true'
+    CLASSIFIER_WARMUP_ROUNDS = int(os.environ.get('CLASSIFIER_WARMUP_ROUNDS') or 2)  # 每种批大小的预热次数
+
+    # AI识别模型热更新配置（替换模型文件后在后台加载、预热，再切换到新模型，不需要重启服务）
+    CLASSIFIER_MODEL_WATCH = os.environ.get('CLASSIFIER_MODEL_WATCH', 'false').lower() == 'true'  # 监视模型文件，更新后自动加载
+    CLASSIFIER_MODEL_WATCH_INTERVAL = int(os.environ.get('CLASSIFIER_MODEL_WATCH_INTERVAL') or 10)  # 检查模型文件的间隔(秒)
+    CLASSIFIER_MODEL_DRAIN_SECONDS = int(os.environ.get('CLASSIFIER_MODEL_DRAIN_SECONDS') or 30)  # 切换后旧模型保留多久再释放(秒)
+
+    # AI识别结果缓存配置
+    CLASSIFIER_CACHE = os.environ.get('CLASSIFIER_CACHE', 'true').lower() == 'true'
+    CLASSIFIER_CACHE_SIZE = int(os.environ.get('CLASSIFIER_CACHE_SIZE') or 1024)  # 最多缓存的图片数
+    CLASSIFIER_CACHE_TTL = int(os.environ.get('CLASSIFIER_CACHE_TTL') or 3600)  # 缓存有效期(秒)
+    CLASSIFIER_CACHE_MAX_DISTANCE = int(os.environ.get('CLASSIFIER_CACHE_MAX_DISTANCE') or 4)  # 感知哈希汉明距离阈值
+
+    # 系统概览统计配置（/api/stats/overview 返回内存中的统计快照，后台定时重新统计）
+    STATS_OVERVIEW_REFRESH_INTERVAL = int(os.environ.get('STATS_OVERVIEW_REFRESH_INTERVAL') or 60)  # 刷新间隔(秒)，0为每次请求实时统计
+
+    # 评分趋势配置（按评价时间每天、最近几天每小时的评分分桶）
+    RATING_TREND_UTC_OFFSET = int(os.environ.get('RATING_TREND_UTC_OFFSET') or 8)  # 划分日期使用的时区(相对UTC的小时数)
+    RATING_TREND_HOURLY_DAYS = int(os.environ.get('RATING_TREND_HOURLY_DAYS') or 2)  # 小时分桶保留天数(含今天)
+
+    # 菜品排行榜配置（每个进程内存中的有序排行榜，本进程的评价变更后增量更新，其他进程的变更在下次全量计算后可见）
+    LEADERBOARD_PRIOR_WEIGHT = float(os.environ.get('LEADERBOARD_PRIOR_WEIGHT') or 5)  # 贝叶斯平均分的先验权重（相当于几条全站平均分的评价）
+    LEADERBOARD_MIN_REVIEWS = int(os.environ.get('LEADERBOARD_MIN_REVIEWS') or 1)  # 上榜至少需要的评价数
+    LEADERBOARD_REBUILD_INTERVAL = int(os.environ.get('LEADERBOARD_REBUILD_INTERVAL') or 30)  # 全量重新计算的间隔(秒)，即其他worker进程的变更最久多久后可见，0为只在结构变化时（仅限单进程部署）
+
+    # 评价回复预览配置（评价中缓存最新几条回复，评价列表不再逐条查询回复）
+    REVIEW_REPLY_PREVIEW_SIZE = int(os.environ.get('REVIEW_REPLY_PREVIEW_SIZE') or 3)  # 缓存的最新回复条数，0为不缓存预览
+    
     @staticmethod
     def init_app(app):
         """初始化应用配置"""
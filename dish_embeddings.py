@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+菜品图片特征索引
+用识别模型倒数第二层的 2048 维特征表示每张菜品图片（Dish.images），支持"以图搜菜"和"相似菜品"查询
+"""
+
+import queue
+import threading
+
+from app import app, db
+from models import Dish
+from ai_service import get_admission_controller, get_batch_backend, resolve_upload_path
+from dish_index import get_dish_summaries
+
+_embedding_index = None
+_embedding_index_lock = threading.Lock()
+_embedding_job_store = None
+_embedding_job_store_lock = threading.Lock()
+_rebuild_job_id = None  # 最近一次提交的重建任务，同一时间只排一个重建任务
+
+
+def _embedding_model_version():
+    """特征随模型权重变化，模型热更新或替换 model.pth 后旧的特征全部作废"""
+    from resnet_classifier.resnet_predict import MODEL_PATH, get_loaded_classifier, model_file_version
+    classifier = get_loaded_classifier()
+    if classifier is not None:
+        return classifier.version
+    try:
+        return model_file_version(MODEL_PATH)
+    except OSError:
+        return None
+
+
+def get_embedding_index():
+    """
+    获取进程内共享的图片特征索引（内存映射磁盘上的 float16 特征矩阵）
+    模型版本变化后重新打开索引，旧版本的特征被清空，需要重新执行 build-embeddings
+    """
+    global _embedding_index
+    version = _embedding_model_version()
+    if _embedding_index is None or _embedding_index.model_version != version:
+        with _embedding_index_lock:
+            if _embedding_index is None or _embedding_index.model_version != version:
+                from resnet_classifier.embedding_index import EmbeddingIndex
+                from resnet_classifier.resnet_predict import EMBEDDING_DIM
+                _embedding_index = EmbeddingIndex(
+                    app.config.get('CLASSIFIER_EMBEDDING_DIR', 'instance/embeddings'),
+                    dim=EMBEDDING_DIM,
+                    model_version=version
+                )
+    return _embedding_index
+
+
+def sync_dish_embeddings(dish_id, images):
+    """
+    让索引中某个菜品的图片与 Dish.images 保持一致：新增的图片提取特征后追加，已移除的图片标记删除
+    只处理本站上传的图片（/api/uploads/<filename>），外部链接和已丢失的文件会被跳过
+    Returns:
+        int: 新增的图片数
+    """
+    index = get_embedding_index()
+    wanted = list(dict.fromkeys(images or []))
+    existing = set(index.get_dish_images(dish_id))
+
+    removed = existing - set(wanted)
+    if removed:
+        index.remove(dish_id, removed)
+
+    new_images, paths = [], []
+    for image in wanted:
+        if image in existing:
+            continue
+        path = resolve_upload_path(image)
+        if path:
+            new_images.append(image)
+            paths.append(path)
+    if not paths:
+        return 0
+
+    backend = get_batch_backend()
+    batch_size = app.config.get('CLASSIFIER_MAX_BATCH_SIZE', 16)
+    max_workers = app.config.get('CLASSIFIER_PREPROCESS_WORKERS', 4)
+    admission = get_admission_controller()
+    if admission is None:
+        embeddings = backend.embed_batch(paths, batch_size=batch_size, max_workers=max_workers)
+    else:
+        # 与识别请求共用推理名额：不设截止时间（不会被拒绝），按图片数占用名额，队列已满时让识别请求先排
+        with admission.admit(None, weight=len(paths)):
+            embeddings = backend.embed_batch(paths, batch_size=batch_size, max_workers=max_workers)
+    added = [(image, vector) for image, vector in zip(new_images, embeddings) if vector is not None]
+    if added:
+        index.add(dish_id, [image for image, _ in added], [vector for _, vector in added])
+    return len(added)
+
+
+def _run_embedding_job(payload):
+    """
+    后台特征任务，payload 为 ('dish', 菜品ID) 或 ('rebuild', 是否全部重新提取)
+    菜品任务执行时重新读取菜品，提交后又修改过的图片以最新的为准
+    """
+    kind, arg = payload
+    with app.app_context():
+        try:
+            if kind == 'rebuild':
+                return build_dish_embeddings(rebuild=arg)
+            dish = db.session.get(Dish, arg)
+            if dish is None:
+                get_embedding_index().remove(arg)
+                return {'dish_id': arg, 'added': 0}
+            return {'dish_id': arg, 'added': sync_dish_embeddings(dish.dish_id, dish.images)}
+        finally:
+            db.session.remove()
+
+
+def get_embedding_job_store():
+    """
+    获取进程内共享的特征提取任务队列
+    只有一个后台线程，菜品特征更新和重建依次执行，不会同时修改索引，也不会占满推理名额
+    """
+    global _embedding_job_store
+    if _embedding_job_store is None:
+        with _embedding_job_store_lock:
+            if _embedding_job_store is None:
+                from resnet_classifier.jobs import ClassificationJobStore
+                _embedding_job_store = ClassificationJobStore(
+                    _run_embedding_job,
+                    num_workers=1,
+                    max_queue=app.config.get('CLASSIFIER_JOB_QUEUE_SIZE', 100),
+                    max_jobs=app.config.get('CLASSIFIER_JOB_MAX_JOBS', 1000),
+                    ttl=app.config.get('CLASSIFIER_JOB_TTL', 600)
+                )
+    return _embedding_job_store
+
+
+def submit_embedding_rebuild(rebuild=False):
+    """
+    提交重建特征索引的后台任务
+    Returns:
+        tuple: (任务ID, 是否新提交)，已有重建任务在排队或执行时返回该任务
+    Raises:
+        queue.Full: 任务队列已满
+    """
+    global _rebuild_job_id
+    store = get_embedding_job_store()
+    with _embedding_job_store_lock:
+        if _rebuild_job_id is not None:
+            job = store.get(_rebuild_job_id)
+            if job and job['status'] in ('queued', 'running'):
+                return _rebuild_job_id, False
+        _rebuild_job_id = store.submit(('rebuild', bool(rebuild)))
+        return _rebuild_job_id, True
+
+
+def update_dish_embeddings(dish):
+    """
+    管理员新增或修改菜品图片并提交后调用：提交后台任务提取特征后立即返回，不占用请求线程；
+    提取失败或任务队列已满只记录日志，不影响菜品本身的保存（之后可由重建任务补齐）
+    未开启 CLASSIFIER_EMBEDDINGS 时不做任何处理
+    """
+    if not app.config.get('CLASSIFIER_EMBEDDINGS', True):
+        return
+    try:
+        get_embedding_job_store().submit(('dish', dish.dish_id))
+    except queue.Full:
+        app.logger.warning(f'特征任务队列已满，菜品 {dish.dish_id} 的图片特征未更新，请稍后重建特征索引')
+
+
+def remove_dish_embeddings(dish_id):
+    """管理员删除菜品后调用"""
+    if not app.config.get('CLASSIFIER_EMBEDDINGS', True):
+        return
+    try:
+        get_embedding_index().remove(dish_id)
+    except Exception as e:
+        app.logger.warning(f'菜品 {dish_id} 图片特征删除失败: {e}')
+
+
+def build_dish_embeddings(rebuild=False):
+    """
+    为所有菜品的图片提取特征（已收录的图片跳过），最后压缩掉已删除的行
+    Args:
+        rebuild: 是否清空索引后全部重新提取
+    Returns:
+        dict: 索引统计，另含本次新增的图片数 'added'
+    """
+    index = get_embedding_index()
+    if rebuild:
+        index.clear()
+
+    added = 0
+    dish_ids = set()
+    for dish in Dish.query.order_by(Dish.dish_id).all():
+        added += sync_dish_embeddings(dish.dish_id, dish.images)
+        dish_ids.add(dish.dish_id)
+
+    # 数据库中已不存在的菜品
+    for dish_id in index.get_dish_ids() - dish_ids:
+        index.remove(dish_id)
+
+    index.compact()
+    stats = index.get_stats()
+    stats['added'] = added
+    return stats
+
+
+def embed_image(image):
+    """
+    提取一张图片的特征
+    Returns:
+        np.ndarray 或 None（图片无法解码）
+    """
+    return get_batch_backend().embed_batch([image])[0]
+
+
+def find_similar_dishes(vector, limit=10, exclude_dish_ids=()):
+    """
+    查找图片特征最相似的在售菜品
+    Args:
+        vector: 查询特征（L2 归一化）
+        limit: 返回的菜品数
+        exclude_dish_ids: 需要排除的菜品ID（如菜品本身）
+    Returns:
+        list: 菜品信息列表，按相似度从高到低排列，每项附带 'similarity'（余弦相似度）
+    """
+    # 多取一些候选，过滤掉已下架的菜品后仍能凑够 limit 个
+    matches = get_embedding_index().search(vector, top_k=limit * 2, exclude_dish_ids=exclude_dish_ids)
+    summaries = get_dish_summaries([dish_id for dish_id, _ in matches])
+
+    result = []
+    for dish_id, similarity in matches:
+        summary = summaries.get(dish_id)
+        if summary and summary['is_available']:
+            result.append(dict(summary, similarity=similarity))
+    return result[:limit]
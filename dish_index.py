@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+菜品名称索引
+把AI识别的类别名称映射到数据库中的菜品，识别接口不再需要客户端再调用 /api/dishes?search= 逐个扫描菜品表
+"""
+
+import threading
+import time
+
+from app import app, db
+from models import Canteen, Window, Dish, Review, DishRatingStats
+from rating_stats import RatingStats, get_grouped_rating_stats
+
+_dish_index = None
+_dish_index_lock = threading.Lock()
+
+
+class DishNameIndex:
+    """
+    类别名称 -> 菜品ID 的内存索引
+    匹配规则与 /api/dishes?search= 相同：菜品名称包含类别名称（不区分大小写），只收录可用的菜品。
+    启动时全量构建一次，之后管理员新增、改名、下架或删除菜品时增量更新。
+    增量更新只发生在处理该请求的进程中，其他 worker 进程每隔 DISH_INDEX_REBUILD_INTERVAL 秒全量重建一次（见 get_dish_index）；
+    重建在锁外读取数据库，期间本进程的增量更新会记录下来，替换索引后重新应用，不会被旧数据覆盖。
+    """
+
+    def __init__(self, class_names):
+        self._class_keys = {name: name.strip().lower() for name in class_names if name.strip()}
+        self._class_dishes = {key: set() for key in self._class_keys.values()}  # 类别 -> 菜品ID集合
+        self._dish_classes = {}  # 菜品ID -> 匹配的类别集合，改名或删除时据此清理
+        self._changes = None  # 重建期间增量更新的菜品：菜品ID -> 菜品名称（已移除为 None）
+        self.built_at = None
+        self._lock = threading.Lock()
+
+    def build(self, dishes):
+        """
+        全量构建索引
+        Args:
+            dishes: (菜品ID, 菜品名称) 列表
+        """
+        self.rebuild(lambda: dishes)
+
+    def rebuild(self, load_dishes):
+        """
+        在锁外调用 load_dishes() 读取在售菜品后替换索引，期间的增量更新在替换后重新应用
+        Args:
+            load_dishes: 返回 (菜品ID, 菜品名称) 列表的函数
+        """
+        with self._lock:
+            self._changes = {}
+        try:
+            dishes = load_dishes()
+        except Exception:
+            with self._lock:
+                self._changes = None
+            raise
+
+        with self._lock:
+            changes, self._changes = self._changes, None
+            for dish_ids in self._class_dishes.values():
+                dish_ids.clear()
+            self._dish_classes.clear()
+            for dish_id, name in dishes:
+                self._add(dish_id, name)
+            for dish_id, name in changes.items():
+                self._remove(dish_id)
+                if name is not None:
+                    self._add(dish_id, name)
+            self.built_at = time.time()
+
+    def update_dish(self, dish_id, name, is_available=True):
+        """新增或更新一个菜品（改名后重新匹配，不可用的菜品从索引中移除）"""
+        with self._lock:
+            self._remove(dish_id)
+            if is_available:
+                self._add(dish_id, name)
+            if self._changes is not None:
+                self._changes[dish_id] = name if is_available else None
+
+    def remove_dish(self, dish_id):
+        with self._lock:
+            self._remove(dish_id)
+            if self._changes is not None:
+                self._changes[dish_id] = None
+
+    def lookup(self, class_name):
+        """
+        查找与类别名称匹配的菜品
+        Returns:
+            list: 菜品ID列表（升序）
+        """
+        key = self._class_keys.get(class_name, class_name.strip().lower())
+        with self._lock:
+            return sorted(self._class_dishes.get(key, ()))
+
+    def get_stats(self):
+        """获取索引统计"""
+        with self._lock:
+            return {
+                'class_count': len(self._class_dishes),
+                'matched_class_count': sum(1 for dish_ids in self._class_dishes.values() if dish_ids),
+                'indexed_dish_count': len(self._dish_classes),
+                'built_at': self.built_at
+            }
+
+    def _add(self, dish_id, name):
+        dish_name = (name or '').lower()
+        matched = {key for key in self._class_dishes if key in dish_name}
+        for key in matched:
+            self._class_dishes[key].add(dish_id)
+        if matched:
+            self._dish_classes[dish_id] = matched
+
+    def _remove(self, dish_id):
+        for key in self._dish_classes.pop(dish_id, ()):
+            self._class_dishes[key].discard(dish_id)
+
+
+def _load_available_dishes():
+    return db.session.query(Dish.dish_id, Dish.name).filter(Dish.is_available == True).all()
+
+
+def get_dish_index():
+    """
+    获取进程内共享的菜品名称索引，首次调用时从数据库全量构建（需要应用上下文）
+    超过 DISH_INDEX_REBUILD_INTERVAL 秒后重新全量构建，其他 worker 进程中的菜品变更最多这么久后可见
+    """
+    global _dish_index
+    if _dish_index is None:
+        with _dish_index_lock:
+            if _dish_index is None:
+                from resnet_classifier.resnet_predict import get_available_classes
+
+                index = DishNameIndex(get_available_classes())
+                index.rebuild(_load_available_dishes)
+                _dish_index = index
+        return _dish_index
+
+    interval = app.config.get('DISH_INDEX_REBUILD_INTERVAL', 30)
+    if interval > 0 and time.time() - (_dish_index.built_at or 0) > interval \
+            and _dish_index_lock.acquire(blocking=False):
+        # 由一个线程重新构建，其他线程继续使用当前索引
+        try:
+            _dish_index.rebuild(_load_available_dishes)
+        finally:
+            _dish_index_lock.release()
+    return _dish_index
+
+
+def refresh_dish_in_index(dish):
+    """管理员新增或修改菜品后调用；索引尚未构建时无需处理，首次使用时会全量构建"""
+    if _dish_index is not None:
+        _dish_index.update_dish(dish.dish_id, dish.name, dish.is_available)
+
+
+def remove_dish_from_index(dish_id):
+    """管理员删除菜品后调用"""
+    if _dish_index is not None:
+        _dish_index.remove_dish(dish_id)
+
+
+def get_dish_summaries(dish_ids):
+    """
+    按主键一次查询多个菜品的摘要信息（所属窗口、食堂和平均评分）
+    平均评分和评价数读取菜品评分汇总表，只有还没有汇总行的菜品才按评价表计算
+    Returns:
+        dict: {菜品ID: 菜品信息}
+    """
+    if not dish_ids:
+        return {}
+
+    rows = db.session.query(
+        Dish.dish_id,
+        Dish.name,
+        Dish.price,
+        Dish.category,
+        Dish.is_available,
+        Window.window_id,
+        Window.name.label('window_name'),
+        Canteen.canteen_id,
+        Canteen.name.label('canteen_name'),
+        DishRatingStats
+    ).join(Window, Dish.window_id == Window.window_id)\
+     .join(Canteen, Window.canteen_id == Canteen.canteen_id)\
+     .outerjoin(DishRatingStats, DishRatingStats.dish_id == Dish.dish_id)\
+     .filter(Dish.dish_id.in_(set(dish_ids)))\
+     .all()
+
+    missing = [row.dish_id for row in rows if row.DishRatingStats is None]
+    computed = get_grouped_rating_stats('dish', Review.dish_id.in_(missing)) if missing else {}
+
+    summaries = {}
+    for row in rows:
+        stats = row.DishRatingStats or computed.get(row.dish_id) or RatingStats()
+        summaries[row.dish_id] = {
+            'id': row.dish_id,
+            'name': row.name,
+            'price': float(row.price),
+            'category': row.category,
+            'window': {
+                'id': row.window_id,
+                'name': row.window_name
+            },
+            'canteen': {
+                'id': row.canteen_id,
+                'name': row.canteen_name
+            },
+            'average_rating': stats.get_average('overall'),
+            'review_count': stats.overall_count,
+            'is_available': row.is_available
+        }
+    return summaries
+
+
+def get_matching_dishes(class_names, limit=None):
+    """
+    查询与识别类别匹配的菜品信息
+    菜品ID来自内存索引，所有类别的菜品详情合并为一次按主键查询
+    Args:
+        class_names: 识别出的类别名称列表
+        limit: 每个类别最多返回的菜品数，默认读取 CLASSIFIER_MATCH_LIMIT
+    Returns:
+        dict: {类别名称: [菜品信息, ...]}
+    """
+    if limit is None:
+        limit = app.config.get('CLASSIFIER_MATCH_LIMIT', 5)
+
+    index = get_dish_index()
+    matches = {name: index.lookup(name)[:limit] for name in class_names}
+    details = get_dish_summaries({dish_id for ids in matches.values() for dish_id in ids})
+    return {name: [details[dish_id] for dish_id in ids if dish_id in details] for name, ids in matches.items()}
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+gunicorn 配置（在项目根目录执行 gunicorn run:app 时自动读取）
+后台线程需在每个 worker 进程中启动：master 进程中启动的线程不会随 fork 进入 worker
+"""
+
+
+def post_worker_init(worker):
+    """worker 进程加载应用后启动后台任务（AI识别模型预热、模型文件监视、系统概览刷新）"""
+    from run import start_background_tasks
+    start_background_tasks()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+菜品排行榜
+全站、每个食堂、每个分类各有两个排行榜：按贝叶斯平均分（score）和按评价数（volume）。
+贝叶斯平均分 = (m * C + 评分总和) / (m + 评价数)，C 为全站平均分，m 为 LEADERBOARD_PRIOR_WEIGHT，
+评价很少的菜品会被拉向全站平均分，不会因为一两个5分排到最前面。m 为 0 时即普通平均分，没有评价的菜品分数为 0。
+
+所有排行榜一次读取菜品评分汇总表后用 numpy 向量化计算、排序，保存在内存中（有序列表 + bisect）；
+评价变更提交后按主键重新读取这些菜品已提交的汇总行，更新它们在各排行榜中的位置（先验平均分 C 保持不变），
+菜品新增、删除、换窗口、改分类等结构变化，或距上次全量计算超过 LEADERBOARD_REBUILD_INTERVAL 秒时，
+下次读取时重新全量计算。取第 N 页只需切片，不需要查询数据库。
+
+排行榜是每个进程各自的内存状态：增量更新只发生在提交评价的进程中，其他 worker 进程要等到下次全量计算
+（最多 LEADERBOARD_REBUILD_INTERVAL 秒）才能看到这些评价和结构变化，多进程部署时应保持较短的间隔。
+全量计算在锁外读取数据库，期间提交的评价记录下菜品ID，替换快照后重新读取这些菜品的汇总行，不会丢失；
+期间发生的结构变化使新快照仍标记为过期，下次读取时再次全量计算。
+增量更新在提交后执行，评价已经保存；增量更新失败（如读取汇总行时数据库出错）只记录日志并把排行榜标记为过期，
+不影响这次写请求的响应，下次读取时全量计算。
+"""
+
+import threading
+import time
+from bisect import bisect_left, insort
+
+import numpy as np
+from sqlalchemy import event, select
+
+from app import app, db
+from models import Canteen, Window, Dish, DishRatingStats
+
+METRICS = ('score', 'volume')
+
+_leaderboards = None
+_leaderboards_lock = threading.Lock()
+
+
+class Leaderboard:
+    """一个排行榜：按排序键升序保存的 (排序键, 菜品ID) 列表"""
+
+    def __init__(self, entries=()):
+        # entries 需已按排序键升序排列
+        self._keys = list(entries)
+        self._positions = {dish_id: key for key, dish_id in self._keys}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, dish_id, key):
+        self.remove(dish_id)
+        insort(self._keys, (key, dish_id))
+        self._positions[dish_id] = key
+
+    def remove(self, dish_id):
+        key = self._positions.pop(dish_id, None)
+        if key is not None:
+            index = bisect_left(self._keys, (key, dish_id))
+            del self._keys[index]
+
+    def rank(self, dish_id):
+        """名次（从1开始），不在榜上时为 None"""
+        key = self._positions.get(dish_id)
+        if key is None:
+            return None
+        return bisect_left(self._keys, (key, dish_id)) + 1
+
+    def page(self, offset, limit):
+        return [dish_id for _, dish_id in self._keys[offset:offset + limit]]
+
+
+class Leaderboards:
+    """全部排行榜及其依赖的菜品数据"""
+
+    def __init__(self, prior_weight=5, min_reviews=1):
+        self.prior_weight = max(0.0, float(prior_weight))
+        self.min_reviews = max(1, int(min_reviews))
+        self.prior_mean = 0.0
+        self.built_at = None
+        self.stale = True
+        self._version = 0  # 结构变化计数，全量计算期间变化时新快照仍为过期
+        self._rebuilding = None  # 全量计算期间提交了评价的菜品ID
+        self._dishes = {}
+        self._boards = {}
+        self._lock = threading.Lock()
+
+    # ---------------- 全量计算 ----------------
+
+    def rebuild(self):
+        """读取菜品评分汇总表（一次查询），向量化计算所有菜品的分数并排序"""
+        with self._lock:
+            version = self._version
+            self._rebuilding = set()
+        try:
+            dishes, boards, prior_mean = self._compute()
+        except Exception:
+            with self._lock:
+                self._rebuilding = None
+            raise
+
+        with self._lock:
+            self.prior_mean = prior_mean
+            self._dishes = dishes
+            self._boards = {name: Leaderboard(entries) for name, entries in boards.items()}
+            self.built_at = time.time()
+            self.stale = self._version != version
+            changed, self._rebuilding = self._rebuilding, None
+            if changed and not self.stale:
+                # 读取快照期间提交的评价可能不在快照中，按已提交的汇总行重新设置这些菜品
+                try:
+                    self._apply_stats(changed)
+                except Exception as e:
+                    app.logger.warning(f'排行榜增量更新失败，下次读取时重新计算: {e}')
+                    self.stale = True
+
+    def _compute(self):
+        rows = db.session.query(
+            Dish.dish_id, Dish.name, Dish.category, Dish.is_available,
+            Window.window_id, Window.name.label('window_name'),
+            Canteen.canteen_id, Canteen.name.label('canteen_name'),
+            DishRatingStats.overall_count, DishRatingStats.overall_sum
+        ).join(Window, Dish.window_id == Window.window_id)\
+         .join(Canteen, Window.canteen_id == Canteen.canteen_id)\
+         .outerjoin(DishRatingStats, DishRatingStats.dish_id == Dish.dish_id)\
+         .all()
+
+        dishes = {row.dish_id: {
+            'dish_id': row.dish_id,
+            'dish_name': row.name,
+            'category': row.category,
+            'is_available': row.is_available,
+            'window_id': row.window_id,
+            'window_name': row.window_name,
+            'canteen_id': row.canteen_id,
+            'canteen_name': row.canteen_name,
+            'count': row.overall_count or 0,
+            'sum': float(row.overall_sum or 0)
+        } for row in rows}
+
+        ids = np.fromiter(dishes.keys(), dtype=np.int64, count=len(dishes))
+        counts = np.array([dish['count'] for dish in dishes.values()], dtype=np.float64)
+        sums = np.array([dish['sum'] for dish in dishes.values()], dtype=np.float64)
+        total = counts.sum()
+        prior_mean = float(sums.sum() / total) if total else 0.0
+        # m 为 0 时没有评价的菜品分母为 0，分数记为 0
+        denominators = self.prior_weight + counts
+        scores = np.divide(self.prior_weight * prior_mean + sums, denominators,
+                           out=np.zeros_like(sums), where=denominators > 0)
+        scores = np.round(scores, 6)
+
+        ranked = counts >= self.min_reviews
+        boards = {}
+        orders = {
+            # np.lexsort 以最后一个键为主键
+            'score': np.lexsort((ids, -counts, -scores)),
+            'volume': np.lexsort((ids, -scores, -counts))
+        }
+        for metric, order in orders.items():
+            for index in order:
+                if not ranked[index]:
+                    continue
+                dish = dishes[int(ids[index])]
+                entry = (self._sort_key(metric, float(scores[index]), int(counts[index])), dish['dish_id'])
+                for board in self._board_names(dish):
+                    boards.setdefault((board, metric), []).append(entry)
+
+        for index, dish_id in enumerate(ids):
+            dishes[int(dish_id)]['score'] = float(scores[index])
+        return dishes, boards, prior_mean
+
+    def _score(self, count, total):
+        """单个菜品的贝叶斯平均分，与 _compute 中的向量化计算一致"""
+        denominator = self.prior_weight + count
+        if denominator <= 0:
+            return 0.0
+        return round((self.prior_weight * self.prior_mean + total) / denominator, 6)
+
+    @staticmethod
+    def _sort_key(metric, score, count):
+        return (-score, -count) if metric == 'score' else (-count, -score)
+
+    @staticmethod
+    def _board_names(dish):
+        names = [('global', None), ('canteen', dish['canteen_id'])]
+        if dish['category']:
+            names.append(('category', dish['category']))
+        return names
+
+    # ---------------- 增量更新 ----------------
+
+    def apply_changes(self, dish_ids):
+        """
+        评价变更提交后调用，按已提交的汇总行设置这些菜品的评价数和评分总和
+        （设置而不是累加增量，重复应用或与全量计算交错都不会重复计入）
+        Args:
+            dish_ids: 评价有变更的菜品ID
+        """
+        with self._lock:
+            if self._rebuilding is not None:
+                self._rebuilding.update(dish_ids)
+            if not self.stale:
+                try:
+                    self._apply_stats(dish_ids)
+                except Exception:
+                    # 可能只更新了部分菜品，下次读取时全量计算
+                    self.stale = True
+                    raise
+
+    def _apply_stats(self, dish_ids):
+        # 调用方持有 self._lock；提交后会话不能再执行 SQL，使用单独的连接读取
+        with db.engine.connect() as connection:
+            rows = connection.execute(
+                select(DishRatingStats.dish_id, DishRatingStats.overall_count, DishRatingStats.overall_sum)
+                .where(DishRatingStats.dish_id.in_(list(dish_ids)))
+            ).all()
+        stats = {row.dish_id: row for row in rows}
+        for dish_id in dish_ids:
+            dish = self._dishes.get(dish_id)
+            row = stats.get(dish_id)
+            if dish is None or row is None:
+                self.stale = True
+                return
+            dish['count'] = row.overall_count or 0
+            dish['sum'] = float(row.overall_sum or 0)
+            dish['score'] = self._score(dish['count'], dish['sum'])
+            for board in self._board_names(dish):
+                for metric in METRICS:
+                    leaderboard = self._boards.setdefault((board, metric), Leaderboard())
+                    if dish['count'] >= self.min_reviews:
+                        leaderboard.update(dish_id, self._sort_key(metric, dish['score'], dish['count']))
+                    else:
+                        leaderboard.remove(dish_id)
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self.stale = True
+
+    # ---------------- 读取 ----------------
+
+    def get_page(self, board, key, metric, offset, limit):
+        """
+        Returns:
+            tuple: (榜上菜品总数, [菜品信息，含名次 rank、贝叶斯平均分 score、平均分 average_rating、评价数 review_count])
+        """
+        with self._lock:
+            leaderboard = self._boards.get(((board, key), metric))
+            if leaderboard is None:
+                return 0, []
+            items = []
+            for rank, dish_id in enumerate(leaderboard.page(offset, limit), start=offset + 1):
+                dish = self._dishes[dish_id]
+                items.append({
+                    'rank': rank,
+                    'dish_id': dish_id,
+                    'dish_name': dish['dish_name'],
+                    'category': dish['category'],
+                    'window_name': dish['window_name'],
+                    'canteen_id': dish['canteen_id'],
+                    'canteen_name': dish['canteen_name'],
+                    'is_available': dish['is_available'],
+                    'review_count': dish['count'],
+                    'average_rating': round(dish['sum'] / dish['count'], 2) if dish['count'] else 0.0,
+                    'score': round(dish['score'], 3)
+                })
+            return len(leaderboard), items
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'dish_count': len(self._dishes),
+                'board_count': len(self._boards),
+                'prior_mean': round(self.prior_mean, 3),
+                'prior_weight': self.prior_weight,
+                'built_at': self.built_at,
+                'stale': self.stale
+            }
+
+
+def get_leaderboards():
+    """
+    获取排行榜（懒加载单例），结构变化或超过 LEADERBOARD_REBUILD_INTERVAL 秒后重新全量计算
+    需在应用上下文中调用
+    """
+    global _leaderboards
+    if _leaderboards is None:
+        with _leaderboards_lock:
+            if _leaderboards is None:
+                _leaderboards = Leaderboards(
+                    prior_weight=app.config.get('LEADERBOARD_PRIOR_WEIGHT', 5),
+                    min_reviews=app.config.get('LEADERBOARD_MIN_REVIEWS', 1)
+                )
+
+    interval = app.config.get('LEADERBOARD_REBUILD_INTERVAL', 30)
+    expired = interval > 0 and time.time() - (_leaderboards.built_at or 0) > interval
+    if _leaderboards.stale:
+        with _leaderboards_lock:
+            if _leaderboards.stale:
+                _leaderboards.rebuild()
+    elif expired and _leaderboards_lock.acquire(blocking=False):
+        # 只是超过间隔时由一个线程重新计算，其他线程继续读取当前快照
+        try:
+            _leaderboards.rebuild()
+        finally:
+            _leaderboards_lock.release()
+    return _leaderboards
+
+
+# ---------------- 事务钩子 ----------------
+# 评价变更在提交前记录到会话中，提交成功后再应用到内存排行榜，回滚时丢弃
+
+def record_rating_change(dish_id):
+    """评价变更提交前调用（由 rating_aggregates 调用），记录评价有变更的菜品"""
+    db.session.info.setdefault('leaderboard_changes', set()).add(dish_id)
+
+
+def invalidate_after_commit():
+    """菜品新增、删除、换窗口或修改名称分类后调用，提交成功后排行榜下次读取时重新全量计算"""
+    db.session.info['leaderboard_invalidate'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_after_commit(session):
+    # 事务已经提交，这里的异常不能再传给写请求（否则已保存的评价会返回500），失败时改为下次读取时全量计算
+    changes = session.info.pop('leaderboard_changes', None)
+    invalidate = session.info.pop('leaderboard_invalidate', False)
+    if _leaderboards is None:
+        return
+    if invalidate:
+        _leaderboards.invalidate()
+    elif changes:
+        try:
+            _leaderboards.apply_changes(changes)
+        except Exception as e:
+            app.logger.warning(f'排行榜增量更新失败，下次读取时重新计算: {e}')
+            _leaderboards.invalidate()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('leaderboard_changes', None)
+    session.info.pop('leaderboard_invalidate', None)
@@ -99,21 +99,21 @@ class Canteen(db.Model):
     def set_images(self, image_list):
         self.images = image_list
     
+    def get_rating_summary(self):
+        """食堂评分汇总（canteen_rating_stats 主键查询），汇总行尚未生成时按评价表临时计算"""
+        stats = db.session.get(CanteenRatingStats, self.canteen_id)
+        if stats is None:
+            from rating_stats import get_rating_stats
+            stats = get_rating_stats('canteen', self.canteen_id)
+        return stats
+    
     def get_average_rating(self):
         """计算食堂平均评分"""
-        from sqlalchemy import func
-        result = db.session.query(func.avg(Review.overall_rating)).join(Dish).join(Window).filter(
-            Window.canteen_id == self.canteen_id,
-            Review.overall_rating.isnot(None)
-        ).scalar()
-        return round(float(result), 1) if result else 0.0
+        return self.get_rating_summary().get_average('overall')
     
     def get_review_count(self):
         """获取评分总数"""
-        return db.session.query(Review).join(Dish).join(Window).filter(
-            Window.canteen_id == self.canteen_id,
-            Review.overall_rating.isnot(None)
-        ).count()
+        return self.get_rating_summary().review_count
     
     def to_dict(self):
         return {
@@ -178,21 +178,21 @@ class Window(db.Model):
     def set_images(self, image_list):
         self.images = image_list
     
+    def get_rating_summary(self):
+        """窗口评分汇总（window_rating_stats 主键查询），汇总行尚未生成时按评价表临时计算"""
+        stats = db.session.get(WindowRatingStats, self.window_id)
+        if stats is None:
+            from rating_stats import get_rating_stats
+            stats = get_rating_stats('window', self.window_id)
+        return stats
+    
     def get_average_rating(self):
         """计算窗口平均评分"""
-        from sqlalchemy import func
-        result = db.session.query(func.avg(Review.overall_rating)).join(Dish).filter(
-            Dish.window_id == self.window_id,
-            Review.overall_rating.isnot(None)
-        ).scalar()
-        return round(float(result), 1) if result else 0.0
+        return self.get_rating_summary().get_average('overall')
     
     def get_review_count(self):
         """获取评分总数"""
-        return db.session.query(Review).join(Dish).filter(
-            Dish.window_id == self.window_id,
-            Review.overall_rating.isnot(None)
-        ).count()
+        return self.get_rating_summary().review_count
     
     def get_dish_count(self):
         """获取菜品数量"""
@@ -264,68 +264,33 @@ class Dish(db.Model):
     def set_images(self, image_list):
         self.images = image_list
     
+    def get_rating_summary(self):
+        """
+        菜品评分汇总（dish_rating_stats 中的一行，按主键查询，同一会话内重复调用不再访问数据库）
+        汇总行尚未生成（执行 rebuild-rating-stats 之前的历史菜品）时按评价表临时计算
+        """
+        stats = db.session.get(DishRatingStats, self.dish_id)
+        if stats is None:
+            from rating_stats import get_rating_stats
+            stats = get_rating_stats('dish', self.dish_id)
+        return stats
+    
     def get_average_rating(self):
         """计算菜品平均评分"""
-        from sqlalchemy import func
-        result = db.session.query(func.avg(Review.overall_rating)).filter(
-            Review.dish_id == self.dish_id,
-            Review.overall_rating.isnot(None)
-        ).scalar()
-        return round(float(result), 1) if result else 0.0
+        return self.get_rating_summary().get_average('overall')
     
     def get_review_count(self):
         """获取评分总数"""
-        return db.session.query(Review).filter(
-            Review.dish_id == self.dish_id,
-            Review.overall_rating.isnot(None)
-        ).count()
+        return self.get_rating_summary().review_count
     
     def get_rating_stats(self):
         """获取评分统计"""
-        from sqlalchemy import func
-        
-        # 各评分维度平均值
-        taste = db.session.query(func.avg(Review.taste_rating)).filter(
-            Review.dish_id == self.dish_id,
-            Review.taste_rating.isnot(None)
-        ).scalar()
-        
-        portion = db.session.query(func.avg(Review.portion_rating)).filter(
-            Review.dish_id == self.dish_id,
-            Review.portion_rating.isnot(None)
-        ).scalar()
-        
-        value = db.session.query(func.avg(Review.value_rating)).filter(
-            Review.dish_id == self.dish_id,
-            Review.value_rating.isnot(None)
-        ).scalar()
-        
-        service = db.session.query(func.avg(Review.service_rating)).filter(
-            Review.dish_id == self.dish_id,
-            Review.service_rating.isnot(None)
-        ).scalar()
-        
-        return {
-            'taste': round(float(taste), 1) if taste else 0.0,
-            'portion': round(float(portion), 1) if portion else 0.0,
-            'value': round(float(value), 1) if value else 0.0,
-            'service': round(float(service), 1) if service else 0.0,
-        }
-
+        stats = self.get_rating_summary()
+        return {dimension: stats.get_average(dimension) for dimension in ('taste', 'portion', 'value', 'service')}
     
     def get_rating_distribution(self):
         """获取评分分布"""
-        from sqlalchemy import func
-        
-        distribution = {}
-        for i in range(1, 6):
-            count = db.session.query(Review).filter(
-                Review.dish_id == self.dish_id,
-                Review.overall_rating == i
-            ).count()
-            distribution[str(i)] = count
-        
-        return distribution
+        return self.get_rating_summary().get_distribution()
     
     def to_dict(self):
         return {
@@ -348,6 +313,98 @@ class Dish(db.Model):
         }
 
 
+class RatingSummaryMixin:
+    """
+    评分统计的读取方法，汇总表（RatingStatsMixin）和 rating_stats.RatingStats 共用
+    字段：各维度的评分数 <维度>_count 和评分总和 <维度>_sum，总体评分1~5分的评价数 rating_1 ~ rating_5
+    """
+    
+    DIMENSIONS = ('overall', 'taste', 'portion', 'value', 'service')
+    FIELDS = tuple(f'{dimension}_{field}' for dimension in DIMENSIONS for field in ('count', 'sum')) + \
+        tuple(f'rating_{star}' for star in range(1, 6))
+    
+    @property
+    def review_count(self):
+        """有总体评分的评价数"""
+        return self.overall_count
+    
+    def get_average(self, dimension, digits=1):
+        """某个维度的平均评分（默认保留一位小数），没有评分时为0"""
+        count = getattr(self, f'{dimension}_count')
+        return round(getattr(self, f'{dimension}_sum') / count, digits) if count else 0.0
+    
+    def get_distribution(self):
+        """总体评分分布 {'1': 数量, ..., '5': 数量}"""
+        return {str(star): getattr(self, f'rating_{star}') for star in range(1, 6)}
+    
+    def to_dict(self):
+        return {
+            'reviewCount': self.review_count,
+            'averages': {dimension: self.get_average(dimension) for dimension in self.DIMENSIONS},
+            'distribution': self.get_distribution()
+        }
+
+
+class RatingStatsMixin(RatingSummaryMixin):
+    """
+    评分汇总表字段
+    菜品、窗口、食堂各有一张汇总表，随评价的新增、修改和删除在同一事务中增量更新（见 rating_aggregates.py），
+    读取时只需一次主键查询
+    """
+    
+    overall_count = db.Column(db.Integer, nullable=False, default=0)  # 有总体评分的评价数
+    overall_sum = db.Column(db.Float, nullable=False, default=0)
+    taste_count = db.Column(db.Integer, nullable=False, default=0)
+    taste_sum = db.Column(db.Float, nullable=False, default=0)
+    portion_count = db.Column(db.Integer, nullable=False, default=0)
+    portion_sum = db.Column(db.Float, nullable=False, default=0)
+    value_count = db.Column(db.Integer, nullable=False, default=0)
+    value_sum = db.Column(db.Float, nullable=False, default=0)
+    service_count = db.Column(db.Integer, nullable=False, default=0)
+    service_sum = db.Column(db.Float, nullable=False, default=0)
+    rating_1 = db.Column(db.Integer, nullable=False, default=0)  # 总体评分为1分的评价数
+    rating_2 = db.Column(db.Integer, nullable=False, default=0)
+    rating_3 = db.Column(db.Integer, nullable=False, default=0)
+    rating_4 = db.Column(db.Integer, nullable=False, default=0)
+    rating_5 = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class DishRatingStats(RatingStatsMixin, db.Model):
+    """菜品评分汇总表"""
+    __tablename__ = 'dish_rating_stats'
+    
+    dish_id = db.Column(db.Integer, db.ForeignKey('dishes.dish_id'), primary_key=True)
+
+
+class WindowRatingStats(RatingStatsMixin, db.Model):
+    """窗口评分汇总表（窗口下所有菜品的评价）"""
+    __tablename__ = 'window_rating_stats'
+    
+    window_id = db.Column(db.Integer, db.ForeignKey('windows.window_id'), primary_key=True)
+
+
+class CanteenRatingStats(RatingStatsMixin, db.Model):
+    """食堂评分汇总表（食堂下所有窗口、菜品的评价）"""
+    __tablename__ = 'canteen_rating_stats'
+    
+    canteen_id = db.Column(db.Integer, db.ForeignKey('canteens.canteen_id'), primary_key=True)
+
+
+class DishRatingBucket(RatingStatsMixin, db.Model):
+    """
+    菜品评分时间分桶表：按评价时间（RATING_TREND_UTC_OFFSET 时区）每天一个分桶，
+    最近 RATING_TREND_HOURLY_DAYS 天另有每小时一个分桶，随评价的新增、修改和删除增量更新（见 rating_trends.py）
+    """
+    __tablename__ = 'dish_rating_buckets'
+    
+    dish_id = db.Column(db.Integer, db.ForeignKey('dishes.dish_id'), primary_key=True)
+    granularity = db.Column(db.String(10), primary_key=True)  # day / hour
+    bucket_start = db.Column(db.DateTime, primary_key=True)  # 分桶开始时间（本地时间）
+    
+    __table_args__ = (db.Index('ix_dish_rating_buckets_range', 'granularity', 'bucket_start'),)
+
+
 class Review(db.Model):
     """评价表（合并评分和评论）"""
     __tablename__ = 'reviews'
@@ -367,6 +424,8 @@ class Review(db.Model):
     content = db.Column(db.Text)
     _images_text = db.Column('images', db.Text)  # JSON格式存储图片URL数组
     likes = db.Column(db.Integer, default=0)
+    reply_count = db.Column(db.Integer, default=0)  # 回复数，由 review_counters 维护
+    _latest_replies_text = db.Column('latest_replies', db.Text)  # JSON格式缓存的最新几条回复
     status = db.Column(db.Enum('published', 'hidden', 'deleted'), default='published')
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -408,17 +467,22 @@ class Review(db.Model):
     
     @property
     def like_count(self):
-        """获取点赞数"""
-        return len(self.review_likes)
+        """获取点赞数（读取计数列，由 review_counters 维护）"""
+        return self.likes or 0
     
-    @property 
-    def reply_count(self):
-        """获取回复数"""
-        return len(self.replies)
+    @property
+    def latest_replies(self):
+        """获取缓存的最新回复预览（按时间正序），未缓存时为空列表"""
+        if self._latest_replies_text:
+            try:
+                return json.loads(self._latest_replies_text)
+            except (json.JSONDecodeError, TypeError):
+                return []
+        return []
     
     def get_likes_count(self):
         """获取点赞数"""
-        return len(self.review_likes)
+        return self.like_count
     
     def is_liked_by_user(self, user_id):
         """检查用户是否已点赞"""
@@ -442,7 +506,8 @@ class Review(db.Model):
             'likes': self.get_likes_count(),
             'isLiked': self.is_liked_by_user(current_user_id) if current_user_id else False,
             'createTime': self.created_at.isoformat() if self.created_at else None,
-            'replies': [reply.to_dict() for reply in self.replies]
+            'replyCount': self.reply_count or 0,
+            'replies': self.latest_replies
         }
 
 
@@ -487,3 +552,54 @@ class Like(db.Model):
     def id(self):
         """为兼容性提供id属性"""
         return self.like_id
+
+
+class ImageClassification(db.Model):
+    """历史图片离线识别结果表"""
+    __tablename__ = 'image_classifications'
+    
+    classification_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    source_type = db.Column(db.Enum('review', 'dish'), nullable=False)  # 图片来源
+    source_id = db.Column(db.Integer, nullable=False)  # 评价ID或菜品ID
+    image = db.Column(db.String(255), nullable=False)  # 图片地址（与 images 字段中保存的一致）
+    model_version = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Enum('done', 'error'), default='done')
+    dish_name = db.Column(db.String(100))  # 识别出的菜品类别
+    confidence = db.Column(db.Float)
+    _top_k_text = db.Column('top_k', db.Text)  # JSON格式存储候选类别
+    error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # 唯一约束：同一模型版本下每张图片只识别一次
+    __table_args__ = (
+        db.UniqueConstraint('source_type', 'source_id', 'image', 'model_version'),
+        db.Index('ix_image_classifications_source', 'source_type', 'source_id'),
+    )
+    
+    @property
+    def id(self):
+        """为兼容性提供id属性"""
+        return self.classification_id
+    
+    @property
+    def top_k(self):
+        """获取候选类别列表"""
+        if self._top_k_text:
+            try:
+                return json.loads(self._top_k_text)
+            except (json.JSONDecodeError, TypeError):
+                return []
+        return []
+    
+    @top_k.setter
+    def top_k(self, value):
+        """设置候选类别列表"""
+        self._top_k_text = json.dumps(value) if value is not None else None
+
+
+class SchemaUpgrade(db.Model):
+    """已执行的数据库升级步骤（schema_upgrade.upgrade_schema 记录，每个步骤只执行一次）"""
+    __tablename__ = 'schema_upgrades'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+评分汇总表维护
+dish_rating_stats / window_rating_stats / canteen_rating_stats 分别保存每个菜品、窗口、食堂的评分数、
+各维度评分总和和总体评分分布。评价的新增、修改和删除在提交前调用这里的函数，按变更前后的评分计算增量，
+用 UPDATE ... SET x = x + :delta 同时原子更新菜品及其所属窗口、食堂的汇总行，与评价本身在同一事务中提交；
+菜品换窗口时把它的汇总从旧窗口（食堂）移到新窗口（食堂）。
+"""
+
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.orm.util import identity_key
+
+from app import db
+from models import Canteen, Window, Dish, Review, DishRatingStats, WindowRatingStats, CanteenRatingStats
+from rating_stats import DIMENSIONS, STAT_FIELDS as STAT_COLUMNS, SCOPES, RatingStats, get_rating_stats, \
+    get_grouped_rating_stats, snapshot_delta, upsert_stats
+from rating_trends import apply_bucket_change, collect_bucket_deltas, apply_bucket_deltas, delete_dish_buckets
+from leaderboards import record_rating_change, invalidate_after_commit
+
+# 汇总层级：(汇总表, 汇总表主键, 评价按哪一列分组, 该层级的实体表主键)
+LEVELS = {
+    'dish': (DishRatingStats, 'dish_id', SCOPES['dish'][0], Dish.dish_id),
+    'window': (WindowRatingStats, 'window_id', SCOPES['window'][0], Window.window_id),
+    'canteen': (CanteenRatingStats, 'canteen_id', SCOPES['canteen'][0], Canteen.canteen_id),
+}
+
+
+def rating_snapshot(review):
+    """评价各维度的评分（按 DIMENSIONS 顺序），修改评价前先记录一份，用于计算增量"""
+    return tuple(getattr(review, f'{dimension}_rating') for dimension in DIMENSIONS)
+
+
+def _row_values(stats=None):
+    """评分统计（RatingStats）转换为汇总表字段，没有评价时全为0"""
+    return stats.get_values() if stats is not None else dict.fromkeys(STAT_COLUMNS, 0)
+
+
+def compute_stats(level, key):
+    """
+    按评价表计算一个菜品、窗口或食堂的评分汇总（不写入数据库）
+    Args:
+        level: 'dish' / 'window' / 'canteen'
+        key: 对应的ID
+    Returns:
+        未加入会话的汇总对象
+    """
+    model, key_name, _, _ = LEVELS[level]
+    return model(**{key_name: key}, **get_rating_stats(level, key).get_values())
+
+
+def _apply_delta(level, key, delta):
+    delta = {column: value for column, value in delta.items() if value}
+    if key is None or not delta:
+        return
+
+    model, key_name, _, _ = LEVELS[level]
+    values = {getattr(model, column): getattr(model, column) + value for column, value in delta.items()}
+    values[model.updated_at] = datetime.utcnow()
+    updated = model.query.filter(getattr(model, key_name) == key).update(values, synchronize_session=False)
+
+    if updated:
+        # 会话中已加载的汇总对象过期，下次读取时重新查询
+        stats = db.session.identity_map.get(identity_key(model, key))
+        if stats is not None:
+            db.session.expire(stats)
+    else:
+        # 汇总行还不存在（重建之前的历史数据）：本次变更 flush 之后按评价表整体计算一次，
+        # 并发事务同时插入时后插入的一方改为累加增量（见 rating_stats.upsert_stats）
+        db.session.flush()
+        upsert_stats(model, {key_name: key}, _row_values(get_rating_stats(level, key)), delta)
+
+
+def _dish_parents(dish_id):
+    """菜品所属的 (窗口ID, 食堂ID)"""
+    row = db.session.query(Dish.window_id, Window.canteen_id)\
+                    .join(Window, Dish.window_id == Window.window_id)\
+                    .filter(Dish.dish_id == dish_id)\
+                    .first()
+    return tuple(row) if row else (None, None)
+
+
+def apply_rating_change(dish_id, old=None, new=None, created_at=None):
+    """
+    评价变更后、提交前调用，在当前事务中更新菜品及其所属窗口、食堂的评分汇总，以及评价所在的时间分桶
+    Args:
+        dish_id: 菜品ID
+        old: 变更前的评分快照（rating_snapshot），新增评价时为 None
+        new: 变更后的评分快照，删除评价时为 None
+        created_at: 评价时间（UTC），用于更新时间分桶
+    """
+    delta = Counter()
+    if old is not None:
+        delta.update(snapshot_delta(old, -1))
+    if new is not None:
+        delta.update(snapshot_delta(new, 1))
+    if not any(delta.values()):
+        return
+
+    window_id, canteen_id = _dish_parents(dish_id)
+    _apply_delta('dish', dish_id, delta)
+    _apply_delta('window', window_id, delta)
+    _apply_delta('canteen', canteen_id, delta)
+    apply_bucket_change(dish_id, created_at, delta)
+    record_rating_change(dish_id)
+
+
+def delete_reviews(*criteria):
+    """
+    批量删除评价（如删除用户或菜品时），并从各层级的评分汇总中减去这些评价
+    Returns:
+        int: 删除的评价数
+    """
+    aggregates = {level: get_grouped_rating_stats(level, *criteria) for level in LEVELS}
+    bucket_deltas = collect_bucket_deltas(*criteria)
+    deleted = Review.query.filter(*criteria).delete(synchronize_session=False)
+    for level, groups in aggregates.items():
+        for key, stats in groups.items():
+            _apply_delta(level, key, {column: -value for column, value in stats.get_values().items()})
+    apply_bucket_deltas(bucket_deltas)
+    for dish_id in aggregates['dish']:
+        record_rating_change(dish_id)
+    return deleted
+
+
+def move_dish_stats(dish_id, old_window_id, new_window_id):
+    """
+    菜品换窗口后、提交前调用：把菜品的评分汇总从旧窗口（及其食堂）移到新窗口（及其食堂）
+    """
+    if old_window_id == new_window_id:
+        return
+    invalidate_after_commit()
+    stats = db.session.get(DishRatingStats, dish_id) or get_rating_stats('dish', dish_id)
+    values = {column: getattr(stats, column) for column in STAT_COLUMNS}
+    negated = {column: -value for column, value in values.items()}
+
+    old_canteen_id = db.session.query(Window.canteen_id).filter(Window.window_id == old_window_id).scalar()
+    new_canteen_id = db.session.query(Window.canteen_id).filter(Window.window_id == new_window_id).scalar()
+    _apply_delta('window', old_window_id, negated)
+    _apply_delta('window', new_window_id, values)
+    if old_canteen_id != new_canteen_id:
+        _apply_delta('canteen', old_canteen_id, negated)
+        _apply_delta('canteen', new_canteen_id, values)
+
+
+def load_rating_summaries(level, keys):
+    """
+    批量读取一页菜品、窗口或食堂的评分汇总，供列表接口使用，避免逐行查询
+    汇总表一次 IN 查询；尚未生成汇总行的再按评价表一次 GROUP BY 计算
+    Args:
+        level: 'dish' / 'window' / 'canteen'
+        keys: ID 列表
+    Returns:
+        dict: {ID: 汇总对象}
+    """
+    model, key_name, group_column, _ = LEVELS[level]
+    keys = list(set(keys))
+    if not keys:
+        return {}
+    summaries = {getattr(stats, key_name): stats
+                 for stats in model.query.filter(getattr(model, key_name).in_(keys)).all()}
+
+    missing = [key for key in keys if key not in summaries]
+    if missing:
+        computed = get_grouped_rating_stats(level, group_column.in_(missing))
+        for key in missing:
+            summaries[key] = computed.get(key) or RatingStats(key=key)
+    return summaries
+
+
+def load_child_counts(level, keys):
+    """
+    批量统计窗口下的菜品数（level='window'）或食堂下的窗口数（level='canteen'），一次 GROUP BY
+    Returns:
+        dict: {ID: 数量}，没有子项的ID为0
+    """
+    parent_column = {'window': Dish.window_id, 'canteen': Window.canteen_id}[level]
+    keys = list(set(keys))
+    if not keys:
+        return {}
+    counts = dict(db.session.query(parent_column, func.count())
+                            .filter(parent_column.in_(keys))
+                            .group_by(parent_column)
+                            .all())
+    return {key: counts.get(key, 0) for key in keys}
+
+
+def create_stats(level, key):
+    """新增菜品、窗口或食堂后调用（需先 flush 得到ID），在同一事务中插入全零的汇总行"""
+    model, key_name, _, _ = LEVELS[level]
+    db.session.add(model(**{key_name: key}, **_row_values()))
+    if level == 'dish':
+        invalidate_after_commit()
+
+
+def delete_stats(level, key):
+    """删除菜品、窗口或食堂前调用，删除其汇总行（菜品还删除其时间分桶）"""
+    model, key_name, _, _ = LEVELS[level]
+    model.query.filter(getattr(model, key_name) == key).delete(synchronize_session=False)
+    if level == 'dish':
+        delete_dish_buckets(key)
+        invalidate_after_commit()
+
+
+def rebuild_rating_stats():
+    """
+    按评价表重新计算所有菜品、窗口和食堂的评分汇总（没有评价的也生成一行全零的汇总）
+    Returns:
+        dict: {层级: 汇总行数}
+    """
+    result = {}
+    for level, (model, key_name, _, entity_key) in LEVELS.items():
+        aggregates = get_grouped_rating_stats(level)
+        keys = [key for key, in db.session.query(entity_key).all()]
+        rows = [dict(_row_values(aggregates.get(key)), **{key_name: key}) for key in keys]
+
+        model.query.delete(synchronize_session=False)
+        if rows:
+            db.session.execute(model.__table__.insert(), rows)
+        result[level] = len(rows)
+    db.session.commit()
+    db.session.expire_all()
+    return result
+
+
+def check_rating_stats():
+    """
+    校验各层级汇总表与评价表是否一致
+    Returns:
+        list: 不一致项 {'level', 'key', 'field', 'expected', 'actual'}，
+              汇总行缺失时 field 为 None、actual 为 None，多余的汇总行 expected 为 None
+    """
+    issues = []
+    for level, (model, key_name, _, entity_key) in LEVELS.items():
+        aggregates = get_grouped_rating_stats(level)
+        stored = {getattr(stats, key_name): stats for stats in model.query.all()}
+        keys = {key for key, in db.session.query(entity_key).all()}
+
+        for key in sorted(keys | set(stored)):
+            if key not in keys:
+                issues.append({'level': level, 'key': key, 'field': None, 'expected': None, 'actual': 'row'})
+                continue
+            actual = stored.get(key)
+            if actual is None:
+                issues.append({'level': level, 'key': key, 'field': None, 'expected': 'row', 'actual': None})
+                continue
+            for column, expected in _row_values(aggregates.get(key)).items():
+                if abs(float(expected) - float(getattr(actual, column))) > 1e-6:
+                    issues.append({'level': level, 'key': key, 'field': column,
+                                   'expected': expected, 'actual': getattr(actual, column)})
+    return issues
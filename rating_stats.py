@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+评分统计
+一次扫描评价表，用条件聚合（COUNT / SUM / SUM(CASE ...)）同时算出各维度的评分数、评分总和和总体评分分布。
+统计范围可以是菜品、窗口、食堂或全站，并可限定评价时间；也可以按菜品、窗口或食堂分组一次算出多行。
+结果统一为 RatingStats，读取方法（平均分、评价数、分布）与评分汇总表相同。
+"""
+
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import case, func
+
+from app import db
+from models import Window, Dish, Review, RatingSummaryMixin
+
+DIMENSIONS = RatingSummaryMixin.DIMENSIONS
+STAT_FIELDS = RatingSummaryMixin.FIELDS
+
+# 统计层级：(评价按哪一列归属, 需要连接的表)
+SCOPES = {
+    'dish': (Review.dish_id, ()),
+    'window': (Dish.window_id, (Dish,)),
+    'canteen': (Window.canteen_id, (Dish, Window)),
+}
+
+
+class RatingStats(RatingSummaryMixin):
+    """
+    一个范围（或一个分组）的评分统计
+    除 FIELDS 中的字段外，total_count 为范围内全部评价数（包括没有总体评分的评价），key 为分组ID
+    """
+
+    def __init__(self, key=None, total_count=0, **values):
+        self.key = key
+        self.total_count = total_count or 0
+        for field in self.FIELDS:
+            setattr(self, field, values.get(field) or 0)
+
+    @classmethod
+    def from_row(cls, row):
+        """条件聚合查询结果的一行转换为统计对象"""
+        values = row._asdict()
+        return cls(**values)
+
+    def get_values(self):
+        """与汇总表一一对应的字段 {字段: 值}"""
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def to_dict(self):
+        result = super().to_dict()
+        result['totalCount'] = self.total_count
+        return result
+
+
+def snapshot_delta(ratings, sign=1):
+    """
+    一条评价的各维度评分（按 DIMENSIONS 顺序）对统计字段的增量
+    Args:
+        ratings: 评分元组，未评分的维度为 None
+        sign: 1 计入，-1 移除
+    """
+    delta = Counter()
+    for dimension, rating in zip(DIMENSIONS, ratings):
+        if rating is not None:
+            delta[f'{dimension}_count'] += sign
+            delta[f'{dimension}_sum'] += sign * rating
+    for star in range(1, 6):
+        if ratings[0] == star:
+            delta[f'rating_{star}'] += sign
+    return delta
+
+
+def _stat_columns():
+    """条件聚合列：每个维度的评分数和评分总和、总体评分1~5分的评价数，以及评价总数"""
+    columns = [func.count(Review.review_id).label('total_count')]
+    for dimension in DIMENSIONS:
+        rating = getattr(Review, f'{dimension}_rating')
+        columns.append(func.count(rating).label(f'{dimension}_count'))
+        columns.append(func.coalesce(func.sum(rating), 0).label(f'{dimension}_sum'))
+    for star in range(1, 6):
+        columns.append(func.coalesce(func.sum(case((Review.overall_rating == star, 1), else_=0)), 0)
+                       .label(f'rating_{star}'))
+    return columns
+
+
+def _stats_query(columns, joins, start=None, end=None, criteria=()):
+    query = db.session.query(*columns).select_from(Review)
+    if Dish in joins:
+        query = query.join(Dish, Review.dish_id == Dish.dish_id)
+    if Window in joins:
+        query = query.join(Window, Dish.window_id == Window.window_id)
+    if start is not None:
+        query = query.filter(Review.created_at >= start)
+    if end is not None:
+        query = query.filter(Review.created_at < end)
+    return query.filter(*criteria)
+
+
+def get_rating_stats(level=None, key=None, start=None, end=None):
+    """
+    统计一个范围内的评分（一次查询）
+    Args:
+        level: 'dish' / 'window' / 'canteen'，None 表示全站
+        key: 对应的菜品/窗口/食堂ID
+        start: 评价时间下限（含），None 不限
+        end: 评价时间上限（不含），None 不限
+    Returns:
+        RatingStats
+    """
+    joins, criteria = (), ()
+    if level is not None:
+        column, joins = SCOPES[level]
+        criteria = (column == key,)
+    row = _stats_query(_stat_columns(), joins, start, end, criteria).one()
+    stats = RatingStats.from_row(row)
+    stats.key = key
+    return stats
+
+
+def get_grouped_rating_stats(level, *criteria, start=None, end=None):
+    """
+    按菜品、窗口或食堂分组统计评分（一次 GROUP BY），没有评价的分组不出现在结果中
+    Args:
+        level: 'dish' / 'window' / 'canteen'
+        criteria: 额外的过滤条件，如 Review.dish_id.in_(ids)
+    Returns:
+        dict: {ID: RatingStats}
+    """
+    column, joins = SCOPES[level]
+    query = _stats_query([column.label('key')] + _stat_columns(), joins, start, end, criteria)
+    return {row.key: RatingStats.from_row(row) for row in query.group_by(column).all()}
+
+
+def upsert_stats(model, keys, values, delta):
+    """
+    汇总行（评分汇总表或评分分桶表）还不存在时插入按评价表计算的完整值 values；
+    该行已被并发事务插入（主键冲突）时改为在已有行上累加本次变更的增量 delta。
+    并发事务插入的行看不到本事务未提交的评价，所以冲突时累加 delta 不会重复计入。
+    Args:
+        model: 汇总表模型
+        keys: 主键 {列名: 值}
+        values: 按评价表计算的各字段值（已包含本次变更）
+        delta: 本次变更的各字段增量
+    """
+    table = model.__table__
+    now = datetime.utcnow()
+    row = dict(values, **keys, updated_at=now)
+    increments = {column: table.c[column] + value for column, value in delta.items()}
+    increments['updated_at'] = now
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table).values(row).on_conflict_do_update(index_elements=list(keys), set_=increments)
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table).values(row).on_conflict_do_update(index_elements=list(keys), set_=increments)
+    elif dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table).values(row).on_duplicate_key_update(increments)
+    else:
+        statement = table.insert().values(row)
+    db.session.execute(statement)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+评分趋势
+dish_rating_buckets 按评价时间保存每个菜品每天（最近几天另有每小时）的评价数、各维度评分总和和评分分布。
+评价的新增、修改和删除在同一事务中增量更新评价所在的分桶；
+菜品、窗口、食堂或全站任意时间范围的评分趋势只读分桶表，不再按 created_at 扫描评价表。
+分桶按 RATING_TREND_UTC_OFFSET（小时）时区划分日期，默认东八区。
+"""
+
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from app import app, db
+from models import Window, Dish, Review, DishRatingBucket
+from rating_stats import DIMENSIONS, STAT_FIELDS, RatingStats, get_rating_stats, snapshot_delta, upsert_stats
+
+GRANULARITIES = {'day': timedelta(days=1), 'hour': timedelta(hours=1)}
+
+
+def _utc_offset():
+    return timedelta(hours=app.config.get('RATING_TREND_UTC_OFFSET', 8))
+
+
+def to_local(utc_time):
+    """UTC时间转换为分桶使用的本地时间"""
+    return utc_time + _utc_offset()
+
+
+def to_utc(local_time):
+    """本地时间转换为UTC时间（评价表 created_at 为UTC）"""
+    return local_time - _utc_offset()
+
+
+def truncate(local_time, granularity):
+    """本地时间所在分桶的开始时间"""
+    if granularity == 'day':
+        return local_time.replace(hour=0, minute=0, second=0, microsecond=0)
+    return local_time.replace(minute=0, second=0, microsecond=0)
+
+
+def hourly_cutoff():
+    """保留小时分桶的最早时间（本地时间）：今天及之前 RATING_TREND_HOURLY_DAYS - 1 天"""
+    days = max(1, app.config.get('RATING_TREND_HOURLY_DAYS', 2))
+    return truncate(to_local(datetime.utcnow()), 'day') - timedelta(days=days - 1)
+
+
+def _bucket_keys(created_at):
+    """评价（created_at 为UTC）所在的分桶 [(粒度, 分桶开始时间)]"""
+    local_time = to_local(created_at)
+    keys = [('day', truncate(local_time, 'day'))]
+    hour_start = truncate(local_time, 'hour')
+    if hour_start >= hourly_cutoff():
+        keys.append(('hour', hour_start))
+    return keys
+
+
+def _compute_bucket(dish_id, granularity, bucket_start):
+    """按评价表计算一个分桶的各字段"""
+    start = to_utc(bucket_start)
+    return get_rating_stats('dish', dish_id, start=start, end=start + GRANULARITIES[granularity]).get_values()
+
+
+def _apply_bucket_delta(dish_id, granularity, bucket_start, delta):
+    delta = {column: value for column, value in delta.items() if value}
+    if not delta:
+        return
+
+    values = {getattr(DishRatingBucket, column): getattr(DishRatingBucket, column) + value
+              for column, value in delta.items()}
+    values[DishRatingBucket.updated_at] = datetime.utcnow()
+    updated = DishRatingBucket.query.filter_by(dish_id=dish_id, granularity=granularity,
+                                               bucket_start=bucket_start)\
+                                    .update(values, synchronize_session=False)
+    if not updated:
+        # 分桶还不存在（菜品在这一天/小时的第一条评价，或重建之前的历史数据）：本次变更 flush 之后
+        # 按评价表计算这个分桶并插入；并发评价同时插入同一分桶时，后插入的一方改为累加增量
+        db.session.flush()
+        upsert_stats(DishRatingBucket,
+                     {'dish_id': dish_id, 'granularity': granularity, 'bucket_start': bucket_start},
+                     _compute_bucket(dish_id, granularity, bucket_start), delta)
+        if granularity == 'hour':
+            prune_hourly_buckets()
+
+
+def apply_bucket_change(dish_id, created_at, delta):
+    """
+    评价变更后、提交前调用（由 rating_aggregates.apply_rating_change 调用），更新评价所在的天、小时分桶
+    Args:
+        dish_id: 菜品ID
+        created_at: 评价时间（UTC）
+        delta: 各字段的增量
+    """
+    if created_at is None:
+        return
+    for granularity, bucket_start in _bucket_keys(created_at):
+        _apply_bucket_delta(dish_id, granularity, bucket_start, delta)
+
+
+def _accumulate(reviews, sign=1):
+    """按分桶累加评价的评分字段 {(菜品ID, 粒度, 分桶开始时间): Counter}"""
+    buckets = defaultdict(Counter)
+    for review in reviews:
+        delta = snapshot_delta(review[2:], sign)
+        for granularity, bucket_start in _bucket_keys(review.created_at):
+            buckets[(review.dish_id, granularity, bucket_start)].update(delta)
+    return buckets
+
+
+def _review_rows(*criteria):
+    columns = [Review.dish_id, Review.created_at] + \
+              [getattr(Review, f'{dimension}_rating') for dimension in DIMENSIONS]
+    return db.session.query(*columns).filter(*criteria).yield_per(1000)
+
+
+def collect_bucket_deltas(*criteria):
+    """批量删除评价前调用：这些评价在各分桶中的负增量"""
+    return _accumulate(_review_rows(*criteria), sign=-1)
+
+
+def apply_bucket_deltas(deltas):
+    """批量删除评价后调用：应用 collect_bucket_deltas 的结果"""
+    for (dish_id, granularity, bucket_start), delta in deltas.items():
+        _apply_bucket_delta(dish_id, granularity, bucket_start, delta)
+
+
+def delete_dish_buckets(dish_id):
+    """删除菜品前调用，删除其所有分桶"""
+    DishRatingBucket.query.filter_by(dish_id=dish_id).delete(synchronize_session=False)
+
+
+def prune_hourly_buckets():
+    """删除超过保留天数的小时分桶"""
+    return DishRatingBucket.query.filter(DishRatingBucket.granularity == 'hour',
+                                         DishRatingBucket.bucket_start < hourly_cutoff())\
+                                 .delete(synchronize_session=False)
+
+
+def _expected_buckets():
+    return {key: {column: delta.get(column, 0) for column in STAT_FIELDS}
+            for key, delta in _accumulate(_review_rows()).items()}
+
+
+def rebuild_rating_buckets():
+    """
+    按评价表重新生成所有分桶（一次遍历评价表）
+    Returns:
+        dict: {粒度: 分桶数}
+    """
+    rows = [dict(values, dish_id=dish_id, granularity=granularity, bucket_start=bucket_start)
+            for (dish_id, granularity, bucket_start), values in _expected_buckets().items()]
+    DishRatingBucket.query.delete(synchronize_session=False)
+    if rows:
+        db.session.execute(DishRatingBucket.__table__.insert(), rows)
+    db.session.commit()
+    db.session.expire_all()
+    return {granularity: sum(1 for row in rows if row['granularity'] == granularity)
+            for granularity in GRANULARITIES}
+
+
+def check_rating_buckets():
+    """
+    校验分桶表与评价表是否一致（超过保留天数的小时分桶不校验）
+    Returns:
+        list: 不一致项 {'level': 'bucket', 'key': '菜品ID/粒度/分桶开始时间', 'field', 'expected', 'actual'}
+    """
+    expected = _expected_buckets()
+    cutoff = hourly_cutoff()
+    stored = {(bucket.dish_id, bucket.granularity, bucket.bucket_start): bucket
+              for bucket in DishRatingBucket.query.all()
+              if bucket.granularity == 'day' or bucket.bucket_start >= cutoff}
+
+    issues = []
+    for key in sorted(set(expected) | set(stored)):
+        values = expected.get(key, dict.fromkeys(STAT_FIELDS, 0))
+        bucket = stored.get(key)
+        name = f'{key[0]}/{key[1]}/{key[2].isoformat()}'
+        if bucket is None:
+            # 没有评价的分桶可以不存在
+            if any(values.values()):
+                issues.append({'level': 'bucket', 'key': name, 'field': None, 'expected': 'row', 'actual': None})
+            continue
+        for column, value in values.items():
+            if abs(float(value) - float(getattr(bucket, column))) > 1e-6:
+                issues.append({'level': 'bucket', 'key': name, 'field': column,
+                               'expected': value, 'actual': getattr(bucket, column)})
+    return issues
+
+
+def get_rating_trend(level=None, key=None, granularity='day', start=None, end=None):
+    """
+    读取分桶表得到评分趋势（一次 GROUP BY 查询），没有评价的时间段补零
+    Args:
+        level: 'dish' / 'window' / 'canteen'，None 表示全站
+        key: 对应的菜品/窗口/食堂ID
+        granularity: 'day' / 'hour'
+        start: 开始时间（本地时间，按粒度对齐，含）
+        end: 结束时间（本地时间，按粒度对齐，不含）
+    Returns:
+        list: [(分桶开始时间, RatingStats)]
+    """
+    columns = [DishRatingBucket.bucket_start] + \
+              [func.sum(getattr(DishRatingBucket, field)).label(field) for field in STAT_FIELDS]
+    query = db.session.query(*columns).filter(DishRatingBucket.granularity == granularity,
+                                              DishRatingBucket.bucket_start >= start,
+                                              DishRatingBucket.bucket_start < end)
+    if level == 'dish':
+        query = query.filter(DishRatingBucket.dish_id == key)
+    elif level in ('window', 'canteen'):
+        query = query.join(Dish, DishRatingBucket.dish_id == Dish.dish_id)
+        if level == 'window':
+            query = query.filter(Dish.window_id == key)
+        else:
+            query = query.join(Window, Dish.window_id == Window.window_id).filter(Window.canteen_id == key)
+
+    rows = {row.bucket_start: row for row in query.group_by(DishRatingBucket.bucket_start).all()}
+    series = []
+    step = GRANULARITIES[granularity]
+    bucket_start = start
+    while bucket_start < end:
+        row = rows.get(bucket_start)
+        stats = RatingStats.from_row(row) if row is not None else RatingStats()
+        stats.key = bucket_start
+        series.append((bucket_start, stats))
+        bucket_start += step
+    return series
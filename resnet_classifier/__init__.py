@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""
+AI菜品识别模块
+"""
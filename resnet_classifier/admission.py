@@ -0,0 +1,156 @@
+# admission.py
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class AdmissionRejected(Exception):
+    """请求无法在截止时间前开始推理，reason 为 queue_full / deadline / expired"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    推理准入控制
+    最多 max_concurrent 个请求同时推理，其余请求在长度为 max_queue 的队列中按到达顺序等待。
+    每个请求带一个截止时间（time.monotonic() 时刻）：队列已满、按排队长度和平均推理耗时估计
+    无法在截止时间前开始，或等到截止时间仍未轮到，都会抛出 AdmissionRejected，
+    由接口立即返回 503，而不是让请求在服务端无限堆积、最后所有客户端一起超时。
+    截止时间为 None 的请求（如后台任务）不会被拒绝，但同样受队列长度限制：队列已满时在队列外等待，
+    不会无限堆积在交互请求前面。
+    批量请求按图片数占用多个名额（weight，最多 max_concurrent 个）。
+    """
+
+    EWMA_ALPHA = 0.2
+    MAX_RETRY_AFTER = 30
+
+    def __init__(self, max_concurrent=16, max_queue=32):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+
+        # 运行统计
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_deadline = 0
+        self.expired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.avg_service = None  # 每个请求占用推理名额的时间（指数滑动平均，秒）
+
+        self._active = 0
+        self._waiting = deque()
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def admit(self, deadline=None, weight=1):
+        """
+        占用推理名额直到 with 块结束
+        Args:
+            deadline: 必须开始推理的最晚时刻（time.monotonic()），None 表示不限
+            weight: 占用的名额数（如批量请求的图片数），超过 max_concurrent 时按 max_concurrent 计
+        Raises:
+            AdmissionRejected: 无法在截止时间前开始推理
+        """
+        weight = max(1, min(int(weight), self.max_concurrent))
+        self._acquire(deadline, weight)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - start, weight)
+
+    def get_stats(self):
+        """获取准入控制统计"""
+        with self._cond:
+            return {
+                'active': self._active,
+                'max_concurrent': self.max_concurrent,
+                'queue_length': len(self._waiting),
+                'queued_weight': self._waiting_weight(),
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected_queue_full': self.rejected_queue_full,
+                'rejected_deadline': self.rejected_deadline,
+                'expired': self.expired,
+                'avg_wait_ms': round(self.total_wait / self.admitted * 1000, 2) if self.admitted else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 2),
+                'avg_service_ms': round(self.avg_service * 1000, 2) if self.avg_service is not None else None,
+                'estimated_wait_ms': round(self._estimate_wait(self._waiting_weight()) * 1000, 2)
+            }
+
+    def _waiting_weight(self):
+        return sum(ticket[0] for ticket in self._waiting)
+
+    def _estimate_wait(self, slots_ahead):
+        """前面还有 slots_ahead 个名额在排队的请求大约还要等多久才能开始推理"""
+        if self._active < self.max_concurrent and not self._waiting:
+            return 0.0
+        if self.avg_service is None:
+            return 0.0
+        return (slots_ahead + 1) * self.avg_service / self.max_concurrent
+
+    def _retry_after(self):
+        """建议客户端等待的秒数：当前队列大约多久能排空"""
+        seconds = math.ceil(self._estimate_wait(self._waiting_weight()))
+        return max(1, min(seconds, self.MAX_RETRY_AFTER))
+
+    def _acquire(self, deadline, weight):
+        arrived = time.monotonic()
+        with self._cond:
+            if deadline is None:
+                # 后台请求：队列已满时在队列外等待，不占用排队位置，也不会被拒绝
+                while self._waiting and len(self._waiting) >= max(1, self.max_queue):
+                    self._cond.wait()
+
+            if self._active + weight <= self.max_concurrent and not self._waiting:
+                self._active += weight
+                self._record_wait(time.monotonic() - arrived)
+                return
+
+            if deadline is not None:
+                if len(self._waiting) >= self.max_queue:
+                    self.rejected_queue_full += 1
+                    raise AdmissionRejected('queue_full', self._retry_after())
+                if arrived + self._estimate_wait(self._waiting_weight()) > deadline:
+                    self.rejected_deadline += 1
+                    raise AdmissionRejected('deadline', self._retry_after())
+
+            ticket = (weight, object())
+            self._waiting.append(ticket)
+            try:
+                while self._waiting[0] is not ticket or self._active + weight > self.max_concurrent:
+                    timeout = None if deadline is None else deadline - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        self.expired += 1
+                        raise AdmissionRejected('expired', self._retry_after())
+                    self._cond.wait(timeout)
+            except BaseException:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+                raise
+
+            self._waiting.popleft()
+            self._active += weight
+            self._record_wait(time.monotonic() - arrived)
+            # 可能还有空闲名额，让下一个请求也检查一次
+            self._cond.notify_all()
+
+    def _release(self, service_time, weight=1):
+        with self._cond:
+            self._active -= weight
+            if self.avg_service is None:
+                self.avg_service = service_time
+            else:
+                self.avg_service += self.EWMA_ALPHA * (service_time - self.avg_service)
+            self._cond.notify_all()
+
+    def _record_wait(self, wait):
+        self.admitted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
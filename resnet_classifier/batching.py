@@ -0,0 +1,133 @@
+# batching.py
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+
+class BatchingClassifier:
+    """
+    动态微批处理推理队列
+    请求线程只负责读图和预处理，后台推理线程在 max_wait_ms 时间窗口内（或凑满 max_batch_size 张）
+    收集请求，合并成一个批次执行一次前向计算，再把结果分发回各个等待的请求。
+    对外提供与 DishClassifier 相同的 predict() 接口。
+    """
+
+    def __init__(self, classifier, max_batch_size=16, max_wait_ms=10):
+        self.classifier = classifier
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        # 运行统计
+        self.batch_count = 0
+        self.request_count = 0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='dish-classifier-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, img_tensor, top_k=1):
+        """
+        提交一张预处理后的图片
+        Args:
+            img_tensor: 形状为 (3, 224, 224) 的张量
+            top_k: 返回的候选类别数
+        Returns:
+            Future: 结果为 {'name': 菜品名称, 'confidence': 置信度}
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('推理队列已关闭')
+            self._queue.put((img_tensor, max(1, int(top_k)), future))
+        return future
+
+    def predict(self, image, top_k=1):
+        """
+        预测图片中的菜品（阻塞等待所在批次完成）
+        Args:
+            image: 图片的绝对路径或相对路径，也可以是 bytes、类文件对象或 PIL.Image
+            top_k: 返回的候选类别数
+        Returns:
+            dict: {'name': 菜品名称, 'confidence': 置信度} 或 {'error': 错误信息}
+        """
+        try:
+            if isinstance(image, str) and not os.path.exists(image):
+                return {'error': f'图片文件不存在: {image}'}
+
+            img_tensor = self.classifier.preprocess(image)
+            return self.submit(img_tensor, top_k).result()
+
+        except Exception as e:
+            return {'error': f'预测过程中出错: {str(e)}'}
+
+    def get_stats(self):
+        """获取批处理运行统计"""
+        return {
+            'batch_count': self.batch_count,
+            'request_count': self.request_count,
+            'avg_batch_size': round(self.request_count / self.batch_count, 2) if self.batch_count else 0.0,
+            'queue_size': self._queue.qsize(),
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000
+        }
+
+    def close(self):
+        """停止后台推理线程（队列中已提交的请求会先处理完，之后提交的请求直接报错）"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def _collect_batch(self):
+        """阻塞等待第一个请求，然后在时间窗口内继续收集，直到凑满一个批次"""
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # 把停止信号放回去，处理完当前批次后再退出
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+
+            futures = [future for _, _, future in batch]
+            # 同一批次按最大的 top_k 计算一次，再按各请求的 top_k 截取候选列表
+            top_k = max(k for _, k, _ in batch)
+            try:
+                results = self.classifier.predict_tensors(torch.stack([tensor for tensor, _, _ in batch]), top_k=top_k)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            self.batch_count += 1
+            self.request_count += len(batch)
+            for (_, k, future), result in zip(batch, results):
+                if k < top_k:
+                    candidates = result.pop('top_k')
+                    if k > 1:
+                        result['top_k'] = candidates[:k]
+                future.set_result(result)
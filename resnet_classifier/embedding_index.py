@@ -0,0 +1,306 @@
+# embedding_index.py
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，只在进程内加锁（单进程部署）
+    fcntl = None
+
+
+class EmbeddingIndex:
+    """
+    图片特征相似度索引
+    每行一张图片的 L2 归一化特征，以 float16 存放在磁盘上的 .npy 文件中并通过内存映射读取
+    （2048 维每张图片 4KB），另有一个 JSON 文件记录每行对应的 (菜品ID, 图片地址)。
+    支持逐行追加：容量不足时按两倍扩容重写文件；删除的行只做标记，compact() 时才真正移除。
+    search() 用一次矩阵乘法计算与全部图片的余弦相似度，再按菜品取最高分。
+
+    多个进程（如 gunicorn 的多个 worker）可以共用同一个目录：写操作持有目录下 embeddings.lock 的排他文件锁，
+    先重新加载其他进程写入的内容再修改；读操作发现 JSON 文件被替换（inode、修改时间变化）后
+    在共享文件锁下重新加载，矩阵文件被其他进程扩容或压缩替换后重新内存映射。
+    """
+
+    MATRIX_FILE = 'embeddings.npy'
+    META_FILE = 'embeddings.json'
+    LOCK_FILE = 'embeddings.lock'
+    SEARCH_CHUNK = 4096
+
+    def __init__(self, directory, dim=2048, model_version=None):
+        self.directory = directory
+        self.dim = dim
+        self.model_version = model_version
+
+        self._matrix = None  # np.memmap，形状为 (容量, dim)
+        self._dish_ids = np.zeros(0, dtype=np.int64)  # 每行的菜品ID，已删除的行为 -1
+        self._images = []  # 每行的图片地址
+        self._count = 0
+        self._meta_stamp = None  # 最近一次加载或写入的 JSON 文件 (inode, 修改时间, 大小)
+        self._lock = threading.RLock()
+
+        os.makedirs(directory, exist_ok=True)
+        with self._lock, self._file_lock():
+            if not self._load():
+                self._clear()
+
+    @property
+    def matrix_path(self):
+        return os.path.join(self.directory, self.MATRIX_FILE)
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.directory, self.META_FILE)
+
+    @property
+    def lock_path(self):
+        return os.path.join(self.directory, self.LOCK_FILE)
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return int((self._dish_ids[:self._count] >= 0).sum())
+
+    def get_dish_ids(self):
+        """已收录图片的菜品ID集合"""
+        with self._lock:
+            self._refresh()
+            dish_ids = self._dish_ids[:self._count]
+            return {int(dish_id) for dish_id in np.unique(dish_ids[dish_ids >= 0])}
+
+    def get_dish_images(self, dish_id):
+        """已收录的某个菜品的图片地址列表"""
+        with self._lock:
+            self._refresh()
+            rows = np.flatnonzero(self._dish_ids[:self._count] == dish_id)
+            return [self._images[i] for i in rows]
+
+    def get_dish_vector(self, dish_id):
+        """
+        菜品所有图片特征的平均方向（归一化），用于以菜搜菜
+        Returns:
+            np.ndarray 或 None（没有收录该菜品的图片）
+        """
+        with self._lock:
+            self._refresh()
+            rows = np.flatnonzero(self._dish_ids[:self._count] == dish_id)
+            if not len(rows):
+                return None
+            vector = self._matrix[rows].astype(np.float32).mean(axis=0)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def add(self, dish_id, images, vectors):
+        """
+        追加一个菜品的若干张图片特征并写回磁盘
+        Args:
+            dish_id: 菜品ID
+            images: 图片地址列表
+            vectors: 与 images 一一对应的特征向量
+        """
+        if not images:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(images), self.dim)
+        with self._lock, self._file_lock():
+            self._refresh(locked=True)
+            self._reserve(self._count + len(images))
+            self._matrix[self._count:self._count + len(images)] = vectors.astype(np.float16)
+            self._dish_ids[self._count:self._count + len(images)] = dish_id
+            self._images.extend(images)
+            self._count += len(images)
+            self._matrix.flush()
+            self._save_meta()
+
+    def remove(self, dish_id, images=None):
+        """标记删除某个菜品的全部图片，或其中指定的图片"""
+        with self._lock, self._file_lock():
+            self._refresh(locked=True)
+            changed = False
+            for i in np.flatnonzero(self._dish_ids[:self._count] == dish_id):
+                if images is None or self._images[i] in images:
+                    self._dish_ids[i] = -1
+                    changed = True
+            if changed:
+                self._save_meta()
+
+    def search(self, vector, top_k=10, exclude_dish_ids=()):
+        """
+        查找与给定特征最相似的菜品
+        Args:
+            vector: 查询特征（L2 归一化）
+            top_k: 返回的菜品数
+            exclude_dish_ids: 需要排除的菜品ID
+        Returns:
+            list: [(菜品ID, 余弦相似度), ...]，按相似度从高到低排列，同一菜品只取相似度最高的图片
+        """
+        query = np.asarray(vector, dtype=np.float32).reshape(self.dim)
+        with self._lock:
+            self._refresh()
+            if not self._count:
+                return []
+            dish_ids = self._dish_ids[:self._count].copy()
+            # numpy 的 float16 矩阵乘法没有 BLAS 加速，分块转换为 float32 后再计算
+            scores = np.empty(self._count, dtype=np.float32)
+            for start in range(0, self._count, self.SEARCH_CHUNK):
+                end = min(start + self.SEARCH_CHUNK, self._count)
+                scores[start:end] = self._matrix[start:end].astype(np.float32) @ query
+
+        valid = dish_ids >= 0
+        for dish_id in exclude_dish_ids:
+            valid &= dish_ids != dish_id
+        dish_ids, scores = dish_ids[valid], scores[valid]
+        if not len(scores):
+            return []
+
+        # 每个菜品取最高分：先按分数降序排列，再取每个菜品第一次出现的位置
+        order = np.argsort(-scores, kind='stable')
+        _, first = np.unique(dish_ids[order], return_index=True)
+        best = order[np.sort(first)][:top_k]
+        return [(int(dish_ids[i]), round(float(scores[i]), 4)) for i in best]
+
+    def compact(self):
+        """移除已删除的行并缩小文件"""
+        with self._lock, self._file_lock():
+            self._refresh(locked=True)
+            rows = np.flatnonzero(self._dish_ids[:self._count] >= 0)
+            vectors = np.array(self._matrix[rows])
+            dish_ids = self._dish_ids[rows]
+            images = [self._images[i] for i in rows]
+            self._write(vectors, dish_ids, images, capacity=max(len(rows), 1))
+
+    def clear(self):
+        with self._lock, self._file_lock():
+            self._clear()
+
+    def _clear(self):
+        # 调用方已持有排他文件锁：同一进程对同一文件再次 flock 会互相阻塞
+        self._write(np.zeros((0, self.dim), dtype=np.float16), np.zeros(0, dtype=np.int64), [], capacity=1)
+
+    def get_stats(self):
+        with self._lock:
+            self._refresh()
+            return {
+                'images': len(self),
+                'dishes': len(self.get_dish_ids()),
+                'rows': self._count,
+                'capacity': 0 if self._matrix is None else int(self._matrix.shape[0]),
+                'dim': self.dim,
+                'model_version': self.model_version,
+                'file_size': os.path.getsize(self.matrix_path) if os.path.exists(self.matrix_path) else 0
+            }
+
+    @contextmanager
+    def _file_lock(self, exclusive=True):
+        """跨进程的文件锁：写操作排他，重新加载时共享"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _stat_meta(self):
+        try:
+            stat = os.stat(self.meta_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self, locked=False):
+        """
+        其他进程修改过索引时重新加载（调用方持有 self._lock）
+        Args:
+            locked: 调用方已持有排他文件锁
+        """
+        if self._stat_meta() == self._meta_stamp:
+            return
+        if locked:
+            loaded = self._load()
+        else:
+            with self._file_lock(exclusive=False):
+                loaded = self._load()
+        if not loaded:
+            # 其他进程已按新模型版本清空重建，本进程的旧版本特征不再可用
+            self._matrix = None
+            self._count = 0
+            self._images = []
+            self._dish_ids = np.zeros(0, dtype=np.int64)
+
+    def _load(self):
+        """
+        打开已有的索引文件（调用方持有文件锁）
+        Returns:
+            bool: 是否加载成功，模型版本变化或文件损坏时返回 False
+        """
+        stamp = self._stat_meta()
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            matrix = np.load(self.matrix_path, mmap_mode='r+')
+            valid = (
+                meta.get('dim') == self.dim
+                and (self.model_version is None or meta.get('model_version') == self.model_version)
+                and matrix.shape[1] == self.dim
+                and meta['count'] <= matrix.shape[0]
+            )
+        except (OSError, ValueError, KeyError):
+            valid = False
+
+        self._meta_stamp = stamp
+        if not valid:
+            return False
+
+        self._matrix = matrix
+        self._count = meta['count']
+        self._images = meta['images']
+        self._dish_ids = np.zeros(matrix.shape[0], dtype=np.int64)
+        self._dish_ids[:self._count] = meta['dish_ids']
+        return True
+
+    def _reserve(self, size):
+        """容量不足时按两倍扩容"""
+        if self._matrix is None:
+            self._clear()
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        self._write(np.array(self._matrix[:self._count]), self._dish_ids[:self._count].copy(),
+                    list(self._images), capacity)
+
+    def _write(self, vectors, dish_ids, images, capacity):
+        """写出新文件后原子替换旧文件，并重新内存映射"""
+        tmp_path = self.matrix_path + '.tmp'
+        matrix = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float16, shape=(capacity, self.dim))
+        matrix[:len(vectors)] = vectors
+        matrix.flush()
+        del matrix
+        self._matrix = None
+        os.replace(tmp_path, self.matrix_path)
+
+        self._matrix = np.load(self.matrix_path, mmap_mode='r+')
+        self._count = len(vectors)
+        self._images = list(images)
+        self._dish_ids = np.zeros(capacity, dtype=np.int64)
+        self._dish_ids[:self._count] = dish_ids
+        self._save_meta()
+
+    def _save_meta(self):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'dim': self.dim,
+                'model_version': self.model_version,
+                'count': self._count,
+                'dish_ids': self._dish_ids[:self._count].tolist(),
+                'images': self._images
+            }, f)
+        os.replace(tmp_path, self.meta_path)
+        self._meta_stamp = self._stat_meta()
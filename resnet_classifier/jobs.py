@@ -0,0 +1,189 @@
+# jobs.py
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class ClassificationJobStore:
+    """
+    异步识别任务队列
+    提交任务后立即返回任务ID，后台线程从有界队列中取出任务执行 handler(payload)，
+    结果保存在有界的进程内任务表中，完成超过 ttl 秒后过期删除。
+    客户端可以轮询任务状态，也可以用 wait() 长轮询直到任务完成或超时。
+    """
+
+    def __init__(self, handler, num_workers=2, max_queue=100, max_jobs=1000, ttl=600):
+        self.handler = handler
+        self.num_workers = max(1, int(num_workers))
+        self.max_jobs = max(1, int(max_jobs))
+        self.ttl = ttl
+
+        # 运行统计
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._jobs = OrderedDict()  # job_id -> 任务记录，按提交顺序排列
+        self._lock = threading.Lock()
+        self._threads = []
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f'dish-classifier-job-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, payload):
+        """
+        提交任务
+        Returns:
+            str: 任务ID
+        Raises:
+            queue.Full: 等待队列已满，或任务表中全是未完成的任务
+        """
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._expire(now)
+            if len(self._jobs) >= self.max_jobs and not self._evict_finished():
+                self.rejected += 1
+                raise queue.Full()
+
+            job = {
+                'job_id': job_id,
+                'status': 'queued',
+                'created_at': now,
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+                'done': threading.Event()
+            }
+            try:
+                self._queue.put_nowait((job_id, payload))
+            except queue.Full:
+                self.rejected += 1
+                raise
+            self._jobs[job_id] = job
+            self.submitted += 1
+        return job_id
+
+    def get(self, job_id):
+        """
+        获取任务状态
+        Returns:
+            dict 或 None（任务不存在或已过期）
+        """
+        with self._lock:
+            self._expire(time.time())
+            job = self._jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def wait(self, job_id, timeout):
+        """长轮询：等待任务完成，最多 timeout 秒，返回当前任务状态"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job['done'].wait(timeout)
+        return self.get(job_id)
+
+    def queue_position(self, job_id):
+        """排队中的任务前面还有多少个任务，不在排队中时返回 None"""
+        with self._lock:
+            position = 0
+            for other_id, job in self._jobs.items():
+                if other_id == job_id:
+                    return position if job['status'] == 'queued' else None
+                if job['status'] == 'queued':
+                    position += 1
+        return None
+
+    def get_stats(self):
+        """获取任务队列统计"""
+        with self._lock:
+            self._expire(time.time())
+            statuses = [job['status'] for job in self._jobs.values()]
+            finished = self.completed + self.failed
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue': self._queue.maxsize,
+                'running': statuses.count('running'),
+                'stored_jobs': len(self._jobs),
+                'max_jobs': self.max_jobs,
+                'workers': self.num_workers,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'expired': self.expired,
+                'avg_wait_ms': round(self.total_wait / finished * 1000, 2) if finished else 0.0,
+                'avg_run_ms': round(self.total_run / finished * 1000, 2) if finished else 0.0
+            }
+
+    def close(self):
+        """停止后台线程（已入队的任务会先处理完）"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            job_id, payload = item
+
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                job['status'] = 'running'
+                job['started_at'] = time.time()
+
+            try:
+                result, error = self.handler(payload), None
+            except Exception as e:
+                result, error = None, str(e)
+
+            with self._lock:
+                job['finished_at'] = time.time()
+                self.total_wait += job['started_at'] - job['created_at']
+                self.total_run += job['finished_at'] - job['started_at']
+                if error is None:
+                    job['status'] = 'done'
+                    job['result'] = result
+                    self.completed += 1
+                else:
+                    job['status'] = 'failed'
+                    job['error'] = error
+                    self.failed += 1
+            job['done'].set()
+
+    def _expire(self, now):
+        """删除完成超过 ttl 秒的任务"""
+        if not self.ttl:
+            return
+        for job_id, job in list(self._jobs.items()):
+            if job['finished_at'] is not None and now - job['finished_at'] > self.ttl:
+                del self._jobs[job_id]
+                self.expired += 1
+
+    def _evict_finished(self):
+        """任务表已满时淘汰最早完成的任务，没有可淘汰的任务时返回 False"""
+        for job_id, job in self._jobs.items():
+            if job['finished_at'] is not None:
+                del self._jobs[job_id]
+                self.expired += 1
+                return True
+        return False
+
+    @staticmethod
+    def _snapshot(job):
+        return {key: value for key, value in job.items() if key != 'done'}
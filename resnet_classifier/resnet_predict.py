@@ -3,25 +3,51 @@ import torch
 import torch.nn as nn
 from torchvision import models, transforms
 from PIL import Image
+import io
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 # 模型路径 & 类别映射
 import os
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-MODEL_PATH = os.path.join(CURRENT_DIR, 'model.pth')
+MODEL_PATH = os.environ.get('RESNET_MODEL_PATH') or os.path.join(CURRENT_DIR, 'model.pth')
 ID_NAME_PATH = os.path.join(CURRENT_DIR, 'id_name_mapping.txt')
 DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+NUM_CLASSES = 100
+INPUT_SIZE = (224, 224)
 
 # 数据预处理
 transform = transforms.Compose([
-    transforms.Resize((224, 224)),
+    transforms.Resize(INPUT_SIZE),
     transforms.ToTensor(),
     transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
 ])
 
+# 加载图片
+def load_image(source):
+    """
+    在内存中解码图片并转换为RGB，不产生临时文件
+    Args:
+        source: 图片路径、bytes、类文件对象或 PIL.Image
+    Returns:
+        PIL.Image: RGB图片
+    """
+    if isinstance(source, Image.Image):
+        return source.convert('RGB')
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    img = Image.open(source)
+    if img.format == 'JPEG':
+        # JPEG 在解码阶段直接按 1/2、1/4、1/8 缩小到不小于 224x224 的尺寸，省去大图的完整解码
+        img.draft('RGB', INPUT_SIZE)
+    return img.convert('RGB')
+
 # 加载类别映射
-def load_id2name():
+def load_id2name(id_name_path=ID_NAME_PATH):
     id2name = {}
-    with open(ID_NAME_PATH, 'r', encoding='utf-8') as f:
+    with open(id_name_path, 'r', encoding='utf-8') as f:
         for line in f:
             if line.strip() and not line.startswith('id'):
                 parts = line.strip().split('\t')
@@ -31,15 +57,333 @@ def load_id2name():
 
 id2name = load_id2name()
 
-# 加载模型
-def load_model():
-    model = models.resnet50(pretrained=False)
-    model.fc = nn.Linear(model.fc.in_features, 100)
-    model.load_state_dict(torch.load(MODEL_PATH, map_location=DEVICE))
+# 模型文件版本（文件大小 + 修改时间），替换 model.pth 后版本随之变化
+def model_file_version(model_path=MODEL_PATH):
+    stat = os.stat(model_path)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+# 模型权重文件所在的目录，热更新只允许加载这些目录中的文件
+MODEL_DIRS = tuple(dict.fromkeys([CURRENT_DIR, os.path.dirname(os.path.abspath(MODEL_PATH))]))
+
+# 加载模型（weights_only：权重文件只能包含张量，不会反序列化执行任意 Python 对象）
+def load_model(model_path=MODEL_PATH, device=DEVICE):
+    model = models.resnet50(weights=None)
+    model.fc = nn.Linear(model.fc.in_features, NUM_CLASSES)
+    model.load_state_dict(torch.load(model_path, map_location=device, weights_only=True))
     model.eval()
-    return model.to(DEVICE)
+    return model.to(device)
+
+# 特征提取：去掉最后的全连接层，输出 2048 维倒数第二层特征（与原模型共享权重，不额外占用内存）
+EMBEDDING_DIM = 2048
+
+def load_feature_extractor(model):
+    return nn.Sequential(*list(model.children())[:-1], nn.Flatten()).eval()
+
+# 推理模式
+#   fp32         - 原始 eager 模型（默认）
+#   torchscript  - channels_last 内存布局 + 冻结的 TorchScript 图
+#   int8-dynamic - 动态 int8 量化（只量化全连接层）
+#   int8         - 静态 int8 量化（FX 图模式，需要校准数据）+ 冻结的 TorchScript 图
+INFERENCE_MODES = ('fp32', 'torchscript', 'int8-dynamic', 'int8')
+
+def configure_threads(num_threads):
+    """设置 PyTorch 算子内并行线程数，0 表示使用 PyTorch 默认值（物理核数）"""
+    if num_threads and int(num_threads) > 0:
+        torch.set_num_threads(int(num_threads))
+
+def _quantized_engine():
+    engines = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in engines:
+            return engine
+    raise RuntimeError('当前PyTorch不支持int8量化推理')
+
+def _freeze(model, example):
+    # 新版本 PyTorch 对 TorchScript 给出弃用提示，冻结后的图仍可正常使用
+    with warnings.catch_warnings(), torch.no_grad():
+        warnings.simplefilter('ignore')
+        return torch.jit.freeze(torch.jit.trace(model, example))
+
+def optimize_model(model, mode='fp32', calibration_batches=None, device=DEVICE):
+    """
+    把加载好的 fp32 模型转换为指定推理模式
+    Args:
+        model: eval 模式的 ResNet-50
+        mode: INFERENCE_MODES 之一
+        calibration_batches: 静态量化的校准数据，形状为 (N, 3, 224, 224) 的张量列表
+        device: 模型所在设备，int8 模式只支持 CPU
+    Returns:
+        可直接调用的模型
+    """
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f'不支持的推理模式: {mode}，可选: {", ".join(INFERENCE_MODES)}')
+
+    if mode == 'fp32':
+        return model
+
+    if mode.startswith('int8') and device.type != 'cpu':
+        raise ValueError('int8 量化推理只支持CPU')
+
+    example = torch.randn(1, 3, *INPUT_SIZE, device=device)
+
+    if mode == 'torchscript':
+        model = model.to(memory_format=torch.channels_last)
+        return _freeze(model, example.to(memory_format=torch.channels_last))
+
+    # 新版本 PyTorch 对 torch.ao.quantization 给出迁移提示，这里的用法仍然有效
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+
+        if mode == 'int8-dynamic':
+            return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+        engine = _quantized_engine()
+        torch.backends.quantized.engine = engine
+        prepared = prepare_fx(model, get_default_qconfig_mapping(engine), example_inputs=(example,))
+
+        # 校准：统计各层激活值范围，没有校准图片时退化为随机输入
+        with torch.no_grad():
+            for batch in calibration_batches or [torch.randn(8, 3, *INPUT_SIZE)]:
+                prepared(batch)
+
+        return _freeze(convert_fx(prepared), example)
+
+def load_calibration_batches(calibration_dir, max_images=64, batch_size=8):
+    """从目录（可包含子目录）读取校准图片，返回预处理后的张量批次列表"""
+    paths = []
+    for root, _, files in os.walk(calibration_dir):
+        for name in sorted(files):
+            if name.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
+                paths.append(os.path.join(root, name))
+    paths = paths[:max_images]
+
+    tensors = []
+    for path in paths:
+        try:
+            tensors.append(transform(load_image(path)))
+        except Exception:
+            continue
+    return [torch.stack(tensors[i:i + batch_size]) for i in range(0, len(tensors), batch_size)]
+
+
+class DishClassifier:
+    """
+    菜品识别器
+    持有模型、预处理流程和类别映射，每个进程只需创建一次。
+    predict() 可以被多个请求线程并发调用：推理只读取模型参数，不修改共享状态。
+    mode 选择推理模式（见 INFERENCE_MODES），num_threads 设置算子内并行线程数。
+    """
+
+    def __init__(self, model_path=MODEL_PATH, id_name_path=ID_NAME_PATH, device=DEVICE,
+                 mode='fp32', num_threads=0, calibration_dir=None):
+        configure_threads(num_threads)
+
+        # 在其他进程中重新创建同样的识别器所需的参数（推理进程池的子进程按此加载模型）
+        self.options = {'model_path': model_path, 'id_name_path': id_name_path, 'device': device,
+                        'mode': mode, 'calibration_dir': calibration_dir}
+        self.model_path = model_path
+        self.version = model_file_version(model_path)
+        self.device = device
+        self.mode = mode
+        self.memory_format = torch.channels_last if mode == 'torchscript' else torch.contiguous_format
+        self.transform = transform
+        self.id2name = load_id2name(id_name_path)
+
+        calibration_batches = None
+        if mode == 'int8' and calibration_dir:
+            calibration_batches = load_calibration_batches(calibration_dir)
+        model = load_model(model_path, device)
+        self.model = optimize_model(model, mode, calibration_batches, device)
+
+        # 图片特征始终用 fp32 模型提取，保证不同推理模式下的特征可以相互比较；
+        # fp32 模式直接复用已加载的权重，其他模式在第一次提取特征时再加载
+        self._feature_model = load_feature_extractor(model) if mode == 'fp32' else None
+        self._feature_model_lock = threading.Lock()
+
+    def preprocess(self, image):
+        """
+        把图片转换为模型输入张量
+        Args:
+            image: 图片路径、bytes、类文件对象或 PIL.Image
+        Returns:
+            torch.Tensor: 形状为 (3, 224, 224) 的张量
+        """
+        return self.transform(load_image(image))
+
+    def predict_tensors(self, batch, top_k=1):
+        """
+        对一批预处理后的图片执行一次前向计算
+        Args:
+            batch: 形状为 (N, 3, 224, 224) 的张量
+            top_k: 每张图片返回的候选类别数
+        Returns:
+            list: 每张图片的 {'name': 菜品名称, 'confidence': 置信度}，顺序与输入一致；
+                  top_k > 1 时额外包含 'top_k': [{'name', 'confidence'}, ...]
+        """
+        with torch.inference_mode():
+            outputs = self.model(batch.to(self.device, memory_format=self.memory_format))
+            probabilities = torch.nn.functional.softmax(outputs, dim=1)
+            top_k = max(1, min(int(top_k), probabilities.shape[1]))
+            confidences, preds = torch.topk(probabilities, top_k, dim=1)
+
+        results = []
+        for row_confidences, row_preds in zip(confidences.tolist(), preds.tolist()):
+            candidates = [
+                {'name': self.id2name.get(pred_id, "unknown"), 'confidence': float(confidence)}
+                for confidence, pred_id in zip(row_confidences, row_preds)
+            ]
+            result = dict(candidates[0])
+            if top_k > 1:
+                result['top_k'] = candidates
+            results.append(result)
+        return results
+
+    def predict_batch(self, images, top_k=1, max_workers=4):
+        """
+        一次识别多张图片：并行解码和预处理，再合并成一个张量执行一次前向计算
+        Args:
+            images: 图片路径、bytes、类文件对象或 PIL.Image 列表
+            top_k: 每张图片返回的候选类别数
+            max_workers: 并行预处理的线程数
+        Returns:
+            list: 与输入顺序一致的结果，无法处理的图片对应 {'error': 错误信息}
+        """
+        def load(source):
+            try:
+                return self.preprocess(source)
+            except Exception as e:
+                return e
+
+        if not images:
+            return []
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(images)))) as pool:
+            tensors = list(pool.map(load, images))
+
+        results = [{'error': f'图片无法识别: {str(t)}'} if isinstance(t, Exception) else None for t in tensors]
+        valid = [i for i, t in enumerate(tensors) if not isinstance(t, Exception)]
+        if valid:
+            try:
+                predictions = self.predict_tensors(torch.stack([tensors[i] for i in valid]), top_k=top_k)
+                for i, prediction in zip(valid, predictions):
+                    results[i] = prediction
+            except Exception as e:
+                for i in valid:
+                    results[i] = {'error': f'预测过程中出错: {str(e)}'}
+        return results
+
+    def extract_embeddings(self, batch):
+        """
+        提取一批预处理后图片的特征向量
+        Args:
+            batch: 形状为 (N, 3, 224, 224) 的张量
+        Returns:
+            torch.Tensor: 形状为 (N, EMBEDDING_DIM) 的 L2 归一化特征，两两点积即余弦相似度
+        """
+        if self._feature_model is None:
+            with self._feature_model_lock:
+                if self._feature_model is None:
+                    self._feature_model = load_feature_extractor(load_model(self.model_path, self.device))
+
+        with torch.inference_mode():
+            features = self._feature_model(batch.to(self.device))
+            return torch.nn.functional.normalize(features, dim=1).cpu()
+
+    def embed_batch(self, images, batch_size=16, max_workers=4):
+        """
+        提取多张图片的特征向量：并行预处理后分批前向计算
+        Args:
+            images: 图片路径、bytes、类文件对象或 PIL.Image 列表
+        Returns:
+            list: 与输入顺序一致，成功为 float32 的 numpy 向量，无法处理的图片为 None
+        """
+        def load(source):
+            try:
+                return self.preprocess(source)
+            except Exception:
+                return None
+
+        if not images:
+            return []
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(images)))) as pool:
+            tensors = list(pool.map(load, images))
+
+        embeddings = [None] * len(images)
+        valid = [i for i, t in enumerate(tensors) if t is not None]
+        for start in range(0, len(valid), batch_size):
+            chunk = valid[start:start + batch_size]
+            features = self.extract_embeddings(torch.stack([tensors[i] for i in chunk])).numpy()
+            for i, feature in zip(chunk, features):
+                embeddings[i] = feature
+        return embeddings
+
+    def predict(self, image, top_k=1):
+        """
+        预测图片中的菜品
+        Args:
+            image: 图片的绝对路径或相对路径，也可以是 bytes、类文件对象或 PIL.Image
+            top_k: 返回的候选类别数
+        Returns:
+            dict: {'name': 菜品名称, 'confidence': 置信度} 或 {'error': 错误信息}；
+                  top_k > 1 时额外包含 'top_k' 候选列表
+        """
+        try:
+            # 确保图片路径存在
+            if isinstance(image, str) and not os.path.exists(image):
+                return {'error': f'图片文件不存在: {image}'}
+
+            # 加载并预处理图片
+            img_tensor = self.preprocess(image).unsqueeze(0)
+
+            # 执行预测
+            return self.predict_tensors(img_tensor, top_k=top_k)[0]
+
+        except Exception as e:
+            return {'error': f'预测过程中出错: {str(e)}'}
+
+
+# 进程内共享的识别器实例（首次使用时加载模型）
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier(**options):
+    """
+    获取进程内共享的识别器，模型只在第一次调用时加载
+    Args:
+        options: 首次创建时传给 DishClassifier 的参数（mode、num_threads 等），之后的调用忽略
+    Returns:
+        DishClassifier: 识别器实例
+    """
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = DishClassifier(**options)
+    return _classifier
+
+
+def get_loaded_classifier():
+    """获取进程内共享的识别器，尚未加载时返回 None（不会触发加载）"""
+    return _classifier
+
+
+def set_classifier(classifier):
+    """
+    替换进程内共享的识别器（模型热更新），之后调用 get_classifier() 得到的都是新识别器；
+    已经拿到旧识别器的调用方不受影响，继续使用旧模型完成推理
+    Returns:
+        DishClassifier 或 None: 被替换的旧识别器
+    """
+    global _classifier
+    with _classifier_lock:
+        previous, _classifier = _classifier, classifier
+    return previous
 
-model = load_model()
 
 # 预测函数
 def predict_image(image_path):
@@ -51,29 +395,23 @@ def predict_image(image_path):
         dict: {'name': 菜品名称, 'confidence': 置信度} 或 {'error': 错误信息}
     """
     try:
-        # 确保图片路径存在
-        if not os.path.exists(image_path):
-            return {'error': f'图片文件不存在: {image_path}'}
-        
-        # 加载并预处理图片
-        img = Image.open(image_path).convert('RGB')
-        img_tensor = transform(img).unsqueeze(0).to(DEVICE)
-        
-        # 执行预测
-        with torch.no_grad():
-            outputs = model(img_tensor)
-            probabilities = torch.nn.functional.softmax(outputs[0], dim=0)
-            confidence, pred = torch.max(probabilities, 0)
-            pred_id = pred.item()
-            pred_name = id2name.get(pred_id, "unknown")
-            
-            return {
-                'name': pred_name, 
-                'confidence': float(confidence.item())
-            }
-            
+        return get_classifier().predict(image_path)
+    except Exception as e:
+        return {'error': f'模型加载失败: {str(e)}'}
+
+
+def predict_image_data(image):
+    """
+    预测内存中的图片，不读写磁盘
+    Args:
+        image: 图片的 bytes 或 PIL.Image
+    Returns:
+        dict: {'name': 菜品名称, 'confidence': 置信度} 或 {'error': 错误信息}
+    """
+    try:
+        return get_classifier().predict(image)
     except Exception as e:
-        return {'error': f'预测过程中出错: {str(e)}'}
+        return {'error': f'模型加载失败: {str(e)}'}
 
 
 def get_available_classes():
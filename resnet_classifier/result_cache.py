@@ -0,0 +1,202 @@
+# result_cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+
+def bytes_digest(data):
+    """图片原始字节的哈希，用于完全相同的重复上传"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def perceptual_hash(img, hash_size=8):
+    """
+    计算图片的差值感知哈希 (dHash)
+    缩小为 (hash_size + 1) x hash_size 的灰度图后比较相邻像素亮度，得到 hash_size² 位整数。
+    重新压缩、轻微缩放或亮度变化后的同一张照片哈希值只相差少数几位。
+    """
+    small = img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    """两个哈希值之间不同的位数"""
+    return bin(a ^ b).count('1')
+
+
+class ClassificationCache:
+    """
+    识别结果缓存
+    以图片的感知哈希为键的有界LRU缓存，另外用原始字节哈希做精确命中的快速路径。
+    感知哈希之间的汉明距离不超过 max_distance 即视为同一张图片；
+    条目超过 ttl 秒后失效；模型版本变化时清空全部缓存。
+
+    近似查找不逐个比较全部条目：把 64 位哈希切成 max_distance + 1 段，按每一段的取值建立索引。
+    两个哈希最多相差 max_distance 位时，至少有一段完全相同（抽屉原理），
+    所以只需计算与某一段相同的候选条目的汉明距离。
+    """
+
+    HASH_BITS = 64  # perceptual_hash 默认 hash_size=8
+
+    def __init__(self, max_size=1024, ttl=3600, max_distance=4):
+        self.max_size = max(1, int(max_size))
+        self.ttl = ttl
+        self.max_distance = min(max(0, int(max_distance)), self.HASH_BITS - 1)
+        self.model_version = None
+
+        self.hits = 0
+        self.exact_hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()  # phash -> (result, 存入时间)
+        self._digests = {}  # 字节哈希 -> phash
+        self._phash_digests = {}  # phash -> 字节哈希集合，淘汰条目时同步清理
+        self._band_slices = self._split_bands(self.max_distance + 1) if self.max_distance else []
+        self._bands = [{} for _ in self._band_slices]  # 每一段：段的取值 -> phash 集合
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _split_bands(cls, count):
+        """把哈希的各位尽量平均地分成 count 段，返回每段的 (右移位数, 掩码)"""
+        slices = []
+        shift = 0
+        for i in range(count):
+            width = cls.HASH_BITS // count + (1 if i < cls.HASH_BITS % count else 0)
+            slices.append((shift, (1 << width) - 1))
+            shift += width
+        return slices
+
+    def check_model_version(self, model_version):
+        """模型版本变化时清空缓存"""
+        with self._lock:
+            if model_version != self.model_version:
+                self._clear()
+                self.model_version = model_version
+
+    def get_by_digest(self, digest):
+        """
+        精确命中：图片字节完全相同
+        Returns:
+            dict 或 None
+        """
+        with self._lock:
+            phash = self._digests.get(digest)
+            if phash is None:
+                return None
+            result = self._get_entry(phash)
+            if result is None:
+                return None
+            self.hits += 1
+            self.exact_hits += 1
+            return result
+
+    def get(self, phash, digest=None):
+        """
+        感知哈希命中：先查相同哈希，再查汉明距离阈值内最接近的条目
+        Returns:
+            dict 或 None（未命中时计入 misses）
+        """
+        with self._lock:
+            result = self._get_entry(phash)
+            match = phash
+
+            if result is None and self.max_distance > 0:
+                candidates = set()
+                for band, (shift, mask) in zip(self._bands, self._band_slices):
+                    candidates.update(band.get((phash >> shift) & mask, ()))
+                best = None
+                for key in candidates:
+                    distance = hamming_distance(phash, key)
+                    if distance <= self.max_distance and (best is None or (distance, key) < best):
+                        best = (distance, key)
+                if best is not None:
+                    match = best[1]
+                    result = self._get_entry(match)
+
+            if result is None:
+                self.misses += 1
+                return None
+
+            if digest is not None:
+                self._add_digest(digest, match)
+            self.hits += 1
+            return result
+
+    def put(self, phash, result, digest=None):
+        """存入识别结果，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            if phash not in self._entries:
+                for band, (shift, mask) in zip(self._bands, self._band_slices):
+                    band.setdefault((phash >> shift) & mask, set()).add(phash)
+            self._entries[phash] = (result, time.monotonic())
+            self._entries.move_to_end(phash)
+            if digest is not None:
+                self._add_digest(digest, phash)
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def get_stats(self):
+        """获取缓存统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'max_distance': self.max_distance,
+                'hits': self.hits,
+                'exact_hits': self.exact_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'model_version': self.model_version
+            }
+
+    def _get_entry(self, phash):
+        entry = self._entries.get(phash)
+        if entry is None:
+            return None
+        result, stored_at = entry
+        if self.ttl and time.monotonic() - stored_at > self.ttl:
+            self._remove(phash)
+            return None
+        self._entries.move_to_end(phash)
+        return result
+
+    def _add_digest(self, digest, phash):
+        self._digests[digest] = phash
+        self._phash_digests.setdefault(phash, set()).add(digest)
+
+    def _remove(self, phash):
+        """删除一个条目及其字节哈希和分段索引"""
+        del self._entries[phash]
+        for digest in self._phash_digests.pop(phash, ()):
+            if self._digests.get(digest) == phash:
+                del self._digests[digest]
+        for band, (shift, mask) in zip(self._bands, self._band_slices):
+            value = (phash >> shift) & mask
+            keys = band.get(value)
+            if keys is not None:
+                keys.discard(phash)
+                if not keys:
+                    del band[value]
+
+    def _clear(self):
+        self._entries.clear()
+        self._digests.clear()
+        self._phash_digests.clear()
+        for band in self._bands:
+            band.clear()
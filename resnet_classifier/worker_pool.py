@@ -0,0 +1,328 @@
+# worker_pool.py
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from multiprocessing.connection import wait
+
+
+def _worker_main(options, request_queue, response_conn, num_threads, cpus):
+    """
+    推理子进程入口：按 options 重新加载模型，加载完成后发送就绪消息，然后循环处理请求
+    子进程由 spawn 启动，不继承父进程中已经初始化的 OpenMP 线程池，可以放心设置多个 PyTorch 线程
+    """
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+    from resnet_classifier.resnet_predict import DishClassifier
+
+    try:
+        classifier = DishClassifier(num_threads=max(1, num_threads), **options)
+        load_error = None
+    except Exception as e:
+        classifier = None
+        load_error = f'模型加载失败: {str(e)}'
+    response_conn.send((None, load_error))
+
+    while True:
+        item = request_queue.get()
+        if item is None:
+            return
+        request_id, method, args, kwargs = item
+        if classifier is None:
+            result = {'error': load_error}
+        else:
+            try:
+                result = getattr(classifier, method)(*args, **kwargs)
+            except Exception as e:
+                result = {'error': f'预测过程中出错: {str(e)}'}
+        response_conn.send((request_id, result))
+
+
+def _picklable(image):
+    """类文件对象（如上传文件流）不能发送给子进程，先读成 bytes"""
+    if hasattr(image, 'read'):
+        if hasattr(image, 'seek'):
+            image.seek(0)
+        return image.read()
+    return image
+
+
+class _Worker:
+    """一个推理子进程：进程、请求队列和它独占的结果管道"""
+
+    def __init__(self, process, requests, responses):
+        self.process = process
+        self.requests = requests
+        self.responses = responses
+        self.ready = False
+        self.retired = False  # 已退出或被终止，等待重启，不再派发请求
+        self.last_active = time.monotonic()  # 最近一次启动或返回结果的时刻
+
+
+class InferenceWorkerPool:
+    """
+    推理进程池
+    用 spawn 启动多个推理子进程，每个子进程按识别器的参数（DishClassifier.options）各自加载一份模型。
+    父进程已经用多个线程执行过 PyTorch 算子（如启动预热）时，fork 出的子进程会在第一次 OpenMP 运算时卡死，
+    spawn 启动的子进程没有这个问题，代价是每个子进程各占一份权重内存（ResNet-50 约100MB）。
+    Flask 请求线程只负责把图片发给子进程并等待结果，推理不再占用请求线程和父进程的CPU线程。
+    每个子进程可以单独设置 PyTorch 线程数并绑定到固定CPU核，结果通过各自独占的管道返回，
+    一个子进程在写结果时被杀掉也不会影响其他子进程。子进程崩溃，或有请求超时且超时期间没有返回任何结果（卡住）时，
+    终止并重新启动该子进程，它正在处理的请求返回错误。
+    对外提供与 DishClassifier 相同的 predict()、predict_batch() 和 embed_batch() 接口，一次批量请求整体交给一个子进程处理。
+    """
+
+    def __init__(self, classifier, num_workers=2, threads_per_worker=1, pin_cpus=False, timeout=30,
+                 start_timeout=120):
+        self.classifier = classifier
+        self.num_workers = max(1, int(num_workers))
+        self.threads_per_worker = max(1, int(threads_per_worker))
+        self.pin_cpus = pin_cpus
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.restart_count = 0
+
+        self._context = multiprocessing.get_context('spawn')
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = {}  # request_id -> (worker_id, Future)
+        self._workers = [self._start_worker(worker_id) for worker_id in range(self.num_workers)]
+        self._closed = False
+        # 重启子进程后唤醒接收线程，让它开始监听新的结果管道
+        self._wakeup_reader, self._wakeup_writer = self._context.Pipe(duplex=False)
+
+        self._receiver = threading.Thread(target=self._receive_results, name='dish-classifier-pool-receiver',
+                                          daemon=True)
+        self._receiver.start()
+        try:
+            self._wait_ready(start_timeout)
+        except RuntimeError:
+            self.close()
+            raise
+        self._monitor = threading.Thread(target=self._monitor_workers, name='dish-classifier-pool-monitor',
+                                         daemon=True)
+        self._monitor.start()
+
+    def predict(self, image, top_k=1):
+        """
+        预测图片中的菜品（在推理子进程中执行）
+        Args:
+            image: 图片路径、bytes 或 PIL.Image
+            top_k: 返回的候选类别数
+        Returns:
+            dict: {'name': 菜品名称, 'confidence': 置信度} 或 {'error': 错误信息}
+        """
+        return self._call('predict', (image,), {'top_k': top_k})
+
+    def predict_batch(self, images, top_k=1, max_workers=4):
+        """一次识别多张图片（在一个推理子进程中执行），返回值同 DishClassifier.predict_batch"""
+        if not images:
+            return []
+        result = self._call('predict_batch', ([_picklable(image) for image in images],),
+                            {'top_k': top_k, 'max_workers': max_workers})
+        if isinstance(result, dict):
+            return [dict(result) for _ in images]
+        return result
+
+    def embed_batch(self, images, batch_size=16, max_workers=4):
+        """提取多张图片的特征向量（在一个推理子进程中执行），失败的图片为 None"""
+        if not images:
+            return []
+        result = self._call('embed_batch', ([_picklable(image) for image in images],),
+                            {'batch_size': batch_size, 'max_workers': max_workers})
+        if isinstance(result, dict):
+            return [None] * len(images)
+        return result
+
+    def _call(self, method, args, kwargs):
+        """在子进程中调用识别器的方法并等待结果，超时或出错时返回 {'error': 错误信息}"""
+        future = None
+        try:
+            future = self._submit(method, args, kwargs)
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self._abandon(future.request_id)
+            return {'error': f'推理超时（超过{self.timeout}秒）'}
+        except Exception as e:
+            return {'error': f'预测过程中出错: {str(e)}'}
+
+    def _abandon(self, request_id):
+        """
+        放弃超时的请求，不再计入子进程的积压；
+        子进程在整个超时期间（还在加载模型时为 start_timeout）都没有返回任何结果时视为卡住，
+        强制终止后由监控线程重新启动
+        """
+        with self._lock:
+            entry = self._pending.pop(request_id, None)
+            if entry is None:
+                return
+            worker = self._workers[entry[0]]
+            limit = self.timeout if worker.ready else self.start_timeout
+            stuck = not worker.retired and time.monotonic() - worker.last_active >= limit
+            if stuck:
+                worker.retired = True
+        if stuck:
+            worker.process.kill()
+
+    def submit(self, image, top_k=1):
+        """把单张图片的识别请求派发给当前积压最少的子进程，返回 Future"""
+        return self._submit('predict', (image,), {'top_k': top_k})
+
+    def _submit(self, method, args, kwargs):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('推理进程池已关闭')
+            loads = self._loads()
+            available = [worker_id for worker_id, worker in enumerate(self._workers) if not worker.retired]
+            if not available:
+                raise RuntimeError('推理进程正在重启，请稍后重试')
+            worker_id = min(available, key=lambda i: loads[i])
+            request_id = next(self._request_ids)
+            future.request_id = request_id
+            self._pending[request_id] = (worker_id, future)
+            self._workers[worker_id].requests.put((request_id, method, args, kwargs))
+        return future
+
+    def _loads(self):
+        loads = [0] * self.num_workers
+        for worker_id, _ in self._pending.values():
+            loads[worker_id] += 1
+        return loads
+
+    def get_stats(self):
+        """获取进程池运行统计"""
+        with self._lock:
+            loads = self._loads()
+            return {
+                'workers': [
+                    {'pid': worker.process.pid, 'alive': worker.process.is_alive(), 'ready': worker.ready,
+                     'in_flight': loads[i]}
+                    for i, worker in enumerate(self._workers)
+                ],
+                'start_method': 'spawn',
+                'threads_per_worker': self.threads_per_worker,
+                'in_flight': len(self._pending),
+                'restart_count': self.restart_count
+            }
+
+    def close(self):
+        """停止所有子进程"""
+        with self._lock:
+            self._closed = True
+            workers = list(self._workers)
+        for worker in workers:
+            worker.requests.put(None)
+        for worker in workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+            self._discard_queue(worker.requests)
+        self._wakeup_writer.send(None)
+        self._receiver.join(timeout=5)
+
+    @staticmethod
+    def _discard_queue(requests):
+        # 子进程已经退出时，队列里没读走的请求可能让后台写线程一直阻塞，不再等待它写完
+        requests.cancel_join_thread()
+        requests.close()
+
+    def _cpus_for(self, worker_id):
+        if not self.pin_cpus or not hasattr(os, 'sched_getaffinity'):
+            return None
+        available = sorted(os.sched_getaffinity(0))
+        start = worker_id * self.threads_per_worker
+        return {available[(start + i) % len(available)] for i in range(self.threads_per_worker)}
+
+    def _start_worker(self, worker_id):
+        """启动一个子进程（不持有 self._lock，避免启动期间阻塞请求派发和结果接收）"""
+        requests = self._context.Queue()
+        responses, response_writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self.classifier.options, requests, response_writer, self.threads_per_worker,
+                  self._cpus_for(worker_id)),
+            name=f'dish-classifier-worker-{worker_id}',
+            daemon=True
+        )
+        process.start()
+        # 父进程不再持有写端，子进程退出后读端能收到 EOF
+        response_writer.close()
+        return _Worker(process, requests, responses)
+
+    def _wait_ready(self, start_timeout):
+        deadline = time.monotonic() + start_timeout
+        while not all(worker.ready for worker in self._workers):
+            failed = [worker for worker in self._workers if not worker.ready and not worker.process.is_alive()]
+            if failed:
+                raise RuntimeError(f'推理子进程启动失败（exitcode={failed[0].process.exitcode}）')
+            if time.monotonic() > deadline:
+                raise RuntimeError(f'推理子进程在 {start_timeout} 秒内未完成模型加载')
+            time.sleep(0.05)
+
+    def _receive_results(self):
+        # 结果管道只在这个线程中关闭：已退出子进程的管道，以及重启后被替换的管道
+        connections = {}
+        while True:
+            with self._lock:
+                current = {worker.responses: worker for worker in self._workers}
+            for connection in connections:
+                if connection not in current and not connection.closed:
+                    connection.close()
+            connections = {connection: worker for connection, worker in current.items() if not connection.closed}
+            ready = wait(list(connections) + [self._wakeup_reader])
+            for connection in ready:
+                if connection is self._wakeup_reader:
+                    if self._wakeup_reader.recv() is None:
+                        return
+                    continue
+                worker = connections[connection]
+                try:
+                    request_id, result = connection.recv()
+                except (EOFError, OSError):
+                    # 子进程已退出，由监控线程重启
+                    connection.close()
+                    continue
+                with self._lock:
+                    worker.last_active = time.monotonic()
+                    if request_id is None:
+                        worker.ready = True
+                        continue
+                    entry = self._pending.pop(request_id, None)
+                if entry is not None:
+                    entry[1].set_result(result)
+
+    def _monitor_workers(self):
+        while not self._closed:
+            time.sleep(1)
+            with self._lock:
+                if self._closed:
+                    return
+                dead = [worker_id for worker_id, worker in enumerate(self._workers) if not worker.process.is_alive()]
+                failed = []
+                for worker_id in dead:
+                    worker = self._workers[worker_id]
+                    worker.retired = True
+                    # 子进程退出：正在处理的请求返回错误
+                    for request_id, (owner, future) in list(self._pending.items()):
+                        if owner == worker_id:
+                            del self._pending[request_id]
+                            failed.append((future, worker.process.exitcode))
+            for future, exitcode in failed:
+                future.set_result({'error': f'推理进程异常退出（exitcode={exitcode}），请重试'})
+
+            # 在锁外启动新的子进程，然后替换并唤醒接收线程
+            for worker_id in dead:
+                worker = self._start_worker(worker_id)
+                with self._lock:
+                    if self._closed:
+                        worker.process.terminate()
+                        return
+                    previous = self._workers[worker_id]
+                    self._workers[worker_id] = worker
+                    self.restart_count += 1
+                self._discard_queue(previous.requests)
+                self._wakeup_writer.send(True)
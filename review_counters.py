@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+评价计数维护
+reviews.likes / reviews.reply_count 保存每条评价的点赞数和回复数，reviews.latest_replies 缓存最新
+REVIEW_REPLY_PREVIEW_SIZE 条回复（JSON）。点赞、回复的增删在同一事务中用 UPDATE ... SET x = x ± 1
+原子更新计数并重新生成该评价的回复预览，评价列表直接读取这些列，不再为每条评价加载点赞和回复记录。
+计数或预览与点赞表、回复表不一致时（如历史数据、并发回复、直接改库）用 flask reconcile-review-counts 校正。
+"""
+
+import json
+
+from sqlalchemy import func, select
+
+from app import app, db
+from models import User, Review, ReviewReply, Like
+
+# 计数列：(评价表中的计数列, 明细表的评价ID列, 明细表主键)
+COUNTERS = {
+    'likes': (Review.likes, Like.review_id, Like.like_id),
+    'reply_count': (Review.reply_count, ReviewReply.review_id, ReviewReply.reply_id),
+}
+
+
+def _preview_size():
+    return max(0, app.config.get('REVIEW_REPLY_PREVIEW_SIZE', 3))
+
+
+def _change_counter(field, review_id, delta):
+    column = COUNTERS[field][0]
+    if delta:
+        Review.query.filter_by(review_id=review_id)\
+                    .update({column: func.coalesce(column, 0) + delta}, synchronize_session=False)
+    return db.session.query(column).filter_by(review_id=review_id).scalar() or 0
+
+
+def change_like_count(review_id, delta):
+    """
+    点赞变更后、提交前调用，原子增减评价的点赞数
+    Args:
+        review_id: 评价ID
+        delta: 增量（点赞 1，取消点赞 -1）
+    Returns:
+        int: 更新后的点赞数（本事务中读取）
+    """
+    return _change_counter('likes', review_id, delta)
+
+
+def remove_user_likes(user_id):
+    """
+    删除用户的全部点赞（删除用户时调用），并把这些评价的点赞数各减1
+    Returns:
+        int: 删除的点赞数
+    """
+    liked = select(Like.review_id).where(Like.user_id == user_id)
+    Review.query.filter(Review.review_id.in_(liked))\
+                .update({Review.likes: func.coalesce(Review.likes, 0) - 1}, synchronize_session=False)
+    return Like.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+
+
+def change_reply_count(review_id, delta):
+    """
+    回复新增或删除后、提交前调用，原子增减评价的回复数并重新生成回复预览
+    Args:
+        review_id: 评价ID
+        delta: 增量（新增 1，删除 -1）
+    Returns:
+        int: 更新后的回复数（本事务中读取）
+    """
+    db.session.flush()
+    count = _change_counter('reply_count', review_id, delta)
+    refresh_reply_previews([review_id])
+    return count
+
+
+def remove_user_replies(user_id):
+    """
+    删除用户的全部回复（删除用户时调用），减去相应评价的回复数并重新生成这些评价的回复预览
+    Returns:
+        int: 删除的回复数
+    """
+    counts = db.session.query(ReviewReply.review_id, func.count(ReviewReply.reply_id))\
+                       .filter(ReviewReply.user_id == user_id)\
+                       .group_by(ReviewReply.review_id).all()
+    deleted = ReviewReply.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    for review_id, count in counts:
+        _change_counter('reply_count', review_id, -count)
+    refresh_reply_previews([review_id for review_id, _ in counts])
+    return deleted
+
+
+def compute_reply_previews(review_ids=None):
+    """
+    按回复表计算评价的最新回复预览（一次查询，按评价分区取最新 REVIEW_REPLY_PREVIEW_SIZE 条）
+    Args:
+        review_ids: 评价ID列表，None 表示全部评价
+    Returns:
+        dict: {评价ID: [回复（与 ReviewReply.to_dict 相同），按时间正序]}，没有回复的评价不出现在结果中
+    """
+    size = _preview_size()
+    if not size:
+        return {}
+    position = func.row_number().over(
+        partition_by=ReviewReply.review_id,
+        order_by=(ReviewReply.created_at.desc(), ReviewReply.reply_id.desc())
+    ).label('position')
+    latest = db.session.query(ReviewReply.reply_id, position)
+    if review_ids is not None:
+        latest = latest.filter(ReviewReply.review_id.in_(review_ids))
+    latest = latest.subquery()
+
+    rows = db.session.query(ReviewReply.review_id, ReviewReply.reply_id, ReviewReply.user_id, User.nickname,
+                            ReviewReply.content, ReviewReply.created_at)\
+                     .join(latest, latest.c.reply_id == ReviewReply.reply_id)\
+                     .outerjoin(User, User.user_id == ReviewReply.user_id)\
+                     .filter(latest.c.position <= size)\
+                     .order_by(ReviewReply.review_id, ReviewReply.created_at, ReviewReply.reply_id).all()
+    previews = {}
+    for row in rows:
+        previews.setdefault(row.review_id, []).append({
+            'replyId': row.reply_id,
+            'userId': row.user_id,
+            'userNickname': row.nickname,
+            'content': row.content,
+            'createTime': row.created_at.isoformat() if row.created_at else None
+        })
+    return previews
+
+
+def _preview_text(replies):
+    return json.dumps(replies, ensure_ascii=False) if replies else None
+
+
+def refresh_reply_previews(review_ids):
+    """
+    提交前调用，重新生成这些评价的回复预览（如用户修改昵称后刷新其回复所在的评价）
+    Args:
+        review_ids: 评价ID列表
+    """
+    review_ids = list(set(review_ids))
+    if not review_ids:
+        return
+    previews = compute_reply_previews(review_ids)
+    for review_id in review_ids:
+        Review.query.filter_by(review_id=review_id)\
+                    .update({Review._latest_replies_text: _preview_text(previews.get(review_id))},
+                            synchronize_session=False)
+
+
+REVIEW_COUNT_FIELDS = tuple(COUNTERS) + ('latest_replies',)
+
+
+def reconcile_review_counts(fix=True, fields=REVIEW_COUNT_FIELDS):
+    """
+    按点赞表、回复表（每个计数一次 GROUP BY）校验所有评价的点赞数、回复数和回复预览
+    Args:
+        fix: 是否校正不一致的计数和预览并提交
+        fields: 要校验的字段，默认全部（'likes' / 'reply_count' / 'latest_replies'）
+    Returns:
+        list: 不一致项 {'review_id', 'field', 'expected', 'actual'}
+    """
+    counters = [field for field in COUNTERS if field in fields]
+    expected = {field: dict(db.session.query(COUNTERS[field][1], func.count(COUNTERS[field][2]))
+                            .group_by(COUNTERS[field][1]).all())
+                for field in counters}
+    columns = [Review.review_id] + [COUNTERS[field][0] for field in counters]
+    check_previews = 'latest_replies' in fields
+    if check_previews:
+        previews = compute_reply_previews()
+        columns.append(Review._latest_replies_text.label('latest_replies'))
+
+    issues = []
+    for row in db.session.query(*columns).all():
+        for field in counters:
+            count = expected[field].get(row.review_id, 0)
+            if getattr(row, field) != count:
+                issues.append({'review_id': row.review_id, 'field': field, 'expected': count,
+                               'actual': getattr(row, field)})
+        if check_previews:
+            preview = _preview_text(previews.get(row.review_id))
+            if row.latest_replies != preview:
+                issues.append({'review_id': row.review_id, 'field': 'latest_replies', 'expected': preview,
+                               'actual': row.latest_replies})
+
+    if fix and issues:
+        for field in counters:
+            column, review_column, key = COUNTERS[field]
+            review_ids = [issue['review_id'] for issue in issues if issue['field'] == field]
+            if review_ids:
+                # 用关联子查询重新计数，校正期间发生的点赞、回复也不会被覆盖
+                actual_count = select(func.count(key)).where(review_column == Review.review_id).scalar_subquery()
+                Review.query.filter(Review.review_id.in_(review_ids))\
+                            .update({column: actual_count}, synchronize_session=False)
+        refresh_reply_previews([issue['review_id'] for issue in issues if issue['field'] == 'latest_replies'])
+        db.session.commit()
+        db.session.expire_all()
+    return issues
@@ -1,14 +1,29 @@
 from flask import request, jsonify, send_from_directory
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
+from sqlalchemy.orm import joinedload
 import os
-from datetime import datetime
+import queue
+from datetime import datetime, timedelta
 from PIL import Image
 import uuid
 
 from app import app, db
 from models import User, Canteen, Window, Dish, Review, ReviewReply, Like
+from ai_service import (
+    classify_image_data, classify_image_batch, build_classification_data, get_job_store, get_readiness,
+    get_model_status, get_request_deadline, resolve_upload_path
+)
+from resnet_classifier.admission import AdmissionRejected
+from dish_index import get_matching_dishes
+from rating_aggregates import rating_snapshot, apply_rating_change, load_rating_summaries, load_child_counts
+from rating_stats import get_rating_stats
+from review_counters import change_like_count, change_reply_count, refresh_reply_previews
+from stats_overview import get_overview
+from leaderboards import METRICS as LEADERBOARD_METRICS, get_leaderboards
+from rating_trends import GRANULARITIES, get_rating_trend, hourly_cutoff, to_local, to_utc, truncate
+from dish_embeddings import get_embedding_index, embed_image, find_similar_dishes
 
 
 # 辅助函数
@@ -45,6 +60,30 @@ def save_uploaded_file(file, upload_dir):
     return None
 
 
+def get_stats_scope():
+    """统计接口的范围参数 dish_id / window_id / canteen_id，返回 (层级, ID)，都没有时为 (None, None) 即全站"""
+    for level in ('dish', 'window', 'canteen'):
+        key = request.args.get(f'{level}_id', type=int)
+        if key:
+            return level, key
+    return None, None
+
+
+def parse_date_range():
+    """
+    统计接口的日期参数 start_date / end_date（YYYY-MM-DD，按 RATING_TREND_UTC_OFFSET 时区的本地日期，含当天）
+    Returns:
+        tuple: (开始日期0点, 结束日期次日0点)，未传的为 None
+    Raises:
+        ValueError: 日期格式错误
+    """
+    start = request.args.get('start_date')
+    end = request.args.get('end_date')
+    start = datetime.strptime(start, '%Y-%m-%d') if start else None
+    end = datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1) if end else None
+    return start, end
+
+
 # ================== 用户认证相关接口 ==================
 
 @app.route('/api/register', methods=['POST'])
@@ -179,8 +218,11 @@ def update_user_info():
         # 更新昵称
         if 'nickname' in data:
             nickname = data['nickname'].strip()
-            if nickname:
+            if nickname and nickname != user.nickname:
                 user.nickname = nickname
+                # 回复预览中保存了昵称，刷新该用户回复过的评价
+                replied = db.session.query(ReviewReply.review_id).filter_by(user_id=user.user_id).distinct()
+                refresh_reply_previews([review_id for review_id, in replied])
         
         # 更新头像
         if 'avatar' in data:
@@ -241,7 +283,7 @@ def get_user_reviews():
                 'images': review.images,
                 'created_at': review.created_at.isoformat(),
                 'like_count': review.like_count,
-                'reply_count': review.reply_count
+                'reply_count': review.reply_count or 0
             })
         
         return jsonify({
@@ -269,8 +311,14 @@ def get_canteens():
     try:
         canteens = Canteen.query.all()
         
+        # 整页的评分汇总和窗口数各一次查询
+        canteen_ids = [canteen.canteen_id for canteen in canteens]
+        summaries = load_rating_summaries('canteen', canteen_ids)
+        window_counts = load_child_counts('canteen', canteen_ids)
+        
         result = []
         for canteen in canteens:
+            summary = summaries[canteen.canteen_id]
             result.append({
                 'id': canteen.id,
                 'name': canteen.name,
@@ -279,9 +327,9 @@ def get_canteens():
                 'contact': canteen.contact,
                 'description': canteen.description,
                 'images': canteen.images,
-                'average_rating': canteen.get_average_rating(),
-                'review_count': canteen.get_review_count(),
-                'window_count': len(canteen.windows)
+                'average_rating': summary.get_average('overall'),
+                'review_count': summary.review_count,
+                'window_count': window_counts[canteen.canteen_id]
             })
         
         return jsonify({
@@ -302,20 +350,26 @@ def get_canteen_detail(canteen_id):
         if not canteen:
             return jsonify({'code': 404, 'message': '食堂不存在'}), 404
         
-        # 获取窗口信息
+        # 获取窗口信息（评分汇总和菜品数各一次查询）
+        window_ids = [window.window_id for window in canteen.windows]
+        summaries = load_rating_summaries('window', window_ids)
+        dish_counts = load_child_counts('window', window_ids)
+        
         windows = []
         for window in canteen.windows:
+            summary = summaries[window.window_id]
             windows.append({
                 'id': window.id,
                 'name': window.name,
                 'description': window.description,
                 'business_hours': window.business_hours,
                 'images': window.images,
-                'average_rating': window.get_average_rating(),
-                'review_count': window.get_review_count(),
-                'dish_count': len(window.dishes)
+                'average_rating': summary.get_average('overall'),
+                'review_count': summary.review_count,
+                'dish_count': dish_counts[window.window_id]
             })
         
+        canteen_summary = canteen.get_rating_summary()
         result = {
             'id': canteen.id,
             'name': canteen.name,
@@ -324,8 +378,8 @@ def get_canteen_detail(canteen_id):
             'contact': canteen.contact,
             'description': canteen.description,
             'images': canteen.images,
-            'average_rating': canteen.get_average_rating(),
-            'review_count': canteen.get_review_count(),
+            'average_rating': canteen_summary.get_average('overall'),
+            'review_count': canteen_summary.review_count,
             'windows': windows
         }
         
@@ -349,9 +403,12 @@ def get_window_detail(window_id):
         if not window:
             return jsonify({'code': 404, 'message': '窗口不存在'}), 404
         
-        # 获取菜品信息
+        # 获取菜品信息（评分汇总一次查询）
+        summaries = load_rating_summaries('dish', [dish.dish_id for dish in window.dishes])
+        
         dishes = []
         for dish in window.dishes:
+            summary = summaries[dish.dish_id]
             dishes.append({
                 'id': dish.id,
                 'name': dish.name,
@@ -359,11 +416,12 @@ def get_window_detail(window_id):
                 'category': dish.category,
                 'description': dish.description,
                 'images': dish.images,
-                'average_rating': dish.get_average_rating(),
-                'review_count': dish.get_review_count(),
+                'average_rating': summary.get_average('overall'),
+                'review_count': summary.review_count,
                 'is_available': dish.is_available
             })
         
+        window_summary = window.get_rating_summary()
         result = {
             'id': window.id,
             'name': window.name,
@@ -375,8 +433,8 @@ def get_window_detail(window_id):
                 'name': window.canteen.name,
                 'location': window.canteen.location
             },
-            'average_rating': window.get_average_rating(),
-            'review_count': window.get_review_count(),
+            'average_rating': window_summary.get_average('overall'),
+            'review_count': window_summary.review_count,
             'dishes': dishes
         }
         
@@ -420,11 +478,15 @@ def get_dishes():
         # 只显示可用的菜品
         query = query.filter_by(is_available=True)
         
-        dishes = query.order_by(Dish.created_at.desc())\
+        # 所属窗口和食堂随菜品一起连接查询
+        dishes = query.options(joinedload(Dish.window).joinedload(Window.canteen))\
+                     .order_by(Dish.created_at.desc())\
                      .paginate(page=page, per_page=per_page, error_out=False)
+        summaries = load_rating_summaries('dish', [dish.dish_id for dish in dishes.items])
         
         result = []
         for dish in dishes.items:
+            summary = summaries[dish.dish_id]
             result.append({
                 'id': dish.id,
                 'name': dish.name,
@@ -437,8 +499,8 @@ def get_dishes():
                     'name': dish.window.name,
                     'canteen_name': dish.window.canteen.name
                 },
-                'average_rating': dish.get_average_rating(),
-                'review_count': dish.get_review_count(),
+                'average_rating': summary.get_average('overall'),
+                'review_count': summary.review_count,
                 'is_available': dish.is_available
             })
         
@@ -500,6 +562,34 @@ def get_dish_detail(dish_id):
         return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
 
 
+@app.route('/api/dishes/<int:dish_id>/similar', methods=['GET'])
+def get_similar_dishes(dish_id):
+    """获取外观相似的菜品（按菜品图片的特征余弦相似度，跨所有食堂）"""
+    try:
+        dish = Dish.query.get(dish_id)
+        if not dish:
+            return jsonify({'code': 404, 'message': '菜品不存在'}), 404
+        
+        limit = request.args.get('limit', 10, type=int)
+        limit = max(1, min(limit, 50))
+        
+        vector = get_embedding_index().get_dish_vector(dish_id)
+        if vector is None:
+            return jsonify({
+                'code': 200,
+                'message': '该菜品暂无可用于比较的图片',
+                'data': []
+            }), 200
+        
+        return jsonify({
+            'code': 200,
+            'data': find_similar_dishes(vector, limit=limit, exclude_dish_ids=(dish_id,))
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
+
+
 # ================== 评价相关接口 ==================
 
 @app.route('/api/dishes/<int:dish_id>/reviews', methods=['GET'])
@@ -535,7 +625,8 @@ def get_dish_reviews(dish_id):
                 'content': review.content,
                 'images': review.images,
                 'like_count': review.like_count,
-                'reply_count': review.reply_count,
+                'reply_count': review.reply_count or 0,
+                'latest_replies': review.latest_replies,
                 'created_at': review.created_at.isoformat()
             })
         
@@ -606,6 +697,8 @@ def create_review(dish_id):
         )
         
         db.session.add(review)
+        db.session.flush()
+        apply_rating_change(dish_id, new=rating_snapshot(review), created_at=review.created_at)
         db.session.commit()
         
         return jsonify({
@@ -647,6 +740,8 @@ def update_review(review_id):
         if not data:
             return jsonify({'code': 400, 'message': '请求数据不能为空'}), 400
         
+        old_ratings = rating_snapshot(review)
+        
         # 更新评分 - 支持驼峰和下划线两种命名方式
         overall_rating_key = 'overallRating' if 'overallRating' in data else 'overall_rating'
         if overall_rating_key in data:
@@ -689,6 +784,7 @@ def update_review(review_id):
                 images = [images] if images else []
             review.images = images
         
+        apply_rating_change(review.dish_id, old=old_ratings, new=rating_snapshot(review), created_at=review.created_at)
         db.session.commit()
         
         return jsonify({
@@ -726,6 +822,7 @@ def delete_review(review_id):
             return jsonify({'code': 403, 'message': '无权限删除此评价'}), 403
         
         db.session.delete(review)
+        apply_rating_change(review.dish_id, old=rating_snapshot(review), created_at=review.created_at)
         db.session.commit()
         
         return jsonify({
@@ -751,24 +848,21 @@ def like_review(review_id):
         if not review:
             return jsonify({'code': 404, 'message': '评价不存在'}), 404
         
-        # 检查是否已经点赞
-        existing_like = Like.query.filter_by(user_id=user_id, review_id=review_id).first()
+        # 已点赞则取消点赞，否则点赞；点赞数在同一事务中原子增减
+        deleted = Like.query.filter_by(user_id=user_id, review_id=review_id).delete(synchronize_session=False)
         
-        if existing_like:
-            # 取消点赞
-            db.session.delete(existing_like)
+        if deleted:
             action = 'unliked'
+            like_count = change_like_count(review_id, -deleted)
         else:
-            # 点赞
             like = Like(user_id=user_id, review_id=review_id)
             db.session.add(like)
+            db.session.flush()
             action = 'liked'
+            like_count = change_like_count(review_id, 1)
         
         db.session.commit()
         
-        # 更新点赞数
-        like_count = Like.query.filter_by(review_id=review_id).count()
-        
         return jsonify({
             'code': 200,
             'message': '操作成功',
@@ -860,6 +954,7 @@ def create_reply(review_id):
         )
         
         db.session.add(reply)
+        reply_count = change_reply_count(review_id, 1)
         db.session.commit()
         
         return jsonify({
@@ -868,7 +963,8 @@ def create_reply(review_id):
             'data': {
                 'id': reply.id,
                 'content': reply.content,
-                'created_at': reply.created_at.isoformat()
+                'created_at': reply.created_at.isoformat(),
+                'reply_count': reply_count
             }
         }), 201
         
@@ -892,6 +988,7 @@ def delete_reply(reply_id):
             return jsonify({'code': 403, 'message': '无权限删除此回复'}), 403
         
         db.session.delete(reply)
+        change_reply_count(reply.review_id, -1)
         db.session.commit()
         
         return jsonify({
@@ -954,19 +1051,20 @@ def uploaded_file(filename):
 
 @app.route('/api/stats/overview', methods=['GET'])
 def get_stats_overview():
-    """获取系统概览统计"""
+    """
+    获取系统概览统计
+    返回内存中的统计快照（定时刷新），refreshed_at 为统计时间；管理员可传 fresh=1 立即重新统计
+    """
+    fresh = request.args.get('fresh') in ('1', 'true')
+    if fresh:
+        verify_jwt_in_request(optional=True)
+        current_user_id = get_jwt_identity()
+        user = User.query.get(current_user_id) if current_user_id else None
+        if not user or user.role != 'admin':
+            return jsonify({'code': 403, 'message': '需要管理员权限'}), 403
+    
     try:
-        stats = {
-            'user_count': User.query.count(),
-            'canteen_count': Canteen.query.count(),
-            'window_count': Window.query.count(),
-            'dish_count': Dish.query.count(),
-            'review_count': Review.query.count(),
-            'total_rating_sum': db.session.query(db.func.sum(Review.overall_rating)).scalar() or 0,
-            'average_rating': round(
-                (db.session.query(db.func.avg(Review.overall_rating)).scalar() or 0), 2
-            )
-        }
+        stats = get_overview(fresh=fresh)
         
         return jsonify({
             'code': 200,
@@ -984,30 +1082,18 @@ def get_popular_dishes():
         limit = request.args.get('limit', 10, type=int)
         limit = min(limit, 50)
         
-        # 按评价数量排序获取热门菜品
-        popular_dishes = db.session.query(
-            Dish.dish_id,
-            Dish.name,
-            Window.name.label('window_name'),
-            Canteen.name.label('canteen_name'),
-            db.func.count(Review.review_id).label('review_count'),
-            db.func.avg(Review.overall_rating).label('avg_rating')
-        ).join(Review, Dish.dish_id == Review.dish_id)\
-         .join(Window, Dish.window_id == Window.window_id)\
-         .join(Canteen, Window.canteen_id == Canteen.canteen_id)\
-         .group_by(Dish.dish_id, Dish.name, Window.name, Canteen.name)\
-         .order_by(db.func.count(Review.review_id).desc())\
-         .limit(limit).all()
+        # 全站按评价数排行榜的前 limit 名（内存中的有序排行榜）
+        _, items = get_leaderboards().get_page('global', None, 'volume', 0, limit)
         
         result = []
-        for dish in popular_dishes:
+        for item in items:
             result.append({
-                'dish_id': dish.dish_id,
-                'dish_name': dish.name,
-                'window_name': dish.window_name,
-                'canteen_name': dish.canteen_name,
-                'review_count': dish.review_count,
-                'average_rating': round(float(dish.avg_rating), 2)
+                'dish_id': item['dish_id'],
+                'dish_name': item['dish_name'],
+                'window_name': item['window_name'],
+                'canteen_name': item['canteen_name'],
+                'review_count': item['review_count'],
+                'average_rating': item['average_rating']
             })
         
         return jsonify({
@@ -1019,18 +1105,79 @@ def get_popular_dishes():
         return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
 
 
+@app.route('/api/stats/leaderboard', methods=['GET'])
+def get_leaderboard():
+    """
+    获取菜品排行榜（内存中的有序排行榜，本进程的评价变更增量更新，定期全量计算）
+    scope: global（默认）/ canteen（需 canteen_id）/ category（需 category）
+    sort: score（贝叶斯平均分，默认）/ volume（评价数）
+    """
+    try:
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 20, type=int)
+        page = max(page, 1)
+        per_page = max(1, min(per_page, 100))
+        
+        scope = request.args.get('scope', 'global')
+        sort = request.args.get('sort', 'score')
+        if sort not in LEADERBOARD_METRICS:
+            return jsonify({'code': 400, 'message': 'sort 只能为 score 或 volume'}), 400
+        
+        if scope == 'global':
+            key = None
+        elif scope == 'canteen':
+            key = request.args.get('canteen_id', type=int)
+            if not key:
+                return jsonify({'code': 400, 'message': '食堂ID不能为空'}), 400
+        elif scope == 'category':
+            key = request.args.get('category', '').strip()
+            if not key:
+                return jsonify({'code': 400, 'message': '分类不能为空'}), 400
+        else:
+            return jsonify({'code': 400, 'message': 'scope 只能为 global、canteen 或 category'}), 400
+        
+        leaderboards = get_leaderboards()
+        total, items = leaderboards.get_page(scope, key, sort, (page - 1) * per_page, per_page)
+        
+        return jsonify({
+            'code': 200,
+            'data': {
+                'scope': scope,
+                'sort': sort,
+                'prior_mean': round(leaderboards.prior_mean, 3),
+                'dishes': items,
+                'pagination': {
+                    'page': page,
+                    'per_page': per_page,
+                    'total': total,
+                    'pages': (total + per_page - 1) // per_page
+                }
+            }
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
+
+
 @app.route('/api/stats/rating-distribution', methods=['GET'])
 def get_rating_distribution():
-    """获取评分分布统计"""
+    """
+    获取评分分布统计
+    可选参数 dish_id / window_id / canteen_id 限定统计范围（默认全站），
+    start_date / end_date（YYYY-MM-DD，含当天）限定评价时间
+    """
     try:
-        # 统计各评分区间的数量
-        distribution = {}
-        for i in range(1, 6):
-            count = Review.query.filter(
-                Review.overall_rating >= i,
-                Review.overall_rating < i + 1 if i < 5 else Review.overall_rating <= 5
-            ).count()
-            distribution[f'{i}星'] = count
+        level, key = get_stats_scope()
+        try:
+            start, end = parse_date_range()
+        except ValueError:
+            return jsonify({'code': 400, 'message': '日期格式应为YYYY-MM-DD'}), 400
+        
+        # 各星级的数量一次扫描评价表得到
+        stats = get_rating_stats(level, key,
+                                 start=to_utc(start) if start else None,
+                                 end=to_utc(end) if end else None)
+        distribution = {f'{star}星': count for star, count in stats.get_distribution().items()}
         
         return jsonify({
             'code': 200,
@@ -1041,59 +1188,115 @@ def get_rating_distribution():
         return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
 
 
+@app.route('/api/stats/rating-trend', methods=['GET'])
+def get_rating_trend_stats():
+    """
+    获取评分趋势（只读评分时间分桶表）
+    可选参数 dish_id / window_id / canteen_id 限定范围（默认全站）；
+    granularity 为 day（默认最近30天）或 hour（只保留最近 RATING_TREND_HOURLY_DAYS 天，默认今天）；
+    start_date / end_date（YYYY-MM-DD，含当天）限定时间范围
+    """
+    try:
+        level, key = get_stats_scope()
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in GRANULARITIES:
+            return jsonify({'code': 400, 'message': 'granularity 只能为 day 或 hour'}), 400
+        
+        try:
+            start, end = parse_date_range()
+        except ValueError:
+            return jsonify({'code': 400, 'message': '日期格式应为YYYY-MM-DD'}), 400
+        
+        now = to_local(datetime.utcnow())
+        if granularity == 'day':
+            end = end or truncate(now, 'day') + timedelta(days=1)
+            start = start or end - timedelta(days=30)
+            max_buckets = 366
+        else:
+            start = start or truncate(now, 'day')
+            end = end or truncate(now, 'hour') + timedelta(hours=1)
+            max_buckets = 24 * 31
+            if start < hourly_cutoff():
+                days = app.config.get('RATING_TREND_HOURLY_DAYS', 2)
+                return jsonify({'code': 400, 'message': f'小时趋势只保留最近{days}天'}), 400
+        
+        if end <= start:
+            return jsonify({'code': 400, 'message': '结束日期不能早于开始日期'}), 400
+        if (end - start) / GRANULARITIES[granularity] > max_buckets:
+            return jsonify({'code': 400, 'message': f'时间范围最多{max_buckets}{"天" if granularity == "day" else "小时"}'}), 400
+        
+        series = []
+        for bucket_start, stats in get_rating_trend(level, key, granularity, start, end):
+            series.append({
+                'time': bucket_start.isoformat(),
+                'review_count': stats.review_count,
+                'rating_sum': stats.overall_sum,
+                'average_rating': stats.get_average('overall', digits=2),
+                'dimension_averages': {
+                    dimension: stats.get_average(dimension, digits=2)
+                    for dimension in ('taste', 'portion', 'value', 'service')
+                }
+            })
+        
+        return jsonify({
+            'code': 200,
+            'data': {
+                'granularity': granularity,
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                'series': series
+            }
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
+
+
 # ================== AI菜品识别接口 ==================
 
 @app.route('/api/classify-dish', methods=['POST'])
 def classify_dish():
     """
     AI菜品图片识别接口
-    上传图片文件，返回AI识别的菜品名称
+    上传图片文件，返回AI识别的菜品名称；
+    也可以传 image_url（/api/upload 返回的 filename 或 url，表单字段或JSON均可），直接识别已上传的图片，无需再次上传
+    请求头 X-Request-Timeout-Ms 可以缩短默认的截止时间（CLASSIFIER_REQUEST_DEADLINE_MS），
+    推理排队无法在截止时间前开始时立即返回 503 和 Retry-After
     注意：此接口为独立的AI识别模块，不需要登录认证
     """
     try:
-        # 检查是否有文件
-        if 'image' not in request.files:
-            return jsonify({'code': 400, 'message': '请上传图片文件'}), 400
-        
-        file = request.files['image']
-        if file.filename == '':
-            return jsonify({'code': 400, 'message': '未选择文件'}), 400
-        
-        # 检查文件类型
-        if not allowed_file(file.filename):
-            return jsonify({'code': 400, 'message': '不支持的文件格式，请上传 PNG、JPG、JPEG 或 GIF 格式的图片'}), 400
+        deadline = get_request_deadline(request.headers.get('X-Request-Timeout-Ms', type=int))
         
-        # 保存上传的文件到临时目录
-        upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'temp')
-        filename = save_uploaded_file(file, upload_dir)
+        image_url = request.form.get('image_url') or (request.get_json(silent=True) or {}).get('image_url')
         
-        if not filename:
-            return jsonify({'code': 400, 'message': '文件保存失败'}), 400
+        if 'image' in request.files:
+            file = request.files['image']
+            if file.filename == '':
+                return jsonify({'code': 400, 'message': '未选择文件'}), 400
+            
+            # 检查文件类型
+            if not allowed_file(file.filename):
+                return jsonify({'code': 400, 'message': '不支持的文件格式，请上传 PNG、JPG、JPEG 或 GIF 格式的图片'}), 400
+            
+            # 直接读取上传内容，在内存中解码识别，不写临时文件
+            image_data = file.read()
+        elif image_url:
+            # 识别之前通过 /api/upload 上传的图片，直接从 UPLOAD_FOLDER 读取；同一张图片再次识别时命中结果缓存
+            file_path = resolve_upload_path(image_url) if isinstance(image_url, str) else None
+            if not file_path:
+                return jsonify({'code': 404, 'message': '图片不存在，请先通过 /api/upload 上传'}), 404
+            with open(file_path, 'rb') as f:
+                image_data = f.read()
+        else:
+            return jsonify({'code': 400, 'message': '请上传图片文件'}), 400
         
-        # 获取图片的绝对路径
-        image_path = os.path.abspath(os.path.join(upload_dir, filename))
+        if not image_data:
+            return jsonify({'code': 400, 'message': '上传的文件为空'}), 400
         
         # 调用AI分类模型
         try:
-            import sys
-            import importlib.util
-            
-            # 动态加载模块
-            classifier_path = os.path.join(os.path.dirname(__file__), 'resnet_classifier')
-            predict_module_path = os.path.join(classifier_path, 'resnet_predict.py')
-            
-            spec = importlib.util.spec_from_file_location("resnet_predict", predict_module_path)
-            resnet_predict = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(resnet_predict)
-            
-            # 执行AI识别
-            result = resnet_predict.predict_image(image_path)
-            
-            # 清理临时文件
-            try:
-                os.remove(image_path)
-            except:
-                pass
+            # 使用进程内共享的识别器（模型只加载一次，并发请求合并批处理），重复图片直接返回缓存结果
+            result, cached = classify_image_data(image_data, deadline=deadline)
             
             # 检查预测结果
             if 'error' in result:
@@ -1102,26 +1305,245 @@ def classify_dish():
             return jsonify({
                 'code': 200,
                 'message': '识别成功',
-                'data': {
-                    'dish_name': result['name'],
-                    'confidence': round(result.get('confidence', 0) * 100, 2)  # 置信度转换为百分比
-                }
+                'data': build_classification_data(result, cached)
             })
             
+        except AdmissionRejected as e:
+            response = jsonify({'code': 503, 'message': '识别服务繁忙，请稍后重试'})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 503
         except ImportError:
             return jsonify({'code': 500, 'message': 'AI模型未正确安装或配置，请联系管理员'}), 500
         except Exception as e:
-            # 确保清理临时文件
-            try:
-                os.remove(image_path)
-            except:
-                pass
             return jsonify({'code': 500, 'message': f'AI识别过程中出错: {str(e)}'}), 500
             
     except Exception as e:
         return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
 
 
+@app.route('/api/classify-dish/batch', methods=['POST'])
+def classify_dish_batch():
+    """
+    AI菜品图片批量识别接口
+    一次上传多张图片（images 字段可重复），按上传顺序返回每张图片的前 top_k 个识别结果
+    与单张识别共用推理准入控制（整个批次按图片数占用名额），排不上队时返回 503 和 Retry-After
+    注意：此接口为独立的AI识别模块，不需要登录认证
+    """
+    try:
+        deadline = get_request_deadline(request.headers.get('X-Request-Timeout-Ms', type=int))
+        
+        files = [f for f in request.files.getlist('images') if f.filename]
+        if not files:
+            return jsonify({'code': 400, 'message': '请上传图片文件'}), 400
+        
+        max_images = app.config.get('CLASSIFIER_MAX_BATCH_IMAGES', 16)
+        if len(files) > max_images:
+            return jsonify({'code': 400, 'message': f'单次最多识别{max_images}张图片'}), 400
+        
+        top_k = request.form.get('top_k', 3, type=int)
+        top_k = max(1, min(top_k, 10))
+        
+        # 不支持的格式直接标记错误，其余图片在内存中解码后一起识别
+        streams = []
+        results = [None] * len(files)
+        for index, file in enumerate(files):
+            if allowed_file(file.filename):
+                streams.append((index, file.stream))
+            else:
+                results[index] = {'error': '不支持的文件格式，请上传 PNG、JPG、JPEG 或 GIF 格式的图片'}
+        
+        try:
+            predictions = classify_image_batch([stream for _, stream in streams], top_k=top_k, deadline=deadline)
+        except AdmissionRejected as e:
+            response = jsonify({'code': 503, 'message': '识别服务繁忙，请稍后重试'})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 503
+        except ImportError:
+            return jsonify({'code': 500, 'message': 'AI模型未正确安装或配置，请联系管理员'}), 500
+        
+        for (index, _), prediction in zip(streams, predictions):
+            if 'error' in prediction:
+                # 具体错误只记录在服务端日志中，不返回给客户端
+                app.logger.warning(f'批量识别第 {index} 张图片（{files[index].filename}）失败: {prediction["error"]}')
+                prediction = {'error': '图片无法识别'}
+            results[index] = prediction
+        
+        # 所有图片的候选类别合并查询一次匹配菜品
+        class_names = {c['name'] for r in results if 'error' not in r for c in r.get('top_k', [r])}
+        matches = get_matching_dishes(sorted(class_names))
+        
+        data = []
+        for index, (file, result) in enumerate(zip(files, results)):
+            item = {'index': index, 'filename': file.filename}
+            if 'error' in result:
+                item['error'] = result['error']
+            else:
+                item['dish_name'] = result['name']
+                item['confidence'] = round(result['confidence'] * 100, 2)  # 置信度转换为百分比
+                item['model_version'] = result.get('model_version')
+                item['top_k'] = [
+                    {
+                        'dish_name': c['name'],
+                        'confidence': round(c['confidence'] * 100, 2),
+                        'dishes': matches.get(c['name'], [])
+                    }
+                    for c in result.get('top_k', [result])
+                ]
+            data.append(item)
+        
+        return jsonify({
+            'code': 200,
+            'message': '识别成功',
+            'data': {
+                'results': data
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'AI识别过程中出错: {str(e)}'}), 500
+
+
+@app.route('/api/classify-dish/similar', methods=['POST'])
+def classify_dish_similar():
+    """
+    以图搜菜：上传一张菜品图片，返回图片特征最相似的在售菜品
+    可选参数 limit（默认10，最大50）
+    注意：此接口为独立的AI识别模块，不需要登录认证
+    """
+    try:
+        if 'image' not in request.files:
+            return jsonify({'code': 400, 'message': '请上传图片文件'}), 400
+        
+        file = request.files['image']
+        if file.filename == '':
+            return jsonify({'code': 400, 'message': '未选择文件'}), 400
+        
+        if not allowed_file(file.filename):
+            return jsonify({'code': 400, 'message': '不支持的文件格式，请上传 PNG、JPG、JPEG 或 GIF 格式的图片'}), 400
+        
+        limit = request.form.get('limit', 10, type=int)
+        limit = max(1, min(limit, 50))
+        
+        try:
+            vector = embed_image(file.read())
+        except ImportError:
+            return jsonify({'code': 500, 'message': 'AI模型未正确安装或配置，请联系管理员'}), 500
+        if vector is None:
+            return jsonify({'code': 400, 'message': '图片无法识别'}), 400
+        
+        return jsonify({
+            'code': 200,
+            'data': find_similar_dishes(vector, limit=limit)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'AI识别过程中出错: {str(e)}'}), 500
+
+
+@app.route('/api/classify-dish/jobs', methods=['POST'])
+def submit_classify_job():
+    """
+    提交异步AI识别任务
+    图片放入后台识别队列后立即返回任务ID，不占用Web工作线程等待推理完成，
+    之后通过 GET /api/classify-dish/jobs/<job_id> 查询结果
+    注意：此接口为独立的AI识别模块，不需要登录认证
+    """
+    try:
+        if 'image' not in request.files:
+            return jsonify({'code': 400, 'message': '请上传图片文件'}), 400
+        
+        file = request.files['image']
+        if file.filename == '':
+            return jsonify({'code': 400, 'message': '未选择文件'}), 400
+        
+        if not allowed_file(file.filename):
+            return jsonify({'code': 400, 'message': '不支持的文件格式，请上传 PNG、JPG、JPEG 或 GIF 格式的图片'}), 400
+        
+        image_data = file.read()
+        if not image_data:
+            return jsonify({'code': 400, 'message': '上传的文件为空'}), 400
+        
+        store = get_job_store()
+        try:
+            job_id = store.submit(image_data)
+        except queue.Full:
+            response = jsonify({'code': 503, 'message': '识别任务队列已满，请稍后重试'})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        
+        return jsonify({
+            'code': 202,
+            'message': '任务已提交',
+            'data': {
+                'job_id': job_id,
+                'status': 'queued',
+                'queue_position': store.queue_position(job_id),
+                'queue_depth': store.get_stats()['queue_depth']
+            }
+        }), 202
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
+
+
+@app.route('/api/classify-dish/jobs/<job_id>', methods=['GET'])
+def get_classify_job(job_id):
+    """
+    查询异步AI识别任务
+    可选参数 wait（秒）：任务未完成时最多等待 wait 秒再返回（长轮询），上限为 CLASSIFIER_JOB_MAX_WAIT
+    status 为 queued / running / done / failed，done 时 result 与 /api/classify-dish 的 data 相同
+    """
+    try:
+        wait = request.args.get('wait', 0, type=float)
+        wait = max(0.0, min(wait, app.config.get('CLASSIFIER_JOB_MAX_WAIT', 30)))
+        
+        store = get_job_store()
+        job = store.wait(job_id, wait) if wait > 0 else store.get(job_id)
+        if not job:
+            return jsonify({'code': 404, 'message': '任务不存在或已过期'}), 404
+        
+        data = {
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'created_at': datetime.utcfromtimestamp(job['created_at']).isoformat(),
+            'finished_at': datetime.utcfromtimestamp(job['finished_at']).isoformat() if job['finished_at'] else None
+        }
+        if job['status'] == 'queued':
+            data['queue_position'] = store.queue_position(job_id)
+        elif job['status'] == 'done':
+            data['result'] = job['result']
+        elif job['status'] == 'failed':
+            data['error'] = job['error']
+        
+        return jsonify({
+            'code': 200,
+            'data': data
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'code': 500, 'message': f'服务器错误: {str(e)}'}), 500
+
+
+# ================== 健康检查接口 ==================
+
+@app.route('/api/health/ready', methods=['GET'])
+def health_ready():
+    """
+    就绪探针：开启启动预热时，AI识别模型预热完成前返回503，负载均衡只把流量转发给已就绪的实例
+    同时返回当前使用的模型版本，便于确认模型热更新是否已在所有实例上完成
+    """
+    ready, warmup = get_readiness()
+    model = get_model_status()
+    
+    return jsonify({
+        'code': 200 if ready else 503,
+        'message': '服务已就绪' if ready else 'AI识别模型预热中',
+        'data': {
+            'ready': ready,
+            'warmup': warmup,
+            'model_version': model['version']
+        }
+    }), 200 if ready else 503
 
 
 # ================== 错误处理 ==================
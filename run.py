@@ -5,9 +5,11 @@
 """
 
 import os
+import click
 from flask_migrate import Migrate
 from app import app, db
-from models import User, Canteen, Window, Dish, Review, ReviewReply, Like
+from models import User, Canteen, Window, Dish, Review, ReviewReply, Like, ImageClassification, DishRatingStats, \
+    WindowRatingStats, CanteenRatingStats, DishRatingBucket, SchemaUpgrade
 from config import config
 
 # 获取配置环境
@@ -18,6 +20,10 @@ config[config_name].init_app(app)
 # 数据库迁移
 migrate = Migrate(app, db)
 
+# 注册路由（gunicorn run:app 不会执行 run_app，路由需在导入时注册）
+import routes  # noqa: E402,F401
+import admin_routes  # noqa: E402,F401
+
 
 def create_admin():
     """创建默认管理员账户"""
@@ -52,20 +58,158 @@ def make_shell_context():
         'Dish': Dish,
         'Review': Review,
         'ReviewReply': ReviewReply,
-        'Like': Like
+        'Like': Like,
+        'ImageClassification': ImageClassification,
+        'DishRatingStats': DishRatingStats,
+        'WindowRatingStats': WindowRatingStats,
+        'CanteenRatingStats': CanteenRatingStats,
+        'DishRatingBucket': DishRatingBucket,
+        'SchemaUpgrade': SchemaUpgrade
     }
 
 
+@app.cli.command('build-embeddings')
+@click.option('--full', is_flag=True, help='清空索引后全部重新提取')
+def build_embeddings_command(full):
+    """为所有菜品图片提取特征，构建相似菜品索引"""
+    from dish_embeddings import build_dish_embeddings
+    stats = build_dish_embeddings(rebuild=full)
+    print(f"✓ 特征索引已更新：新增 {stats['added']} 张图片，共 {stats['images']} 张图片 / {stats['dishes']} 个菜品")
+
+
+@app.cli.command('classify-images')
+@click.option('--source', 'sources', default='review,dish', help='图片来源，逗号分隔：review / dish')
+@click.option('--batch-size', default=32, help='每批推理的图片数')
+@click.option('--workers', default=4, help='并行解码预处理的线程数')
+@click.option('--top-k', default=3, help='每张图片保存的候选类别数')
+@click.option('--limit', default=0, help='每类来源本次最多处理的图片数，0为不限')
+@click.option('--retry-errors', is_flag=True, help='重新识别之前失败的图片')
+def classify_images_command(sources, batch_size, workers, top_k, limit, retry_errors):
+    """离线批量识别历史评价和菜品图片，结果写入 image_classifications 表，中断后重新运行即可续跑"""
+    from batch_classify import SOURCES, run_batch_classification
+    source_types = [s.strip() for s in sources.split(',') if s.strip()]
+    unknown = [s for s in source_types if s not in SOURCES]
+    if unknown:
+        raise click.BadParameter(f'不支持的图片来源: {", ".join(unknown)}')
+    result = run_batch_classification(source_types, batch_size=batch_size, workers=workers, top_k=top_k,
+                                      limit=limit, retry_errors=retry_errors)
+    print("✓ 识别完成：" + "，".join(f"{source} {count} 张" for source, count in result.items()))
+
+
+LEVEL_NAMES = {'dish': '菜品', 'window': '窗口', 'canteen': '食堂', 'bucket': '评分分桶'}
+
+
+def _rebuild_all():
+    from rating_aggregates import rebuild_rating_stats
+    from rating_trends import rebuild_rating_buckets
+    counts = rebuild_rating_stats()
+    print("✓ 评分汇总已重建：" + "，".join(f"{count} 个{LEVEL_NAMES[level]}" for level, count in counts.items()))
+    buckets = rebuild_rating_buckets()
+    print(f"✓ 评分分桶已重建：{buckets['day']} 个天分桶，{buckets['hour']} 个小时分桶")
+
+
+@app.cli.command('rebuild-rating-stats')
+def rebuild_rating_stats_command():
+    """按评价表重新计算所有菜品、窗口和食堂的评分汇总（dish/window/canteen_rating_stats）和评分分桶（dish_rating_buckets）"""
+    db.create_all()
+    _rebuild_all()
+
+
+@app.cli.command('check-rating-stats')
+@click.option('--fix', is_flag=True, help='发现不一致时重建评分汇总')
+def check_rating_stats_command(fix):
+    """校验菜品、窗口和食堂的评分汇总及评分分桶与评价表是否一致"""
+    from rating_aggregates import check_rating_stats
+    from rating_trends import check_rating_buckets
+    issues = check_rating_stats() + check_rating_buckets()
+    if not issues:
+        print("✓ 评分汇总与评价表一致")
+        return
+    for issue in issues[:50]:
+        name = f"{LEVEL_NAMES[issue['level']]} {issue['key']}"
+        if issue['field'] is None:
+            state = '缺少汇总行' if issue['actual'] is None else f"{LEVEL_NAMES[issue['level']]}已不存在"
+            print(f"✗ {name}: {state}")
+        else:
+            print(f"✗ {name}: {issue['field']} 应为 {issue['expected']}，实际为 {issue['actual']}")
+    if len(issues) > 50:
+        print(f"... 共 {len(issues)} 处不一致")
+    if fix:
+        _rebuild_all()
+    else:
+        raise SystemExit(1)
+
+
+@app.cli.command('reconcile-review-counts')
+@click.option('--dry-run', is_flag=True, help='只报告不一致，不修改')
+def reconcile_review_counts_command(dry_run):
+    """校验评价的点赞数、回复数和最新回复预览与点赞表、回复表是否一致，并校正不一致的评价"""
+    from review_counters import reconcile_review_counts
+    issues = reconcile_review_counts(fix=not dry_run)
+    if not issues:
+        print("✓ 评价点赞数、回复数和回复预览与明细表一致")
+        return
+    for issue in issues[:50]:
+        if issue['field'] == 'latest_replies':
+            print(f"✗ 评价 {issue['review_id']}: 回复预览已过期")
+        else:
+            print(f"✗ 评价 {issue['review_id']}: {issue['field']} 应为 {issue['expected']}，实际为 {issue['actual']}")
+    if len(issues) > 50:
+        print(f"... 共 {len(issues)} 处不一致")
+    if dry_run:
+        raise SystemExit(1)
+    print(f"✓ 已校正 {len({issue['review_id'] for issue in issues})} 条评价")
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """创建缺少的表并执行尚未执行的数据库升级步骤（已执行的步骤不会重复执行）"""
+    _upgrade_schema()
+
+
+def _upgrade_schema():
+    from schema_upgrade import upgrade_schema
+    for description in upgrade_schema():
+        print(f"✓ 数据库升级：{description}")
+
+
+def start_background_tasks():
+    """
+    启动处理请求的进程中的后台任务：AI识别模型预热（预热完成前 /api/health/ready 返回503）、模型文件监视和系统概览刷新
+    python run.py 启动时由 run_app 调用，gunicorn 由 gunicorn.conf.py 在每个 worker 进程初始化后调用
+    """
+    if app.config.get('CLASSIFIER_WARMUP', False):
+        from ai_service import start_warmup
+        start_warmup()
+        print("✓ AI识别模型正在后台预热")
+    if app.config.get('CLASSIFIER_MODEL_WATCH', False):
+        from ai_service import start_model_watch
+        start_model_watch()
+        print("✓ 已开启模型文件监视，替换模型文件后自动热更新")
+    if app.config.get('STATS_OVERVIEW_REFRESH_INTERVAL', 60) > 0:
+        from stats_overview import start_overview_refresh
+        start_overview_refresh()
+        print(f"✓ 系统概览统计每 {app.config['STATS_OVERVIEW_REFRESH_INTERVAL']} 秒在后台刷新")
+
+
 def run_app():
     """运行应用"""
     with app.app_context():
-        # 创建数据库表
-        db.create_all()
+        # 创建数据库表，并升级已有数据库
+        _upgrade_schema()
         print("✓ 数据库表创建完成")
         
         # 创建管理员账户
         create_admin()
         
+        # 构建AI识别类别 -> 菜品的名称索引
+        try:
+            from dish_index import get_dish_index
+            stats = get_dish_index().get_stats()
+            print(f"✓ 菜品名称索引构建完成（{stats['matched_class_count']} 个识别类别有对应菜品）")
+        except ImportError:
+            print("⚠ 未安装PyTorch，跳过菜品名称索引构建")
+        
 
         print("\n" + "="*50)
         print("🍽️  校园食堂菜品打分系统")
@@ -76,9 +220,10 @@ def run_app():
         print(f"📚 API文档: 请查看需求文档.md")
         print("="*50)
     
-    # 导入路由模块
-    import routes
-    import admin_routes
+    # 调试模式下只在实际处理请求的重载子进程中启动后台任务
+    reloader_parent = app.config.get('DEBUG', False) and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+    if not reloader_parent:
+        start_background_tasks()
     
     # 启动应用
     app.run(
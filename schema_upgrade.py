@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+已有数据库升级
+db.create_all 只创建缺少的表，不会为已有的表添加新列，也不会回填新增的计数列。
+upgrade_schema 在建表后依次执行 UPGRADE_STEPS 中尚未执行的步骤，执行过的步骤记录在 schema_upgrades 表中，
+启动服务（python run.py）时自动执行，也可以用 flask --app run upgrade-db 单独执行。
+"""
+
+from sqlalchemy import inspect, text
+
+from app import db
+from models import SchemaUpgrade, Review
+from review_counters import reconcile_review_counts
+
+
+def add_missing_columns(model, names):
+    """
+    为已有的表添加模型中新增的列（ALTER TABLE ... ADD COLUMN，已存在的列跳过）
+    Args:
+        model: 模型类
+        names: 列名列表
+    Returns:
+        list: 添加的列名
+    """
+    table = model.__table__
+    existing = {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+    quote = db.engine.dialect.identifier_preparer.quote
+    added = []
+    for name in names:
+        if name in existing:
+            continue
+        column_type = table.c[name].type.compile(dialect=db.engine.dialect)
+        db.session.execute(text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(name)} {column_type}'))
+        added.append(name)
+    db.session.commit()
+    return added
+
+
+def _backfill_like_counts():
+    # 旧版本不维护 reviews.likes，按点赞表回填
+    reconcile_review_counts(fields=('likes',))
+
+
+def _add_review_reply_counts():
+    # reviews.reply_count / latest_replies 为新增列，添加后按回复表回填回复数和最新回复预览
+    add_missing_columns(Review, ['reply_count', 'latest_replies'])
+    reconcile_review_counts(fields=('reply_count', 'latest_replies'))
+
+
+# 升级步骤：(名称, 说明, 函数)，按顺序执行，只能在末尾追加
+UPGRADE_STEPS = [
+    ('review_like_counts', '按点赞表回填评价点赞数', _backfill_like_counts),
+    ('review_reply_counts', '为评价表添加回复数、最新回复预览列并回填', _add_review_reply_counts),
+]
+
+
+def upgrade_schema():
+    """
+    创建缺少的表并执行尚未执行的升级步骤
+    Returns:
+        list: 本次执行的步骤说明
+    """
+    db.create_all()
+    applied = {name for name, in db.session.query(SchemaUpgrade.name).all()}
+    done = []
+    for name, description, step in UPGRADE_STEPS:
+        if name in applied:
+            continue
+        step()
+        db.session.add(SchemaUpgrade(name=name))
+        db.session.commit()
+        done.append(description)
+    return done
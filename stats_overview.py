@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+系统概览统计快照
+/api/stats/overview 被首页和外部监控频繁轮询，每次都全表 COUNT 代价太高。
+这里把统计结果保存在内存中，由后台线程每隔 STATS_OVERVIEW_REFRESH_INTERVAL 秒重新统计一次；
+没有启动后台线程时（如其他方式部署），请求读到超过间隔的快照会顺带刷新。
+管理员可以用 ?fresh=1 立即重新统计。
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from app import app, db
+from models import User, Canteen, Window, Dish
+from rating_stats import get_rating_stats
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_refresh_thread = None
+
+
+def _refresh_interval():
+    return app.config.get('STATS_OVERVIEW_REFRESH_INTERVAL', 60)
+
+
+def compute_overview():
+    """精确统计系统概览（两次查询：各表行数、评价评分汇总）"""
+    counts = db.session.execute(select(
+        select(func.count()).select_from(User).scalar_subquery().label('user_count'),
+        select(func.count()).select_from(Canteen).scalar_subquery().label('canteen_count'),
+        select(func.count()).select_from(Window).scalar_subquery().label('window_count'),
+        select(func.count()).select_from(Dish).scalar_subquery().label('dish_count')
+    )).one()
+    rating_stats = get_rating_stats()
+
+    overview = dict(counts._asdict())
+    overview.update({
+        'review_count': rating_stats.total_count,
+        'total_rating_sum': rating_stats.overall_sum,
+        'average_rating': rating_stats.get_average('overall', digits=2)
+    })
+    return overview
+
+
+def _replace_snapshot():
+    global _snapshot
+    data = compute_overview()
+    snapshot = {'data': data, 'refreshed_at': datetime.utcnow(), 'monotonic': time.monotonic()}
+    with _snapshot_lock:
+        _snapshot = snapshot
+    return snapshot
+
+
+def refresh_overview():
+    """重新统计并替换快照"""
+    with _refresh_lock:
+        return _replace_snapshot()
+
+
+def get_overview(fresh=False):
+    """
+    获取系统概览
+    Args:
+        fresh: 是否立即重新统计
+    Returns:
+        dict: 统计数据，附带 refreshed_at（统计时间，UTC）和 age_seconds（距今秒数）
+    """
+    with _snapshot_lock:
+        snapshot = _snapshot
+
+    interval = _refresh_interval()
+    if fresh or snapshot is None or interval <= 0:
+        snapshot = refresh_overview()
+    elif _refresh_thread is None and time.monotonic() - snapshot['monotonic'] > interval:
+        # 没有后台线程：由请求刷新，其他请求正在刷新时先返回旧快照
+        if _refresh_lock.acquire(blocking=False):
+            try:
+                snapshot = _replace_snapshot()
+            finally:
+                _refresh_lock.release()
+
+    result = dict(snapshot['data'])
+    result['refreshed_at'] = snapshot['refreshed_at'].isoformat()
+    result['age_seconds'] = round(time.monotonic() - snapshot['monotonic'], 1)
+    return result
+
+
+def _refresh_loop(interval):
+    while True:
+        with app.app_context():
+            try:
+                refresh_overview()
+            except Exception as e:
+                app.logger.warning(f'系统概览统计刷新失败: {e}')
+            finally:
+                db.session.remove()
+        time.sleep(interval)
+
+
+def start_overview_refresh():
+    """在后台线程中定时刷新系统概览快照（STATS_OVERVIEW_REFRESH_INTERVAL 秒，<=0 时不启动）"""
+    global _refresh_thread
+    interval = _refresh_interval()
+    if _refresh_thread is not None or interval <= 0:
+        return _refresh_thread
+    _refresh_thread = threading.Thread(
+        target=_refresh_loop,
+        args=(interval,),
+        name='stats-overview-refresh',
+        daemon=True
+    )
+    _refresh_thread.start()
+    return _refresh_thread
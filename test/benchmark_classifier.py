@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI菜品识别性能基准脚本
+- latency: 对比"每次请求重新加载模型"与"进程内共享识别器"两种方式的单次请求延迟
+- throughput: 对比逐张推理与微批处理队列在不同并发客户端数下的吞吐量
+- suite: 完整基准套件，用不同尺寸/格式的合成图片分别测量预处理、前向计算和端到端延迟
+  （多种批大小 × 线程数），输出包含 P50/P95/P99 和吞吐量(张/秒)的 JSON / Markdown 报告，
+  指定 --baseline 时与上一版本的报告对比，发现性能退化
+无需启动服务器，直接调用 resnet_classifier 模块
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PIL import Image
+
+
+def prepare_model_path():
+    """
+    准备模型权重文件
+    model.pth 未通过 git lfs 拉取时只是一个指针文件，此时生成随机权重用于测速
+    """
+    from resnet_classifier import resnet_predict
+
+    if os.path.exists(resnet_predict.MODEL_PATH) and os.path.getsize(resnet_predict.MODEL_PATH) > 1024 * 1024:
+        return resnet_predict.MODEL_PATH
+
+    import torch
+    import torch.nn as nn
+    from torchvision import models
+
+    print("⚠ 未找到有效的 model.pth，使用随机权重进行测速")
+    model = models.resnet50(weights=None)
+    model.fc = nn.Linear(model.fc.in_features, resnet_predict.NUM_CLASSES)
+    fd, path = tempfile.mkstemp(suffix='.pth')
+    os.close(fd)
+    torch.save(model.state_dict(), path)
+    return path
+
+
+def cleanup_model_path(model_path):
+    """删除 prepare_model_path() 生成的临时随机权重，不删除真实的模型文件"""
+    from resnet_classifier import resnet_predict
+
+    if model_path != resnet_predict.MODEL_PATH and os.path.exists(model_path):
+        os.remove(model_path)
+
+
+def make_test_image(directory, size=(800, 600)):
+    """生成一张测试图片"""
+    path = os.path.join(directory, 'bench.jpg')
+    Image.effect_noise(size, 64).convert('RGB').save(path, quality=85)
+    return path
+
+
+def summarize(title, samples):
+    """打印延迟统计"""
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{title}: 平均 {statistics.mean(samples) * 1000:.1f} ms, "
+          f"中位数 {statistics.median(samples) * 1000:.1f} ms, "
+          f"P95 {p95 * 1000:.1f} ms ({len(samples)} 次)")
+
+
+def bench_reload_per_request(model_path, image_path, rounds):
+    """旧方式：每次请求都重新构建 ResNet-50 并加载权重"""
+    from resnet_classifier.resnet_predict import DishClassifier
+
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        DishClassifier(model_path=model_path).predict(image_path)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_shared_classifier(model_path, image_path, rounds):
+    """新方式：进程内只加载一次模型，之后每次请求只做推理"""
+    from resnet_classifier.resnet_predict import DishClassifier
+
+    start = time.perf_counter()
+    classifier = DishClassifier(model_path=model_path)
+    print(f"共享识别器首次加载耗时: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        classifier.predict(image_path)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run_clients(predictor, image_path, clients, requests_per_client):
+    """启动多个并发客户端线程，每个客户端连续发起若干次识别，返回吞吐量(张/秒)"""
+    barrier = threading.Barrier(clients + 1)
+
+    def client():
+        barrier.wait()
+        for _ in range(requests_per_client):
+            predictor.predict(image_path)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return clients * requests_per_client / elapsed
+
+
+def bench_throughput(model_path, image_path, client_counts, requests_per_client, max_batch_size, max_wait_ms):
+    """逐张推理 vs 微批处理队列 的吞吐量对比"""
+    from resnet_classifier.resnet_predict import DishClassifier
+    from resnet_classifier.batching import BatchingClassifier
+
+    classifier = DishClassifier(model_path=model_path)
+    classifier.predict(image_path)  # 预热
+
+    print(f"微批处理配置: max_batch_size={max_batch_size}, max_wait_ms={max_wait_ms}")
+    print(f"{'并发客户端':>10} | {'逐张推理(张/秒)':>16} | {'微批处理(张/秒)':>16} | {'平均批大小':>10}")
+    for clients in client_counts:
+        direct = run_clients(classifier, image_path, clients, requests_per_client)
+
+        batcher = BatchingClassifier(classifier, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        batched = run_clients(batcher, image_path, clients, requests_per_client)
+        avg_batch_size = batcher.get_stats()['avg_batch_size']
+        batcher.close()
+
+        print(f"{clients:>10} | {direct:>16.2f} | {batched:>16.2f} | {avg_batch_size:>10}")
+
+
+# 基准套件使用的合成图片：(尺寸, 格式)，覆盖手机照片、截图和小图
+SUITE_IMAGE_SPECS = [
+    ((4032, 3024), 'JPEG'),
+    ((1920, 1080), 'JPEG'),
+    ((800, 600), 'JPEG'),
+    ((1280, 960), 'PNG'),
+    ((320, 240), 'PNG'),
+    ((480, 360), 'GIF'),
+]
+
+
+def make_suite_images(directory):
+    """生成不同尺寸和格式的合成图片，返回 [(标签, 路径)]"""
+    images = []
+    for index, ((width, height), fmt) in enumerate(SUITE_IMAGE_SPECS):
+        img = Image.effect_noise((width, height), 32 + index * 8).convert('RGB')
+        if fmt == 'GIF':
+            img = img.convert('P', palette=Image.Palette.ADAPTIVE)
+        path = os.path.join(directory, f'suite_{width}x{height}.{fmt.lower()}')
+        img.save(path, fmt, **({'quality': 85} if fmt == 'JPEG' else {}))
+        images.append((f'{fmt} {width}x{height}', path))
+    return images
+
+
+def latency_stats(samples, images_per_sample=1):
+    """延迟分位数(毫秒)和吞吐量(张/秒)"""
+    samples = sorted(samples)
+
+    def percentile(ratio):
+        return samples[min(len(samples) - 1, int(len(samples) * ratio))] * 1000
+
+    return {
+        'samples': len(samples),
+        'mean_ms': round(statistics.mean(samples) * 1000, 3),
+        'p50_ms': round(percentile(0.50), 3),
+        'p95_ms': round(percentile(0.95), 3),
+        'p99_ms': round(percentile(0.99), 3),
+        'images_per_sec': round(images_per_sample * len(samples) / sum(samples), 2)
+    }
+
+
+def timed(func, rounds, warmup=1):
+    """先预热 warmup 次，再执行 rounds 次并返回每次耗时"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run_suite(model_path, inference_mode, batch_sizes, thread_counts, rounds):
+    """
+    运行完整基准套件
+    - preprocess: 每种图片的解码 + 缩放 + 标准化耗时（单线程，与 PyTorch 线程数无关）
+    - forward: 各批大小 × 线程数下一次前向计算的耗时
+    - end_to_end: 各线程数下从图片文件到识别结果的单张耗时（轮流使用全部合成图片）
+    """
+    import torch
+    from resnet_classifier.resnet_predict import DishClassifier, model_file_version
+
+    start = time.perf_counter()
+    classifier = DishClassifier(model_path=model_path, mode=inference_mode)
+    load_time = time.perf_counter() - start
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'inference_mode': inference_mode,
+            'model_version': model_file_version(model_path),
+            'model_load_s': round(load_time, 3),
+            'torch_version': torch.__version__,
+            'python_version': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'rounds': rounds
+        },
+        'preprocess': [],
+        'forward': [],
+        'end_to_end': []
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        images = make_suite_images(tmp_dir)
+
+        for label, path in images:
+            stats = latency_stats(timed(lambda: classifier.preprocess(path), rounds))
+            report['preprocess'].append({'image': label, **stats})
+            print(f"预处理 {label:<16} P50 {stats['p50_ms']:>8.1f} ms")
+
+        tensors = [classifier.preprocess(path) for _, path in images]
+        for num_threads in thread_counts:
+            torch.set_num_threads(num_threads)
+
+            for batch_size in batch_sizes:
+                batch = torch.stack([tensors[i % len(tensors)] for i in range(batch_size)])
+                stats = latency_stats(timed(lambda: classifier.predict_tensors(batch), rounds), batch_size)
+                report['forward'].append({'threads': num_threads, 'batch_size': batch_size, **stats})
+                print(f"前向计算 线程={num_threads:<3} 批大小={batch_size:<4} P50 {stats['p50_ms']:>8.1f} ms, "
+                      f"{stats['images_per_sec']:>8.2f} 张/秒")
+
+            paths = iter(path for _ in range(rounds + 1) for _, path in images)
+            stats = latency_stats(timed(lambda: classifier.predict(next(paths)), rounds * len(images)))
+            report['end_to_end'].append({'threads': num_threads, **stats})
+            print(f"端到端   线程={num_threads:<3} P50 {stats['p50_ms']:>8.1f} ms, P99 {stats['p99_ms']:>8.1f} ms")
+
+    return report
+
+
+def _report_keys(report):
+    """把报告展开为 {指标名: P50延迟}，用于与基准报告对比"""
+    keys = {}
+    for item in report['preprocess']:
+        keys[f"preprocess {item['image']}"] = item['p50_ms']
+    for item in report['forward']:
+        keys[f"forward threads={item['threads']} batch={item['batch_size']}"] = item['p50_ms']
+    for item in report['end_to_end']:
+        keys[f"end_to_end threads={item['threads']}"] = item['p50_ms']
+    return keys
+
+
+def compare_reports(report, baseline):
+    """
+    与基准报告对比 P50 延迟
+    Returns:
+        list: [(指标名, 基准P50, 当前P50, 变化比例)]，只包含两份报告共有的指标
+    """
+    current, previous = _report_keys(report), _report_keys(baseline)
+    rows = []
+    for key, value in current.items():
+        if key in previous and previous[key] > 0:
+            rows.append((key, previous[key], value, value / previous[key] - 1))
+    return rows
+
+
+def render_markdown(report, comparison=None, tolerance=0.1):
+    """生成 Markdown 格式的基准报告"""
+    meta = report['meta']
+    lines = [
+        '# AI菜品识别性能基准报告',
+        '',
+        f"- 生成时间: {meta['created_at']}",
+        f"- 推理模式: {meta['inference_mode']}，模型版本: {meta['model_version']}，加载耗时: {meta['model_load_s']} s",
+        f"- 环境: PyTorch {meta['torch_version']} / Python {meta['python_version']} / {meta['cpu_count']} CPU / "
+        f"{meta['platform']}",
+        '',
+        '## 预处理（解码 + 缩放 + 标准化）',
+        '',
+        '| 图片 | P50(ms) | P95(ms) | P99(ms) | 张/秒 |',
+        '|------|--------:|--------:|--------:|------:|',
+    ]
+    for item in report['preprocess']:
+        lines.append(f"| {item['image']} | {item['p50_ms']:.1f} | {item['p95_ms']:.1f} | {item['p99_ms']:.1f} | "
+                     f"{item['images_per_sec']:.2f} |")
+
+    lines += ['', '## 前向计算', '', '| 线程数 | 批大小 | P50(ms) | P95(ms) | P99(ms) | 张/秒 |',
+              '|-------:|-------:|--------:|--------:|--------:|------:|']
+    for item in report['forward']:
+        lines.append(f"| {item['threads']} | {item['batch_size']} | {item['p50_ms']:.1f} | {item['p95_ms']:.1f} | "
+                     f"{item['p99_ms']:.1f} | {item['images_per_sec']:.2f} |")
+
+    lines += ['', '## 端到端（图片文件 → 识别结果，单张）', '', '| 线程数 | P50(ms) | P95(ms) | P99(ms) | 张/秒 |',
+              '|-------:|--------:|--------:|--------:|------:|']
+    for item in report['end_to_end']:
+        lines.append(f"| {item['threads']} | {item['p50_ms']:.1f} | {item['p95_ms']:.1f} | {item['p99_ms']:.1f} | "
+                     f"{item['images_per_sec']:.2f} |")
+
+    if comparison:
+        lines += ['', f'## 与基准报告对比（P50，超过 {tolerance:.0%} 视为退化）', '',
+                  '| 指标 | 基准(ms) | 当前(ms) | 变化 | |', '|------|--------:|--------:|-----:|---|']
+        for key, previous, value, change in comparison:
+            flag = '⚠ 退化' if change > tolerance else ''
+            lines.append(f"| {key} | {previous:.1f} | {value:.1f} | {change:+.1%} | {flag} |")
+
+    return '\n'.join(lines) + '\n'
+
+
+def bench_suite(model_path, args):
+    """运行基准套件并写出报告，与基准报告相比出现退化时返回非零退出码"""
+    batch_sizes = [int(n) for n in args.batch_sizes.split(',') if n.strip()]
+    thread_counts = [int(n) for n in args.threads.split(',') if n.strip()]
+
+    print(f"=== AI菜品识别基准套件：批大小 {batch_sizes}，线程数 {thread_counts} ===")
+    report = run_suite(model_path, args.inference_mode, batch_sizes, thread_counts, args.rounds)
+
+    comparison = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            comparison = compare_reports(report, json.load(f))
+        report['comparison'] = [
+            {'metric': key, 'baseline_p50_ms': previous, 'p50_ms': value, 'change': round(change, 4)}
+            for key, previous, value, change in comparison
+        ]
+
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(output_dir, exist_ok=True)
+    with open(f'{args.output}.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    with open(f'{args.output}.md', 'w', encoding='utf-8') as f:
+        f.write(render_markdown(report, comparison, args.tolerance))
+    print(f"✓ 报告已写入 {args.output}.json 和 {args.output}.md")
+
+    regressions = [row for row in comparison or [] if row[3] > args.tolerance]
+    for key, previous, value, change in regressions:
+        print(f"⚠ 性能退化: {key} P50 {previous:.1f} ms → {value:.1f} ms ({change:+.1%})")
+    return 1 if regressions else 0
+
+
+def run_benchmark(model_path, args):
+    """按 --mode 运行基准，返回进程退出码"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_path = make_test_image(tmp_dir)
+        if args.mode == 'suite':
+            return bench_suite(model_path, args)
+        elif args.mode == 'latency':
+            print("=== AI菜品识别单次请求延迟 ===")
+            summarize("每次请求重新加载模型", bench_reload_per_request(model_path, image_path, args.rounds))
+            summarize("进程内共享识别器", bench_shared_classifier(model_path, image_path, args.rounds))
+        else:
+            print("=== AI菜品识别并发吞吐量 (CPU) ===")
+            client_counts = [int(n) for n in args.clients.split(',') if n.strip()]
+            bench_throughput(model_path, image_path, client_counts, args.requests_per_client,
+                             args.max_batch_size, args.max_wait_ms)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI菜品识别性能基准')
+    parser.add_argument('--mode', choices=['latency', 'throughput', 'suite'], default='latency', help='基准类型')
+    parser.add_argument('--rounds', type=int, default=10, help='latency: 每种方式的请求次数')
+    parser.add_argument('--clients', default='1,4,16,64', help='throughput: 并发客户端数列表')
+    parser.add_argument('--requests-per-client', type=int, default=4, help='throughput: 每个客户端的请求次数')
+    parser.add_argument('--max-batch-size', type=int, default=16, help='throughput: 微批处理最大批大小')
+    parser.add_argument('--max-wait-ms', type=float, default=10, help='throughput: 微批处理最长等待时间')
+    parser.add_argument('--batch-sizes', default='1,4,16', help='suite: 前向计算的批大小列表')
+    parser.add_argument('--threads', default='1,2,4', help='suite: PyTorch 线程数列表')
+    parser.add_argument('--inference-mode', default='fp32', help='suite: 推理模式')
+    parser.add_argument('--output', default='benchmark_report', help='suite: 报告路径前缀（生成 .json 和 .md）')
+    parser.add_argument('--baseline', help='suite: 用于对比的上一版本 JSON 报告')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='suite: P50 变慢超过该比例视为退化')
+    args = parser.parse_args()
+
+    model_path = prepare_model_path()
+    try:
+        return run_benchmark(model_path, args)
+    finally:
+        cleanup_model_path(model_path)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI菜品识别推理模式对比工具
+在同一批带标签的图片上分别运行不同推理模式（fp32 / torchscript / int8-dynamic / int8），
+报告 top-1 准确率、与基准模式的 top-1 一致率以及单张图片 P50/P95 延迟
+
+图片目录按类别分子目录存放，子目录名为 id_name_mapping.txt 中的菜品名称：
+    images/
+    ├── fried rice/
+    │   ├── 001.jpg
+    │   └── 002.jpg
+    └── sushi/
+        └── 001.jpg
+
+用法:
+    python test/compare_inference_modes.py --folder images --modes fp32,int8
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmark_classifier import cleanup_model_path, prepare_model_path
+
+
+def list_labelled_images(folder, limit):
+    """读取 (图片路径, 标签) 列表，标签取自所在子目录名"""
+    items = []
+    for label in sorted(os.listdir(folder)):
+        class_dir = os.path.join(folder, label)
+        if not os.path.isdir(class_dir):
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
+                items.append((os.path.join(class_dir, name), label))
+    return items[:limit] if limit else items
+
+
+def make_synthetic_images(directory, count):
+    """没有提供图片目录时生成无标签的随机图片，只能比较一致率和延迟"""
+    from PIL import Image
+
+    items = []
+    for i in range(count):
+        path = os.path.join(directory, f'synthetic_{i}.jpg')
+        Image.effect_noise((640, 480), 20 + i * 5).convert('RGB').save(path, quality=85)
+        items.append((path, None))
+    return items
+
+
+def percentile(samples, ratio):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * ratio))]
+
+
+def run_mode(mode, model_path, items, num_threads, calibration_dir):
+    """用指定模式识别全部图片，返回 (预测列表, 每张延迟列表, 加载耗时)"""
+    from resnet_classifier.resnet_predict import DishClassifier
+
+    start = time.perf_counter()
+    classifier = DishClassifier(model_path=model_path, mode=mode, num_threads=num_threads,
+                                calibration_dir=calibration_dir)
+    load_time = time.perf_counter() - start
+
+    classifier.predict(items[0][0])  # 预热
+
+    predictions, latencies = [], []
+    for path, _ in items:
+        start = time.perf_counter()
+        result = classifier.predict(path)
+        latencies.append(time.perf_counter() - start)
+        predictions.append(result.get('name'))
+    return predictions, latencies, load_time
+
+
+def compare_modes(model_path, modes, args):
+    """依次用各推理模式识别同一组图片并打印对比结果"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.folder:
+            items = list_labelled_images(args.folder, args.limit)
+        else:
+            print("⚠ 未指定 --folder，使用随机生成的无标签图片")
+            items = make_synthetic_images(tmp_dir, args.limit or 20)
+
+        if not items:
+            print("✗ 没有找到图片")
+            return
+
+        calibration_dir = args.calibration_dir or args.folder
+        print(f"=== 推理模式对比：{len(items)} 张图片 ===")
+
+        reports = []
+        baseline = None
+        for mode in modes:
+            predictions, latencies, load_time = run_mode(mode, model_path, items, args.threads, calibration_dir)
+            if baseline is None:
+                baseline = predictions
+
+            labelled = [(p, label) for p, (_, label) in zip(predictions, items) if label is not None]
+            accuracy = sum(p == label for p, label in labelled) / len(labelled) if labelled else None
+            agreement = sum(p == b for p, b in zip(predictions, baseline)) / len(predictions)
+
+            reports.append((mode, accuracy, agreement, percentile(latencies, 0.5), percentile(latencies, 0.95),
+                            statistics.mean(latencies), load_time))
+
+    print(f"{'模式':<14} | {'top-1准确率':>10} | {'与' + modes[0] + '一致率':>12} | "
+          f"{'P50(ms)':>8} | {'P95(ms)':>8} | {'平均(ms)':>8} | {'加载(s)':>7}")
+    for mode, accuracy, agreement, p50, p95, mean, load_time in reports:
+        accuracy_text = f'{accuracy:.2%}' if accuracy is not None else '-'
+        print(f"{mode:<14} | {accuracy_text:>10} | {agreement:>12.2%} | "
+              f"{p50 * 1000:>8.1f} | {p95 * 1000:>8.1f} | {mean * 1000:>8.1f} | {load_time:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI菜品识别推理模式对比')
+    parser.add_argument('--folder', help='带标签的图片目录（按类别分子目录）')
+    parser.add_argument('--modes', default='fp32,torchscript,int8', help='要对比的推理模式，第一个为基准')
+    parser.add_argument('--threads', type=int, default=0, help='算子内并行线程数，0为PyTorch默认')
+    parser.add_argument('--calibration-dir', help='int8 校准图片目录，默认使用 --folder')
+    parser.add_argument('--limit', type=int, default=0, help='最多使用的图片数，0为全部')
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    model_path = prepare_model_path()
+
+    try:
+        compare_modes(model_path, modes, args)
+    finally:
+        cleanup_model_path(model_path)
+
+
+if __name__ == '__main__':
+    main()
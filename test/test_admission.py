@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推理准入控制测试
+无法在截止时间前开始的请求立即被拒绝，排队的请求按到达顺序取得名额，批量请求按图片数占用名额，
+被拒绝时的 Retry-After 按排队的名额数估计。不需要模型和数据库：
+    python test/test_admission.py
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resnet_classifier.admission import AdmissionController, AdmissionRejected
+
+
+class AdmissionControllerTest(unittest.TestCase):
+    """推理名额的排队与拒绝"""
+
+    def hold(self, controller, weight=1):
+        """占用推理名额，返回释放函数"""
+        admission = controller.admit(None, weight=weight)
+        admission.__enter__()
+        return lambda: admission.__exit__(None, None, None)
+
+    def start_waiting(self, controller, name, order, deadline=None, weight=1):
+        """在后台线程中排队，进入队列后返回；取得名额后把 name 记入 order"""
+        queued = controller.get_stats()['queue_length']
+
+        def run():
+            with controller.admit(deadline, weight=weight):
+                order.append(name)
+                time.sleep(0.01)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.wait_until(lambda: controller.get_stats()['queue_length'] > queued)
+        self.addCleanup(thread.join, 5)
+        return thread
+
+    def wait_until(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail('等待超时')
+            time.sleep(0.005)
+
+    def test_reject_unreachable_deadline_immediately(self):
+        """估计的排队时间超过截止时间时立即拒绝，不在队列中等到超时"""
+        controller = AdmissionController(max_concurrent=1, max_queue=10)
+        release = self.hold(controller)
+        self.addCleanup(release)
+        controller.avg_service = 2.0
+
+        start = time.monotonic()
+        with self.assertRaises(AdmissionRejected) as caught:
+            with controller.admit(start + 0.5):
+                pass
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual((caught.exception.reason, caught.exception.retry_after), ('deadline', 2))
+        self.assertEqual(controller.get_stats()['queue_length'], 0)
+
+        # 截止时间足够时排队等待，到截止时间仍未轮到才放弃
+        controller.avg_service = 0.2
+        with self.assertRaises(AdmissionRejected) as caught:
+            with controller.admit(time.monotonic() + 0.3):
+                pass
+        self.assertEqual(caught.exception.reason, 'expired')
+        self.assertEqual(controller.get_stats()['rejected_deadline'], 1)
+
+    def test_fifo_order(self):
+        """名额空出后按到达顺序放行，后到的请求不会插队"""
+        controller = AdmissionController(max_concurrent=1, max_queue=10)
+        release = self.hold(controller)
+        order = []
+        for name in ('a', 'b', 'c', 'd'):
+            self.start_waiting(controller, name, order, deadline=time.monotonic() + 30)
+        release()
+        self.wait_until(lambda: len(order) == 4)
+        self.assertEqual(order, ['a', 'b', 'c', 'd'])
+
+    def test_batch_weight(self):
+        """批量请求按图片数占用名额，排在前面的批量请求等待时，后到的单张请求不能用剩余名额插队"""
+        controller = AdmissionController(max_concurrent=4, max_queue=10)
+        release = self.hold(controller, weight=3)
+        self.assertEqual(controller.get_stats()['active'], 3)
+
+        order = []
+        self.start_waiting(controller, 'batch', order, weight=2)
+        self.start_waiting(controller, 'single', order)
+        time.sleep(0.05)
+        self.assertEqual(order, [])
+
+        release()
+        self.wait_until(lambda: len(order) == 2)
+        self.assertEqual(order, ['batch', 'single'])
+
+        # 超过 max_concurrent 的批次按 max_concurrent 计，空闲时可以立即开始
+        with controller.admit(time.monotonic() + 1, weight=100):
+            self.assertEqual(controller.get_stats()['active'], 4)
+
+    def test_retry_after_counts_queued_weight(self):
+        """队列已满时拒绝，Retry-After 按排队的名额数（而不是请求数）估计"""
+        controller = AdmissionController(max_concurrent=4, max_queue=1)
+        release = self.hold(controller, weight=4)
+        controller.avg_service = 10.0
+        order = []
+        self.start_waiting(controller, 'batch', order, weight=3)
+
+        with self.assertRaises(AdmissionRejected) as caught:
+            with controller.admit(time.monotonic() + 100):
+                pass
+        # (3 个排队名额 + 本请求) × 10 秒 / 4 个并发名额
+        self.assertEqual((caught.exception.reason, caught.exception.retry_after), ('queue_full', 10))
+
+        controller.avg_service = 1000.0
+        with self.assertRaises(AdmissionRejected) as caught:
+            with controller.admit(time.monotonic() + 100):
+                pass
+        self.assertEqual(caught.exception.retry_after, AdmissionController.MAX_RETRY_AFTER)
+
+        release()
+        self.wait_until(lambda: order == ['batch'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+菜品名称索引测试
+其他 worker 进程新增、改名或下架的菜品在超过 DISH_INDEX_REBUILD_INTERVAL 秒后的全量重建中可见，
+重建期间本进程的增量更新不会被重建读取到的旧数据覆盖。使用内存数据库，不需要启动服务和模型：
+    python test/test_dish_index.py
+"""
+
+import os
+import sys
+import unittest
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dish_index
+from app import app, db
+from dish_index import DishNameIndex, get_dish_index
+from models import Canteen, Window, Dish
+
+CLASSES = ['fried rice', 'dumplings']
+
+
+class DishNameIndexTest(unittest.TestCase):
+    """菜品名称索引的增量更新与定时重建"""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+        canteen = Canteen(name='一食堂', location='校园')
+        db.session.add(canteen)
+        db.session.flush()
+        self.window = Window(canteen_id=canteen.canteen_id, name='窗口')
+        db.session.add(self.window)
+        db.session.flush()
+        self.fried_rice = self.add_dish('扬州fried rice')
+        db.session.commit()
+
+        self.interval = app.config.get('DISH_INDEX_REBUILD_INTERVAL')
+        self.index = DishNameIndex(CLASSES)
+        self.index.build([(self.fried_rice.dish_id, self.fried_rice.name)])
+        dish_index._dish_index = self.index
+
+    def tearDown(self):
+        dish_index._dish_index = None
+        app.config['DISH_INDEX_REBUILD_INTERVAL'] = self.interval
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def add_dish(self, name, is_available=True):
+        dish = Dish(window_id=self.window.window_id, name=name, price=10, category='主食', is_available=is_available)
+        db.session.add(dish)
+        db.session.flush()
+        return dish
+
+    def test_other_process_changes_visible_after_interval(self):
+        """其他进程直接写入数据库的变更在间隔到期后的重建中可见"""
+        dumplings = self.add_dish('猪肉dumplings')
+        self.fried_rice.is_available = False
+        db.session.commit()
+
+        app.config['DISH_INDEX_REBUILD_INTERVAL'] = 30
+        self.assertEqual(get_dish_index().lookup('dumplings'), [])
+
+        self.index.built_at -= 31
+        self.assertEqual(get_dish_index().lookup('dumplings'), [dumplings.dish_id])
+        self.assertEqual(get_dish_index().lookup('fried rice'), [])
+
+    def test_update_during_rebuild(self):
+        """重建读取数据库之后、替换索引之前的增量更新不会丢失"""
+        dumplings = self.add_dish('猪肉dumplings')
+        db.session.commit()
+
+        def load_stale_dishes():
+            # 读取到的是旧数据，读取之后本进程改名并下架了菜品
+            rows = [(self.fried_rice.dish_id, self.fried_rice.name)]
+            self.index.update_dish(dumplings.dish_id, dumplings.name)
+            self.index.update_dish(self.fried_rice.dish_id, self.fried_rice.name, is_available=False)
+            return rows
+
+        self.index.rebuild(load_stale_dishes)
+        self.assertEqual(self.index.lookup('dumplings'), [dumplings.dish_id])
+        self.assertEqual(self.index.lookup('fried rice'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片特征索引多进程测试
+多个进程（如 gunicorn 的多个 worker）共用同一个索引目录时，并发追加不会覆盖彼此写入的行，
+每个进程都能读到其他进程追加、删除、扩容和压缩后的内容。不需要模型和数据库：
+    python test/test_embedding_index.py
+"""
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from resnet_classifier.embedding_index import EmbeddingIndex
+
+DIM = 8
+
+
+def _vector(dish_id):
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[dish_id % DIM] = 1
+    return vector
+
+
+def _append(directory, dish_ids):
+    """子进程：逐个追加菜品，每次追加一张图片"""
+    index = EmbeddingIndex(directory, dim=DIM, model_version='v1')
+    for dish_id in dish_ids:
+        index.add(dish_id, [f'/uploads/{dish_id}.jpg'], [_vector(dish_id)])
+
+
+class EmbeddingIndexProcessTest(unittest.TestCase):
+    """多个进程共用一个索引目录"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_concurrent_appends(self):
+        """多个进程同时追加（期间多次扩容），所有行都保留"""
+        index = EmbeddingIndex(self.directory, dim=DIM, model_version='v1')
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=_append, args=(self.directory, range(start, start + 40)))
+                     for start in (0, 100, 200)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(timeout=60)
+            self.assertEqual(process.exitcode, 0)
+
+        expected = set(range(0, 40)) | set(range(100, 140)) | set(range(200, 240))
+        self.assertEqual(index.get_dish_ids(), expected)
+        self.assertEqual(len(index), 120)
+        for dish_id in (0, 139, 237):
+            self.assertEqual(index.get_dish_images(dish_id), [f'/uploads/{dish_id}.jpg'])
+            np.testing.assert_allclose(index.get_dish_vector(dish_id), _vector(dish_id))
+
+    def test_reads_see_other_writers(self):
+        """另一个实例的追加、删除和压缩在读取时生效，写入前先合并其他实例的修改"""
+        first = EmbeddingIndex(self.directory, dim=DIM, model_version='v1')
+        second = EmbeddingIndex(self.directory, dim=DIM, model_version='v1')
+        first.add(1, ['/uploads/1.jpg'], [_vector(1)])
+        second.add(2, ['/uploads/2a.jpg', '/uploads/2b.jpg'], [_vector(2), _vector(2)])
+        self.assertEqual(first.get_dish_ids(), {1, 2})
+        self.assertEqual([dish_id for dish_id, _ in first.search(_vector(2), top_k=1)], [2])
+
+        first.remove(2, ['/uploads/2a.jpg'])
+        self.assertEqual(second.get_dish_images(2), ['/uploads/2b.jpg'])
+        second.compact()
+        self.assertEqual(first.get_stats()['rows'], 2)
+        first.add(3, ['/uploads/3.jpg'], [_vector(3)])
+        self.assertEqual(second.get_dish_ids(), {1, 2, 3})
+        self.assertEqual(second.get_dish_images(3), ['/uploads/3.jpg'])
+
+    def test_model_version_change(self):
+        """其他进程按新模型版本重建后，旧版本实例不再返回旧特征"""
+        old = EmbeddingIndex(self.directory, dim=DIM, model_version='v1')
+        old.add(1, ['/uploads/1.jpg'], [_vector(1)])
+        EmbeddingIndex(self.directory, dim=DIM, model_version='v2')
+        self.assertEqual(old.get_dish_ids(), set())
+        self.assertEqual(old.search(_vector(1)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步识别任务队列测试
+排队位置、完成后按 TTL 过期、任务表已满时淘汰最早完成的任务、等待队列已满时拒绝，
+以及查询接口返回的时间为 UTC。不需要模型，接口部分使用内存数据库：
+    python test/test_jobs.py
+"""
+
+import os
+import queue
+import sys
+import threading
+import time
+import unittest
+from datetime import datetime
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resnet_classifier.jobs import ClassificationJobStore
+
+
+class ClassificationJobStoreTest(unittest.TestCase):
+    """任务的排队、过期与淘汰"""
+
+    def setUp(self):
+        self.release = threading.Event()
+
+    def make_store(self, **options):
+        def handler(payload):
+            if payload == 'block':
+                self.release.wait(5)
+            if payload == 'fail':
+                raise ValueError('无法识别')
+            return {'payload': payload}
+        store = ClassificationJobStore(handler, **options)
+        # 先放行被阻塞的任务，再等待后台线程退出
+        self.addCleanup(store.close)
+        self.addCleanup(self.release.set)
+        return store
+
+    def wait_status(self, store, job_id, status, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = store.get(job_id)
+            if job and job['status'] == status:
+                return job
+            time.sleep(0.005)
+        self.fail(f'任务没有变为 {status}')
+
+    def test_queue_position(self):
+        """排队中的任务按提交顺序报告前面的任务数，执行中和已完成的任务没有排队位置"""
+        store = self.make_store(num_workers=1)
+        running = store.submit('block')
+        self.wait_status(store, running, 'running')
+        first, second = store.submit('a'), store.submit('b')
+
+        self.assertIsNone(store.queue_position(running))
+        self.assertEqual((store.queue_position(first), store.queue_position(second)), (0, 1))
+        self.assertEqual(store.get_stats()['queue_depth'], 2)
+
+        self.release.set()
+        job = store.wait(second, 5)
+        self.assertEqual((job['status'], job['result']), ('done', {'payload': 'b'}))
+        self.assertIsNone(store.queue_position(second))
+        self.assertIsNone(store.queue_position('missing'))
+
+    def test_failed_job(self):
+        """handler 抛出异常时任务记为 failed 并保存错误信息"""
+        store = self.make_store()
+        job = store.wait(store.submit('fail'), 5)
+        self.assertEqual((job['status'], job['error'], job['result']), ('failed', '无法识别', None))
+        self.assertEqual(store.get_stats()['failed'], 1)
+
+    def test_ttl_expiry(self):
+        """任务完成超过 ttl 秒后过期，未完成的任务不会过期"""
+        store = self.make_store(num_workers=1, ttl=0.05)
+        done = store.submit('a')
+        store.wait(done, 5)
+        blocked = store.submit('block')
+        self.wait_status(store, blocked, 'running')
+        time.sleep(0.1)
+
+        self.assertIsNone(store.get(done))
+        self.assertIsNone(store.wait(done, 1))
+        self.assertEqual(store.get(blocked)['status'], 'running')
+        self.assertEqual(store.get_stats()['expired'], 1)
+
+    def test_evict_finished_when_full(self):
+        """任务表已满时淘汰最早完成的任务；全是未完成的任务时拒绝提交"""
+        store = self.make_store(num_workers=1, max_jobs=2, ttl=0)
+        first, second = store.submit('a'), store.submit('b')
+        store.wait(second, 5)
+        third = store.submit('c')
+        store.wait(third, 5)
+
+        self.assertIsNone(store.get(first))
+        self.assertEqual(store.get(second)['status'], 'done')
+        self.assertEqual(store.get_stats()['stored_jobs'], 2)
+
+        # 再提交两个任务，依次淘汰 second、third
+        running = store.submit('block')
+        self.wait_status(store, running, 'running')
+        store.submit('d')
+        with self.assertRaises(queue.Full):
+            store.submit('e')
+        stats = store.get_stats()
+        self.assertEqual((stats['rejected'], stats['expired'], stats['stored_jobs']), (1, 3, 2))
+
+    def test_queue_full(self):
+        """等待队列已满时拒绝提交，被拒绝的任务不会留在任务表中"""
+        store = self.make_store(num_workers=1, max_queue=1)
+        running = store.submit('block')
+        self.wait_status(store, running, 'running')
+        store.submit('a')
+        with self.assertRaises(queue.Full):
+            store.submit('b')
+        self.assertEqual(store.get_stats()['stored_jobs'], 2)
+
+
+class ClassifyJobRouteTest(unittest.TestCase):
+    """查询异步识别任务接口"""
+
+    def test_timestamps_are_utc(self):
+        """created_at、finished_at 与其他接口一样使用 UTC 时间"""
+        import ai_service
+        import routes  # noqa: F401  注册路由
+        from app import app
+
+        store = ClassificationJobStore(lambda payload: {'dish_name': 'fried rice'})
+        self.addCleanup(store.close)
+        previous, ai_service._job_store = ai_service._job_store, store
+        self.addCleanup(setattr, ai_service, '_job_store', previous)
+
+        job_id = store.submit(b'image')
+        job = store.wait(job_id, 5)
+        response = app.test_client().get(f'/api/classify-dish/jobs/{job_id}')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()['data']
+        self.assertEqual(data['created_at'], datetime.utcfromtimestamp(job['created_at']).isoformat())
+        self.assertEqual(data['finished_at'], datetime.utcfromtimestamp(job['finished_at']).isoformat())
+        self.assertEqual(data['result'], {'dish_name': 'fried rice'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模型热更新安全测试
+热更新接口只接受模型目录中的权重文件（拒绝目录外的绝对路径、.. 和指向目录外的符号链接），
+权重文件按 weights_only 加载，包含任意 Python 对象的文件会被拒绝。需要安装 PyTorch，使用内存数据库：
+    python test/test_model_reload.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+
+class _Payload:
+    """反序列化时会执行代码的对象"""
+
+    def __reduce__(self):
+        return os.system, ('true',)
+
+
+@unittest.skipIf(torch is None, '未安装PyTorch')
+class ModelReloadTest(unittest.TestCase):
+    """模型目录限制与 weights_only 加载"""
+
+    def setUp(self):
+        from resnet_classifier import resnet_predict
+
+        self.model_dir = tempfile.mkdtemp()
+        self.outside_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.model_dir)
+        self.addCleanup(shutil.rmtree, self.outside_dir)
+        for name, value in (('MODEL_PATH', os.path.join(self.model_dir, 'model.pth')),
+                            ('MODEL_DIRS', (self.model_dir,))):
+            self.addCleanup(setattr, resnet_predict, name, getattr(resnet_predict, name))
+            setattr(resnet_predict, name, value)
+
+        self.inside = os.path.join(self.model_dir, 'new.pth')
+        self.outside = os.path.join(self.outside_dir, 'evil.pth')
+        torch.save({'weight': torch.zeros(1)}, self.inside)
+        torch.save(_Payload(), self.outside)
+
+    def test_resolve_model_path(self):
+        """只接受模型目录中存在的文件，相对路径按模型目录解析"""
+        from ai_service import resolve_model_path
+
+        self.assertEqual(resolve_model_path('new.pth'), os.path.realpath(self.inside))
+        self.assertEqual(resolve_model_path(self.inside), os.path.realpath(self.inside))
+        self.assertIsNone(resolve_model_path('missing.pth'))
+        self.assertIsNone(resolve_model_path(self.outside))
+        self.assertIsNone(resolve_model_path(os.path.join('..', os.path.basename(self.outside_dir), 'evil.pth')))
+
+        link = os.path.join(self.model_dir, 'link.pth')
+        os.symlink(self.outside, link)
+        self.assertIsNone(resolve_model_path('link.pth'))
+
+    def test_reload_route_rejects_outside_path(self):
+        """接口拒绝模型目录外的文件，不会开始加载"""
+        from flask_jwt_extended import create_access_token
+
+        import admin_routes  # noqa: F401  注册路由
+        from app import app, db
+        from models import User
+
+        with app.app_context():
+            db.create_all()
+            self.addCleanup(self.drop_tables, app, db)
+            admin = User(username='admin', nickname='管理员', password_hash='x', role='admin')
+            db.session.add(admin)
+            db.session.commit()
+            headers = {'Authorization': f'Bearer {create_access_token(identity=str(admin.user_id))}'}
+
+            client = app.test_client()
+            for model_path in (self.outside, '../evil.pth', 'model.txt'):
+                response = client.post('/api/admin/ai/model/reload', json={'model_path': model_path}, headers=headers)
+                self.assertEqual(response.status_code, 400, model_path)
+            self.assertNotEqual(client.get('/api/admin/ai/model', headers=headers).get_json()['data']['reload']['status'],
+                                'loading')
+
+    @staticmethod
+    def drop_tables(app, db):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_weights_only_load(self):
+        """包含 Python 对象的权重文件加载失败，不会执行其中的代码"""
+        from resnet_classifier.resnet_predict import load_model
+
+        with self.assertRaises(Exception) as caught:
+            load_model(self.outside, device=torch.device('cpu'))
+        self.assertIn('weights_only', str(caught.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列表接口查询次数测试
+食堂列表、食堂详情、窗口详情和菜品列表的评分汇总、评价数和子项数按整页批量查询，
+查询次数不随食堂/窗口/菜品数量增加；菜品评价列表读取评价中的回复数和回复预览，查询次数不随回复数增加。使用内存数据库和 Flask 测试客户端，不需要启动服务：
+    python test/test_query_counts.py
+"""
+
+import os
+import sys
+import unittest
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+
+from app import app, db
+import routes  # noqa: F401  注册路由
+from models import User, Canteen, Window, Dish, Review, ReviewReply
+from rating_aggregates import rebuild_rating_stats
+from review_counters import reconcile_review_counts
+
+
+class QueryCountTest(unittest.TestCase):
+    """同一接口在数据量不同时的SQL查询次数应相同"""
+
+    REVIEWERS = 3
+
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        cls.client = app.test_client()
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+        self.users = []
+        for i in range(self.REVIEWERS):
+            user = User(username=f'reviewer{i}', nickname=f'评价者{i}', password_hash='x')
+            db.session.add(user)
+            self.users.append(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def seed(self, canteens=1, windows=1, dishes=1, canteen=None):
+        """创建食堂、窗口和菜品，每个菜品有 REVIEWERS 条评价，返回最后一个食堂"""
+        for c in range(canteens):
+            if canteen is None or c > 0:
+                canteen = Canteen(name=f'食堂{Canteen.query.count()}', location='校园')
+                db.session.add(canteen)
+                db.session.flush()
+            for w in range(windows):
+                window = Window(canteen_id=canteen.canteen_id, name=f'窗口{w}-{Window.query.count()}')
+                db.session.add(window)
+                db.session.flush()
+                for d in range(dishes):
+                    dish = Dish(window_id=window.window_id, name=f'菜品{d}', price=10, category='主食')
+                    db.session.add(dish)
+                    db.session.flush()
+                    for i, user in enumerate(self.users):
+                        db.session.add(Review(user_id=user.user_id, dish_id=dish.dish_id,
+                                              overall_rating=(d + i) % 5 + 1, taste_rating=4))
+        db.session.commit()
+        return canteen
+
+    def count_queries(self, url):
+        """请求一次接口，返回 (响应数据, SQL查询次数)"""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = self.client.get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(response.status_code, 200, response.get_json())
+        return response.get_json()['data'], len(statements)
+
+    def assert_constant(self, url, grow, rebuild=True):
+        """数据量增加前后查询次数相同；rebuild=False 时汇总表为空，走按评价表计算的分支"""
+        if rebuild:
+            rebuild_rating_stats()
+        _, small = self.count_queries(url)
+        grow()
+        if rebuild:
+            rebuild_rating_stats()
+        data, large = self.count_queries(url)
+        self.assertEqual(small, large)
+        return data
+
+    def test_canteen_list(self):
+        self.seed(canteens=1, windows=1, dishes=1)
+        data = self.assert_constant('/api/canteens', lambda: self.seed(canteens=8, windows=3, dishes=2))
+        self.assertEqual(len(data), 9)
+        last = data[-1]
+        self.assertEqual(last['window_count'], 3)
+        self.assertEqual(last['review_count'], 3 * 2 * self.REVIEWERS)
+        canteen = db.session.get(Canteen, last['id'])
+        self.assertEqual(last['average_rating'], canteen.get_average_rating())
+
+    def test_canteen_detail(self):
+        canteen = self.seed(windows=1, dishes=1)
+        url = f'/api/canteens/{canteen.canteen_id}'
+        data = self.assert_constant(url, lambda: self.seed(windows=10, dishes=3, canteen=canteen))
+        self.assertEqual(len(data['windows']), 11)
+        self.assertEqual(data['review_count'], (1 + 10 * 3) * self.REVIEWERS)
+        self.assertEqual(data['windows'][-1]['dish_count'], 3)
+        self.assertEqual(data['windows'][-1]['review_count'], 3 * self.REVIEWERS)
+
+    def test_window_detail(self):
+        self.seed(windows=1, dishes=2)
+        window = Window.query.first()
+
+        def grow():
+            for d in range(30):
+                dish = Dish(window_id=window.window_id, name=f'新菜品{d}', price=8)
+                db.session.add(dish)
+                db.session.flush()
+                db.session.add(Review(user_id=self.users[0].user_id, dish_id=dish.dish_id, overall_rating=5))
+            db.session.commit()
+
+        data = self.assert_constant(f'/api/windows/{window.window_id}', grow)
+        self.assertEqual(len(data['dishes']), 32)
+        self.assertEqual(data['review_count'], 2 * self.REVIEWERS + 30)
+        self.assertEqual(data['dishes'][-1]['average_rating'], 5.0)
+
+    def test_dish_list_page_size(self):
+        self.seed(canteens=3, windows=4, dishes=5)
+        rebuild_rating_stats()
+        _, small = self.count_queries('/api/dishes?per_page=5')
+        data, large = self.count_queries('/api/dishes?per_page=50')
+        self.assertEqual(small, large)
+        self.assertEqual(len(data['dishes']), 50)
+        for item in data['dishes']:
+            dish = db.session.get(Dish, item['id'])
+            self.assertEqual(item['review_count'], self.REVIEWERS)
+            self.assertEqual(item['average_rating'], dish.get_average_rating())
+            self.assertEqual(item['window']['canteen_name'], dish.window.canteen.name)
+
+    def test_without_stats_rows(self):
+        """汇总表尚未重建（历史数据）时仍按评价表批量计算，查询次数同样不变"""
+        self.seed(canteens=1, windows=1, dishes=1)
+        data = self.assert_constant('/api/canteens', lambda: self.seed(canteens=5, windows=2, dishes=2),
+                                    rebuild=False)
+        self.assertEqual(data[-1]['review_count'], 2 * 2 * self.REVIEWERS)
+        _, small = self.count_queries('/api/dishes?per_page=5')
+        _, large = self.count_queries('/api/dishes?per_page=50')
+        self.assertEqual(small, large)
+
+    def test_dish_reviews_replies(self):
+        """回复数和最新回复预览读取评价中的计数列，不随回复数增加查询"""
+        self.seed(windows=1, dishes=1)
+        dish = Dish.query.first()
+        url = f'/api/dishes/{dish.dish_id}/reviews'
+        db.session.expire_all()  # 与 grow() 提交后一样，请求时重新加载菜品
+
+        def grow():
+            for review in Review.query.filter_by(dish_id=dish.dish_id).all():
+                for i in range(20):
+                    db.session.add(ReviewReply(review_id=review.review_id, user_id=self.users[i % 3].user_id,
+                                               content=f'回复{i}'))
+            db.session.commit()
+            self.assertEqual(len(reconcile_review_counts()), 2 * self.REVIEWERS)
+
+        data = self.assert_constant(url, grow, rebuild=False)
+        size = app.config.get('REVIEW_REPLY_PREVIEW_SIZE', 3)
+        for item in data['reviews']:
+            self.assertEqual(item['reply_count'], 20)
+            self.assertEqual([reply['content'] for reply in item['latest_replies']],
+                             [f'回复{i}' for i in range(20 - size, 20)])
+        self.assertEqual(reconcile_review_counts(fix=False), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+评分汇总维护测试
+通过接口新增、修改、删除评价，点赞、回复，以及管理员换窗口、删除评价、用户和菜品后，
+菜品/窗口/食堂评分汇总、评分分桶应与评价表一致，评价的点赞数、回复数和回复预览应与点赞表、回复表一致。
+使用内存数据库和 Flask 测试客户端，不需要启动服务：
+    python test/test_rating_maintenance.py
+"""
+
+import os
+import sys
+import unittest
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+
+from app import app, db
+import routes  # noqa: F401  注册路由
+import admin_routes  # noqa: F401
+import leaderboards
+from leaderboards import Leaderboards
+from models import User, Canteen, Window, Dish, Review, DishRatingBucket
+from rating_aggregates import check_rating_stats, create_stats
+from rating_stats import snapshot_delta, upsert_stats
+from rating_trends import check_rating_buckets, _bucket_keys, _compute_bucket
+from review_counters import reconcile_review_counts
+
+RATINGS = ('overallRating', 'tasteRating', 'portionRating', 'valueRating', 'serviceRating')
+
+
+class RatingTestCase(unittest.TestCase):
+    """测试数据：管理员、3个用户、1个食堂、2个窗口，窗口0中有3个菜品"""
+
+    @classmethod
+    def setUpClass(cls):
+        app.config['TESTING'] = True
+        app.config['CLASSIFIER_EMBEDDINGS'] = False  # 删除菜品时不写特征索引文件
+        cls.client = app.test_client()
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+        self.admin = User(username='admin', nickname='管理员', password_hash='x', role='admin')
+        db.session.add(self.admin)
+        self.users = [User(username=f'user{i}', nickname=f'用户{i}', password_hash='x') for i in range(3)]
+        db.session.add_all(self.users)
+        db.session.flush()
+
+        canteen = Canteen(name='一食堂', location='校园')
+        db.session.add(canteen)
+        db.session.flush()
+        create_stats('canteen', canteen.canteen_id)
+        self.windows = []
+        for w in range(2):
+            window = Window(canteen_id=canteen.canteen_id, name=f'窗口{w}')
+            db.session.add(window)
+            db.session.flush()
+            create_stats('window', window.window_id)
+            self.windows.append(window)
+        self.dishes = []
+        for d in range(3):
+            dish = Dish(window_id=self.windows[0].window_id, name=f'菜品{d}', price=10, category='主食')
+            db.session.add(dish)
+            db.session.flush()
+            create_stats('dish', dish.dish_id)
+            self.dishes.append(dish)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        self.ctx.pop()
+
+    def headers(self, user):
+        return {'Authorization': f'Bearer {create_access_token(identity=str(user.user_id))}'}
+
+    def post_review(self, user, dish, overall=4):
+        ratings = dict.fromkeys(RATINGS, 3)
+        ratings['overallRating'] = overall
+        response = self.client.post(f'/api/dishes/{dish.dish_id}/reviews', json=ratings, headers=self.headers(user))
+        self.assertEqual(response.status_code, 201, response.get_json())
+        return response.get_json()['data']['id']
+
+    def request(self, method, url, user, json=None):
+        response = self.client.open(url, method=method, json=json, headers=self.headers(user))
+        self.assertEqual(response.status_code, 200, response.get_json())
+        return response.get_json()
+
+    def assert_consistent(self):
+        db.session.expire_all()
+        self.assertEqual(check_rating_stats(), [])
+        self.assertEqual(check_rating_buckets(), [])
+        self.assertEqual(reconcile_review_counts(fix=False), [])
+
+    def get_buckets(self, dish):
+        db.session.expire_all()
+        return {(bucket.granularity, bucket.bucket_start): bucket
+                for bucket in DishRatingBucket.query.filter_by(dish_id=dish.dish_id).all()}
+
+
+class RatingMaintenanceTest(RatingTestCase):
+    """接口操作后各汇总表与评价表一致"""
+
+    def test_first_review_in_bucket(self):
+        """菜品在某一天/小时的第一条评价插入新分桶，之后的评价累加到已有分桶"""
+        dish = self.dishes[0]
+        self.assertEqual(self.get_buckets(dish), {})
+
+        review_id = self.post_review(self.users[0], dish, overall=5)
+        buckets = self.get_buckets(dish)
+        review = db.session.get(Review, review_id)
+        self.assertEqual(set(buckets), set(_bucket_keys(review.created_at)))
+        for bucket in buckets.values():
+            self.assertEqual((bucket.overall_count, bucket.overall_sum, bucket.rating_5), (1, 5, 1))
+        self.assert_consistent()
+
+        self.post_review(self.users[1], dish, overall=3)
+        for bucket in self.get_buckets(dish).values():
+            self.assertEqual((bucket.overall_count, bucket.overall_sum), (2, 8))
+        self.assert_consistent()
+
+    def test_review_lifecycle(self):
+        """评价、点赞、回复的增删改及管理员操作后，每一步各汇总和计数都与明细表一致"""
+        first, second = self.dishes[0], self.dishes[1]
+        reviews = {}
+        for index, user in enumerate(self.users):
+            reviews[index, 0] = self.post_review(user, first, overall=index + 2)
+            reviews[index, 1] = self.post_review(user, second, overall=5 - index)
+        self.assert_consistent()
+
+        self.request('POST', f'/api/reviews/{reviews[0, 0]}/like', self.users[1])
+        self.request('POST', f'/api/reviews/{reviews[0, 0]}/like', self.users[2])
+        self.request('POST', f'/api/reviews/{reviews[0, 0]}/like', self.users[2])  # 取消点赞
+        self.request('POST', f'/api/reviews/{reviews[2, 1]}/like', self.users[1])
+        response = self.client.post(f'/api/reviews/{reviews[0, 0]}/replies', json={'content': '同意'},
+                                    headers=self.headers(self.users[1]))
+        self.assertEqual(response.status_code, 201, response.get_json())
+        self.assert_consistent()
+
+        # 修改、删除自己的评价
+        self.request('PUT', f'/api/reviews/{reviews[1, 0]}', self.users[1], {'overallRating': 1, 'tasteRating': 5})
+        self.assert_consistent()
+        self.request('DELETE', f'/api/reviews/{reviews[2, 0]}', self.users[2])
+        self.assert_consistent()
+
+        # 菜品换窗口，汇总从旧窗口移到新窗口
+        self.request('PUT', f'/api/admin/dishes/{first.dish_id}', self.admin, {'window_id': self.windows[1].window_id})
+        self.assert_consistent()
+
+        # 管理员删除评价、用户（连同其评价、回复和点赞）和菜品（连同其评价）
+        self.request('DELETE', f'/api/admin/reviews/{reviews[0, 1]}', self.admin)
+        self.assert_consistent()
+        self.request('DELETE', f'/api/admin/users/{self.users[1].user_id}', self.admin)
+        self.assert_consistent()
+        self.request('DELETE', f'/api/admin/dishes/{second.dish_id}', self.admin)
+        self.assert_consistent()
+        self.assertEqual(Review.query.count(), 1)
+
+    def test_concurrent_bucket_insert(self):
+        """并发事务已插入同一分桶时，后插入的一方只累加本次增量，不重复计入对方的评价"""
+        dish = self.dishes[0]
+        self.post_review(self.users[0], dish, overall=5)
+
+        # 模拟另一条评价的事务：UPDATE 时分桶还不存在，计算分桶时对方已提交
+        review = Review(user_id=self.users[1].user_id, dish_id=dish.dish_id, overall_rating=2)
+        db.session.add(review)
+        db.session.flush()
+        delta = snapshot_delta((2, None, None, None, None))
+        for granularity, bucket_start in _bucket_keys(review.created_at):
+            upsert_stats(DishRatingBucket,
+                         {'dish_id': dish.dish_id, 'granularity': granularity, 'bucket_start': bucket_start},
+                         _compute_bucket(dish.dish_id, granularity, bucket_start), delta)
+        db.session.commit()
+
+        for bucket in self.get_buckets(dish).values():
+            self.assertEqual((bucket.overall_count, bucket.overall_sum, bucket.rating_2, bucket.rating_5),
+                             (2, 7, 1, 1))
+        self.assertEqual(check_rating_buckets(), [])
+
+
+class LeaderboardTest(RatingTestCase):
+    """排行榜的增量更新与全量计算"""
+
+    def setUp(self):
+        super().setUp()
+        leaderboards._leaderboards = None
+
+    def tearDown(self):
+        leaderboards._leaderboards = None
+        super().tearDown()
+
+    def volume_board(self, boards):
+        return {item['dish_id']: item['review_count'] for item in boards.get_page('global', None, 'volume', 0, 10)[1]}
+
+    def test_review_during_rebuild(self):
+        """全量计算读取数据库之后、替换快照之前提交的评价不会丢失"""
+        dish = self.dishes[0]
+        self.post_review(self.users[0], dish)
+        test = self
+
+        class RacingLeaderboards(Leaderboards):
+            def _compute(self):
+                result = super()._compute()
+                test.post_review(test.users[1], dish)
+                return result
+
+        leaderboards._leaderboards = boards = RacingLeaderboards()
+        boards.rebuild()
+        self.assertFalse(boards.stale)
+        self.assertEqual(self.volume_board(boards), {dish.dish_id: 2})
+
+    def test_other_process_converges(self):
+        """其他进程的排行榜不会收到本进程的增量，超过间隔后全量计算时看到新评价"""
+        other = Leaderboards()
+        other.rebuild()
+        leaderboards._leaderboards = boards = Leaderboards()
+        boards.rebuild()
+
+        self.post_review(self.users[0], self.dishes[1])
+        self.assertEqual(self.volume_board(boards), {self.dishes[1].dish_id: 1})
+        self.assertEqual(self.volume_board(other), {})
+        other.rebuild()
+        self.assertEqual(self.volume_board(other), {self.dishes[1].dish_id: 1})
+
+    def test_zero_prior_weight(self):
+        """先验权重为 0 时按普通平均分排序，没有评价的菜品分数为 0 而不是 NaN"""
+        self.post_review(self.users[0], self.dishes[0], overall=3)
+        leaderboards._leaderboards = boards = Leaderboards(prior_weight=0)
+        boards.rebuild()
+        self.assertEqual(boards._dishes[self.dishes[1].dish_id]['score'], 0.0)
+
+        self.post_review(self.users[1], self.dishes[1], overall=5)
+        self.assertFalse(boards.stale)
+        items = boards.get_page('global', None, 'score', 0, 10)[1]
+        self.assertEqual([(item['dish_id'], item['score']) for item in items],
+                         [(self.dishes[1].dish_id, 5.0), (self.dishes[0].dish_id, 3.0)])
+
+    def test_apply_failure_after_commit(self):
+        """提交后增量更新失败时评价照常保存并返回成功，排行榜标记为过期，下次读取时全量计算"""
+        leaderboards._leaderboards = boards = Leaderboards()
+        boards.rebuild()
+
+        def fail(dish_ids):
+            raise RuntimeError('database is locked')
+        boards._apply_stats = fail
+        self.post_review(self.users[0], self.dishes[0])
+        self.assertTrue(boards.stale)
+
+        del boards._apply_stats
+        self.assertEqual(self.volume_board(leaderboards.get_leaderboards()), {self.dishes[0].dish_id: 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
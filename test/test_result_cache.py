@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+识别结果缓存测试
+条目过期、模型版本变化时清空、按字节哈希精确命中和按感知哈希匹配近似重复的图片
+（汉明距离阈值内命中最接近的条目，跨越分段边界的差异同样命中，淘汰和过期的条目不再命中）。
+不需要模型和数据库：
+    python test/test_result_cache.py
+"""
+
+import io
+import os
+import random
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+from resnet_classifier.result_cache import ClassificationCache, bytes_digest, hamming_distance, perceptual_hash
+
+
+def flip(value, *bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+class ClassificationCacheTest(unittest.TestCase):
+    """识别结果缓存的命中、失效与淘汰"""
+
+    PHASH = 0x9f3a_c4e1_5b72_08d6
+
+    def test_near_duplicate_hits(self):
+        """汉明距离不超过阈值时命中，超过阈值时未命中"""
+        cache = ClassificationCache(max_distance=4)
+        cache.put(self.PHASH, {'name': 'fried rice'})
+
+        self.assertEqual(cache.get(self.PHASH), {'name': 'fried rice'})
+        # 分散在不同分段中的差异位，以及集中在同一分段中的差异位
+        for bits in ((0, 13, 26, 39), (60, 61, 62, 63), (12, 13)):
+            self.assertEqual(cache.get(flip(self.PHASH, *bits)), {'name': 'fried rice'}, bits)
+        self.assertIsNone(cache.get(flip(self.PHASH, 0, 13, 26, 39, 52)))
+        stats = cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (4, 1))
+
+    def test_nearest_entry_wins(self):
+        """阈值内有多个条目时返回距离最近的条目，命中后记住这次上传的字节哈希"""
+        cache = ClassificationCache(max_distance=4)
+        cache.put(flip(self.PHASH, 1, 2, 3), {'name': 'far'})
+        cache.put(flip(self.PHASH, 40), {'name': 'near'})
+        self.assertEqual(cache.get(self.PHASH, digest='upload'), {'name': 'near'})
+        self.assertEqual(cache.get_by_digest('upload'), {'name': 'near'})
+        self.assertEqual(cache.get_stats()['exact_hits'], 1)
+
+    def test_exact_only_without_distance(self):
+        """max_distance 为 0 时只精确匹配感知哈希"""
+        cache = ClassificationCache(max_distance=0)
+        cache.put(self.PHASH, {'name': 'fried rice'}, digest='a')
+        self.assertIsNone(cache.get(flip(self.PHASH, 5)))
+        self.assertEqual(cache.get(self.PHASH), {'name': 'fried rice'})
+        self.assertEqual(cache.get_by_digest('a'), {'name': 'fried rice'})
+
+    def test_ttl(self):
+        """条目超过 ttl 秒后失效，字节哈希和近似匹配都不再命中"""
+        cache = ClassificationCache(ttl=0.05)
+        cache.put(self.PHASH, {'name': 'fried rice'}, digest='a')
+        time.sleep(0.1)
+        self.assertIsNone(cache.get_by_digest('a'))
+        self.assertIsNone(cache.get(flip(self.PHASH, 7)))
+        self.assertIsNone(cache.get(self.PHASH))
+        self.assertEqual(cache.get_stats()['size'], 0)
+
+    def test_model_version_invalidation(self):
+        """模型版本变化时清空全部缓存，版本不变时保留"""
+        cache = ClassificationCache()
+        cache.check_model_version('v1')
+        cache.put(self.PHASH, {'name': 'fried rice'}, digest='a')
+        cache.check_model_version('v1')
+        self.assertEqual(cache.get_by_digest('a'), {'name': 'fried rice'})
+
+        cache.check_model_version('v2')
+        self.assertIsNone(cache.get_by_digest('a'))
+        self.assertIsNone(cache.get(flip(self.PHASH, 3)))
+        self.assertEqual(cache.get_stats()['model_version'], 'v2')
+
+    def test_eviction(self):
+        """超出容量时淘汰最久未使用的条目，被淘汰的条目不再近似命中"""
+        cache = ClassificationCache(max_size=2)
+        first, second, third = self.PHASH, flip(self.PHASH, *range(0, 64, 4)), flip(self.PHASH, *range(1, 64, 4))
+        cache.put(first, {'name': 'first'}, digest='a')
+        cache.put(second, {'name': 'second'})
+        cache.get(first)
+        cache.put(third, {'name': 'third'})
+
+        self.assertIsNone(cache.get(flip(second, 9)))
+        self.assertEqual(cache.get(flip(first, 9)), {'name': 'first'})
+        self.assertEqual(cache.get_by_digest('a'), {'name': 'first'})
+        self.assertEqual(cache.get_stats()['size'], 2)
+
+    def test_matches_linear_scan(self):
+        """分段索引的查找结果与逐个比较全部条目一致"""
+        rng = random.Random(0)
+        cache = ClassificationCache(max_size=10000, max_distance=6)
+        keys = [rng.getrandbits(64) for _ in range(500)]
+        for key in keys:
+            cache.put(key, key)
+        for _ in range(300):
+            query = flip(rng.choice(keys), *rng.sample(range(64), rng.randint(1, 8)))
+            expected = min(((hamming_distance(query, key), key) for key in keys), default=None)
+            expected = expected[1] if expected[0] <= 6 else None
+            self.assertEqual(cache.get(query), expected)
+
+    def test_recompressed_photo(self):
+        """同一张照片重新压缩、缩放后感知哈希仍在默认阈值内，字节哈希不同"""
+        img = Image.new('RGB', (320, 240), (200, 180, 150))
+        draw = ImageDraw.Draw(img)
+        draw.ellipse((60, 40, 260, 200), fill=(150, 90, 40))
+        draw.rectangle((120, 100, 200, 140), fill=(60, 140, 60))
+
+        original, recompressed = io.BytesIO(), io.BytesIO()
+        img.save(original, format='JPEG', quality=95)
+        img.resize((300, 225)).save(recompressed, format='JPEG', quality=60)
+        images = [Image.open(io.BytesIO(data.getvalue())) for data in (original, recompressed)]
+
+        cache = ClassificationCache()
+        cache.put(perceptual_hash(images[0]), {'name': 'curry'}, digest=bytes_digest(original.getvalue()))
+        self.assertIsNone(cache.get_by_digest(bytes_digest(recompressed.getvalue())))
+        self.assertEqual(cache.get(perceptual_hash(images[1])), {'name': 'curry'})
+
+
+if __name__ == '__main__':
+    unittest.main()
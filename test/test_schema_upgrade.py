@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+已有数据库升级测试
+旧版本的 reviews 表没有 reply_count、latest_replies 列，也不维护 likes；升级后应补齐列并按明细表回填。
+使用内存数据库，不需要启动服务：
+    python test/test_schema_upgrade.py
+"""
+
+import os
+import sys
+import unittest
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import inspect, text
+
+from app import app, db
+from models import User, Review, SchemaUpgrade
+from review_counters import reconcile_review_counts
+from schema_upgrade import UPGRADE_STEPS, upgrade_schema
+
+
+class SchemaUpgradeTest(unittest.TestCase):
+    """旧版本数据库升级"""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.drop_all()
+        db.create_all()
+        # 还原为旧版本的表结构和数据
+        SchemaUpgrade.__table__.drop(db.engine)
+        db.session.execute(text('ALTER TABLE reviews DROP COLUMN reply_count'))
+        db.session.execute(text('ALTER TABLE reviews DROP COLUMN latest_replies'))
+        db.session.add_all([User(user_id=i, username=f'user{i}', nickname=f'用户{i}', password_hash='x')
+                            for i in (1, 2)])
+        db.session.execute(text("INSERT INTO reviews (review_id, user_id, dish_id, overall_rating, likes) "
+                                "VALUES (1, 1, 1, 5, 0), (2, 2, 1, 4, NULL)"))
+        db.session.execute(text("INSERT INTO likes (user_id, review_id) VALUES (1, 1), (2, 1), (1, 2)"))
+        db.session.execute(text("INSERT INTO review_replies (user_id, review_id, content, created_at) "
+                                "VALUES (2, 1, '同意', '2024-01-01 10:00:00')"))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_upgrade_existing_database(self):
+        """添加缺少的列并回填点赞数、回复数和回复预览"""
+        done = upgrade_schema()
+        self.assertEqual(done, [description for _, description, _ in UPGRADE_STEPS])
+        columns = {column['name'] for column in inspect(db.engine).get_columns('reviews')}
+        self.assertTrue({'reply_count', 'latest_replies'} <= columns)
+
+        first, second = db.session.get(Review, 1), db.session.get(Review, 2)
+        self.assertEqual((first.likes, first.reply_count), (2, 1))
+        self.assertEqual([reply['content'] for reply in first.latest_replies], ['同意'])
+        self.assertEqual((second.likes, second.reply_count, second.latest_replies), (1, 0, []))
+        self.assertEqual(reconcile_review_counts(fix=False), [])
+
+        # 已执行的步骤不会重复执行
+        self.assertEqual(upgrade_schema(), [])
+        self.assertEqual(SchemaUpgrade.query.count(), len(UPGRADE_STEPS))
+
+
+if __name__ == '__main__':
+    unittest.main()
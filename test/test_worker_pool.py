@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推理进程池测试
+父进程已经用多个线程执行过推理（启动预热）后，每个子进程多线程推理仍能正常返回结果；
+子进程被杀掉或卡住后自动重启。需要安装 PyTorch，model.pth 不可用时使用随机权重：
+    python test/test_worker_pool.py
+"""
+
+import os
+import signal
+import sys
+import time
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TEST_DIR))
+sys.path.insert(0, TEST_DIR)
+
+try:
+    import torch  # noqa: F401
+except ImportError:
+    torch = None
+
+from PIL import Image
+
+
+@unittest.skipIf(torch is None, '未安装PyTorch')
+class InferenceWorkerPoolTest(unittest.TestCase):
+    """spawn 启动的推理子进程"""
+
+    @classmethod
+    def setUpClass(cls):
+        from benchmark_classifier import prepare_model_path
+        from resnet_classifier.resnet_predict import DishClassifier
+
+        cls.model_path = prepare_model_path()
+        cls.image = Image.new('RGB', (320, 240), (150, 100, 60))
+        # 与启动预热相同：父进程先用多个线程跑一次推理，初始化 OpenMP 线程池
+        cls.classifier = DishClassifier(model_path=cls.model_path, num_threads=4)
+        cls.expected = cls.classifier.predict(cls.image)
+
+    @classmethod
+    def tearDownClass(cls):
+        from benchmark_classifier import cleanup_model_path
+        cleanup_model_path(cls.model_path)
+
+    def make_pool(self, **options):
+        from resnet_classifier.worker_pool import InferenceWorkerPool
+        pool = InferenceWorkerPool(self.classifier, num_workers=1, **options)
+        self.addCleanup(pool.close)
+        return pool
+
+    def wait_restarted(self, pool, restarts=1, timeout=120):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            stats = pool.get_stats()
+            if stats['restart_count'] >= restarts and all(worker['ready'] for worker in stats['workers']):
+                return
+            time.sleep(0.2)
+        self.fail('推理子进程没有重启')
+
+    def test_multithreaded_worker_after_parent_inference(self):
+        """每个子进程多个 PyTorch 线程时也能返回结果"""
+        pool = self.make_pool(threads_per_worker=2, timeout=20)
+        result = pool.predict(self.image)
+        self.assertNotIn('error', result)
+        self.assertEqual(result['name'], self.expected['name'])
+        self.assertAlmostEqual(result['confidence'], self.expected['confidence'], places=4)
+
+    def test_restart_killed_worker(self):
+        """子进程被杀掉后自动重启，之后的请求正常返回"""
+        pool = self.make_pool(threads_per_worker=2, timeout=20)
+        os.kill(pool.get_stats()['workers'][0]['pid'], signal.SIGKILL)
+        self.wait_restarted(pool)
+        self.assertNotIn('error', pool.predict(self.image))
+
+    @unittest.skipUnless(hasattr(signal, 'SIGSTOP'), '需要 SIGSTOP')
+    def test_restart_stuck_worker(self):
+        """请求超时且子进程在超时期间没有任何响应时，终止并重启该子进程"""
+        pool = self.make_pool(timeout=2)
+        os.kill(pool.get_stats()['workers'][0]['pid'], signal.SIGSTOP)
+        self.assertIn('超时', pool.predict(self.image)['error'])
+        self.wait_restarted(pool)
+        self.assertNotIn('error', pool.predict(self.image))
+
+
+if __name__ == '__main__':
+    unittest.main()